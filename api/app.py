@@ -1,8 +1,33 @@
+from contextlib import asynccontextmanager
+
 from fastapi import Depends, FastAPI, HTTPException, Security
+from fastapi.responses import PlainTextResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
-from api.routes import router
-from core.config import API_AUTH_ENABLED, API_PASS, API_USER
+from api.metrics import MetricsCollector
+from api.routes import router, service
+from core.config import (
+    API_AUTH_ENABLED,
+    API_PASS,
+    API_USER,
+    GATEWAY_PORT,
+    HEALTH_CHECK_INTERVAL,
+    OPENVPN_MANAGEMENT,
+    POOL_TARGETS,
+    PROXY_MODE,
+    QUOTA_CHECK_INTERVAL,
+    RECONCILE_ON_START,
+    SUPERVISE,
+    USERS_RELOAD_INTERVAL,
+)
+from core.supervisor import Supervisor
+from core.users import UserWatcher
+from proxy.forwarder import ForwardingEngine
+from proxy.gateway import GatewayEngine
+from proxy.health import HealthMonitor
+from proxy.pool import TunnelPool, parse_pool_targets
+from proxy.quota import QuotaMonitor
+from vpn.management import ManagementClient
 
 # ---------- Optional HTTP Basic Auth ----------
 # Uses API_USER / API_PASS from .env.
@@ -28,14 +53,90 @@ async def verify_credentials(credentials: HTTPBasicCredentials | None = _securit
         )
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Drop entries left behind by crashes or reboots before anything is served
+    if RECONCILE_ON_START:
+        print(service.reconcile()["message"])
+
+    # Supervised mode runs OpenVPN and 3proxy as child processes restarted on exit
+    if SUPERVISE:
+        service.supervisor = Supervisor()
+        service.vpn_manager.supervisor = service.proxy_server.supervisor = service.supervisor
+        service.supervisor.start()
+
+    # OpenVPN pushes state, address and traffic over its management socket
+    if OPENVPN_MANAGEMENT:
+        service.management = ManagementClient(on_moved=service.tunnel_moved)
+        service.vpn_manager.management = service.management
+        service.management.start_in_thread()
+        for port, info in service.state_manager.get_state().items():
+            service.management.watch(info.get("tunnel_id", port))
+
+    # In builtin mode the API process hosts the forwarding engine for every port
+    if PROXY_MODE == "builtin":
+        engine = ForwardingEngine(
+            authenticate=service.proxy_server.authenticate, listener_source=service.proxy_server.current_listeners
+        )
+        service.proxy_server.engine = engine
+        engine.start_in_thread()
+
+    if GATEWAY_PORT:
+        service.gateway = GatewayEngine(
+            service.state_manager,
+            authenticate=service.proxy_server.authenticate,
+            permits=service.proxy_server.permits,
+        )
+        service.gateway.start_in_thread()
+
+    # 3proxy daemons follow users changed by the CLI or another API process, too
+    watcher = UserWatcher(service.proxy_server.reload_users) if USERS_RELOAD_INTERVAL > 0 else None
+    if watcher is not None:
+        watcher.start()
+
+    pool_targets = parse_pool_targets(POOL_TARGETS)
+    if pool_targets:
+        service.pool = TunnelPool(
+            service.vpn_manager,
+            service.proxy_server,
+            pool_targets,
+            configs_in_use=service.configs_in_use,
+            tunnels_in_use=service.tunnels_in_use,
+        )
+        service.pool.start()
+
+    monitor = HealthMonitor(service) if HEALTH_CHECK_INTERVAL > 0 else None
+    if monitor is not None:
+        monitor.start()
+    if QUOTA_CHECK_INTERVAL > 0:
+        service.quota = QuotaMonitor(service)
+        service.quota.start()
+    yield
+    if watcher is not None:
+        watcher.stop()
+    if service.quota is not None:
+        service.quota.stop()
+    if monitor is not None:
+        monitor.stop()
+    if service.pool is not None:
+        service.pool.stop()
+    if service.management is not None:
+        service.management.stop()
+    if service.supervisor is not None:
+        # The children keep running and are picked up through their pid files
+        service.supervisor.close()
+
+
 app = FastAPI(
     title="ProxyForFree API",
     description="REST API for managing proxy servers via OpenVPN + 3proxy",
     version="1.0.0",
     dependencies=[Depends(verify_credentials)],
+    lifespan=lifespan,
 )
 
 app.include_router(router)
+metrics = MetricsCollector(service)
 
 
 @app.get("/", tags=["health"])
@@ -46,3 +147,9 @@ async def root():
 @app.get("/health", tags=["health"])
 async def health():
     return {"status": "healthy"}
+
+
+@app.get("/metrics", tags=["health"], response_class=PlainTextResponse)
+def get_metrics():
+    """Per-proxy traffic, process and connection metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.collect(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,148 @@
+import asyncio
+import contextlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from core.config import JOB_HISTORY, JOB_WORKERS
+
+FINISHED_STATUSES = ("succeeded", "failed")
+
+
+class Job:
+    """
+    A single background operation and the progress events it produced.
+    """
+
+    def __init__(self, kind, params):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.events = []
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+            "events": list(self.events),
+        }
+
+
+class JobManager:
+    """
+    Runs blocking proxy operations on a bounded thread pool.
+
+    Keeps the most recent jobs in memory and pushes their progress events to any
+    asyncio subscribers (used by the SSE stream).
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, history=JOB_HISTORY):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.history = history
+        self.jobs = OrderedDict()
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def submit(self, kind, func, params=None, **kwargs):
+        """
+        Queue `func(**kwargs, progress=callback)` and return the new job.
+
+        The callable reports intermediate steps through `progress(message, **data)` and
+        returns a result dict; a falsy 'success' key marks the job as failed.
+        """
+        job = Job(kind, params or {})
+        with self.lock:
+            self.jobs[job.id] = job
+            self._trim()
+        self._publish(job, "queued", f"{kind} queued")
+        self.executor.submit(self._run, job, func, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def subscribe(self, job_id):
+        """
+        Register an asyncio queue receiving the events of a job.
+
+        Must be called from the event loop that will consume the queue. Returns the
+        queue and the events recorded so far, or None if there is no such job (any
+        more: finished jobs are trimmed).
+        """
+        queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            self.subscribers.setdefault(job_id, []).append((loop, queue))
+            return queue, list(job.events)
+
+    def unsubscribe(self, job_id, queue):
+        with self.lock:
+            subscribers = self.subscribers.get(job_id, [])
+            self.subscribers[job_id] = [s for s in subscribers if s[1] is not queue]
+            if not self.subscribers[job_id]:
+                del self.subscribers[job_id]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job, func, kwargs):
+        job.status = "running"
+        job.started_at = time.time()
+        self._publish(job, "running", f"{job.kind} started")
+
+        def progress(message, **data):
+            self._publish(job, "progress", message, **data)
+
+        try:
+            job.result = func(progress=progress, **kwargs)
+            success = not isinstance(job.result, dict) or job.result.get("success", True)
+            job.status = "succeeded" if success else "failed"
+            message = job.result.get("message", job.status) if isinstance(job.result, dict) else job.status
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            message = f"{job.kind} failed: {e}"
+        job.finished_at = time.time()
+        self._publish(job, job.status, message)
+
+    def _publish(self, job, event_type, message, **data):
+        event = {"type": event_type, "message": message, "time": time.time(), **data}
+        with self.lock:
+            job.events.append(event)
+            subscribers = list(self.subscribers.get(job.id, []))
+        for loop, queue in subscribers:
+            with contextlib.suppress(RuntimeError):
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def _trim(self):
+        """Drop the oldest finished jobs once the history limit is exceeded."""
+        excess = len(self.jobs) - self.history
+        for job_id in [j.id for j in self.jobs.values() if j.finished][: max(excess, 0)]:
+            del self.jobs[job_id]
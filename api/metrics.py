@@ -0,0 +1,217 @@
+import time
+
+from core.procfs import LogLineCounter, established_connections, interface_stats, process_stats, read_pid_file
+from proxy.server import SHARED_PID_FILE
+
+# OpenVPN logs this line after every successful (re)connection
+OPENVPN_CONNECTED = "Initialization Sequence Completed"
+
+TUNNEL_COUNTERS = (
+    ("rx_bytes", "receive_bytes", "Bytes received on the tun interface."),
+    ("tx_bytes", "transmit_bytes", "Bytes sent on the tun interface."),
+    ("rx_packets", "receive_packets", "Packets received on the tun interface."),
+    ("tx_packets", "transmit_packets", "Packets sent on the tun interface."),
+)
+
+CGROUP_METRICS = (
+    ("cpu_seconds", "proxyforfree_cgroup_cpu_seconds_total", "counter", "CPU time used by the proxy's cgroup."),
+    ("memory_bytes", "proxyforfree_cgroup_memory_bytes", "gauge", "Memory charged to the proxy's cgroup."),
+    ("pids", "proxyforfree_cgroup_pids", "gauge", "Processes and threads in the proxy's cgroup."),
+    ("oom_kills", "proxyforfree_cgroup_oom_kills_total", "counter", "Processes killed by the cgroup's memory limit."),
+)
+
+OPENVPN_COUNTERS = (
+    ("bytes_in", "receive_bytes", "Bytes received by OpenVPN, as reported on its management socket."),
+    ("bytes_out", "transmit_bytes", "Bytes sent by OpenVPN, as reported on its management socket."),
+)
+
+
+class MetricsCollector:
+    """
+    Renders Prometheus metrics for every proxy recorded in the state.
+
+    A scrape reads /proc/net/dev, /proc/net/tcp, one /proc/<pid>/stat per
+    process and the usage files of each proxy's cgroup; OpenVPN reconnects and
+    byte counts come from the management client, or from the newly appended part
+    of each OpenVPN log for instances it cannot reach. Nothing is spawned per proxy.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.reconnects = LogLineCounter(OPENVPN_CONNECTED)
+
+    def collect(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        state = self.service.state_manager.get_state()
+        proxy_server = self.service.proxy_server
+        ports = sorted(int(port) for port in state)
+
+        pids = {}
+        for port in ports:
+            tunnel_id = state[str(port)].get("tunnel_id", port)
+            pids[(port, "openvpn")] = read_pid_file(f"/tmp/ovpn_{tunnel_id}.pid")
+            if proxy_server.mode == "per-port":
+                pids[(port, "3proxy")] = read_pid_file(f"/tmp/3proxy_{port}.pid")
+        shared_pid = read_pid_file(SHARED_PID_FILE) if proxy_server.mode == "shared" else None
+        processes = process_stats([pid for pid in [*pids.values(), shared_pid] if pid])
+        interfaces = interface_stats()
+        management = self.service.management
+        cgroups = self.service.vpn_manager.cgroups
+        engine = proxy_server.engine
+        if engine is not None:
+            connections = {port: stats.active for port, stats in list(engine.stats.items())}
+        else:
+            connections = established_connections(ports)
+
+        metrics = Metrics()
+        metrics.add("proxyforfree_proxies", "gauge", "Number of proxies recorded in the state.", len(ports))
+        now = time.time()
+        for port in ports:
+            info = state[str(port)]
+            labels = {"port": port}
+            metrics.add(
+                "proxyforfree_proxy_info",
+                "gauge",
+                "Proxy metadata.",
+                1,
+                port=port,
+                country=info.get("country"),
+                config=info.get("config"),
+                tun_interface=info.get("tun_interface"),
+                label=info.get("label"),
+            )
+            counters = interfaces.get(info.get("tun_interface"))
+            metrics.add(
+                "proxyforfree_tunnel_up", "gauge", "Whether the tun interface exists.", int(bool(counters)), **labels
+            )
+            for key, name, help_text in TUNNEL_COUNTERS if counters else ():
+                metrics.add(f"proxyforfree_tunnel_{name}_total", "counter", help_text, counters[key], **labels)
+
+            for process in ("openvpn", "3proxy"):
+                stats = processes.get(pids.get((port, process)))
+                if stats:
+                    metrics.add_process(stats, process=process, **labels)
+            openvpn = processes.get(pids[(port, "openvpn")])
+            if openvpn:
+                metrics.add(
+                    "proxyforfree_proxy_uptime_seconds",
+                    "gauge",
+                    "Seconds since the OpenVPN process started.",
+                    round(now - openvpn["start_time"], 3),
+                    **labels,
+                )
+
+            usage = cgroups.usage(info.get("tunnel_id", port)) if cgroups is not None else None
+            for key, name, kind, help_text in CGROUP_METRICS if usage else ():
+                if usage[key] is not None:
+                    metrics.add(name, kind, help_text, usage[key], **labels)
+
+            quota_bytes = (info.get("traffic") or {}).get("quota_bytes")
+            if quota_bytes:
+                quota = info.get("quota") or {}
+                metrics.add("proxyforfree_quota_bytes", "gauge", "Traffic quota of the proxy.", quota_bytes, **labels)
+                metrics.add(
+                    "proxyforfree_quota_used_bytes",
+                    "gauge",
+                    "Traffic counted against the quota.",
+                    quota.get("used_bytes", 0),
+                    **labels,
+                )
+                metrics.add(
+                    "proxyforfree_quota_throttled",
+                    "gauge",
+                    "Whether the proxy is throttled for using up its quota.",
+                    int(bool(quota.get("throttled"))),
+                    **labels,
+                )
+
+            vpn = management.status(info.get("tunnel_id", port)) if management else None
+            if vpn is not None and vpn["state"] is not None:
+                # Pushed by OpenVPN over its management socket
+                reconnects = vpn["reconnects"]
+                for key, name, help_text in OPENVPN_COUNTERS:
+                    metrics.add(f"proxyforfree_openvpn_{name}_total", "counter", help_text, vpn[key], **labels)
+            else:
+                log_file = f"/tmp/ovpn_{info.get('tunnel_id', port)}.log"
+                reconnects = max(self.reconnects.count(log_file) - 1, 0)
+            metrics.add(
+                "proxyforfree_openvpn_reconnects_total",
+                "counter",
+                "OpenVPN reconnections after the first connection.",
+                reconnects,
+                **labels,
+            )
+            metrics.add(
+                "proxyforfree_proxy_restarts_total",
+                "counter",
+                "Restarts by the health monitor.",
+                (info.get("health") or {}).get("restarts", 0),
+                **labels,
+            )
+            metrics.add(
+                "proxyforfree_proxy_active_connections",
+                "gauge",
+                "Open client connections.",
+                connections.get(port, 0),
+                **labels,
+            )
+
+        if shared_pid in processes:
+            metrics.add_process(processes[shared_pid], process="3proxy-shared")
+        gateway = self.service.gateway
+        if gateway is not None:
+            stats = gateway.stats.get(gateway.port)
+            metrics.add(
+                "proxyforfree_gateway_active_connections",
+                "gauge",
+                "Open client connections on the gateway port.",
+                stats.active if stats else 0,
+            )
+        if self.service.pool is not None:
+            for country, status in self.service.pool.status().items():
+                metrics.add(
+                    "proxyforfree_pool_warm_tunnels", "gauge", "Warm tunnels ready.", status["warm"], country=country
+                )
+        return metrics.render()
+
+
+class Metrics:
+    """Collects samples grouped by metric name and renders them as text."""
+
+    def __init__(self):
+        self.families = {}
+
+    def add(self, name, kind, help_text, value, **labels):
+        family = self.families.setdefault(name, (kind, help_text, []))
+        family[2].append((labels, value))
+
+    def add_process(self, stats, **labels):
+        self.add("proxyforfree_process_cpu_seconds_total", "counter", "CPU time used.", stats["cpu_seconds"], **labels)
+        self.add(
+            "proxyforfree_process_resident_memory_bytes", "gauge", "Resident memory.", stats["rss_bytes"], **labels
+        )
+        self.add(
+            "proxyforfree_process_start_time_seconds",
+            "gauge",
+            "Process start time as a Unix timestamp.",
+            round(stats["start_time"], 3),
+            **labels,
+        )
+
+    @staticmethod
+    def _labels(labels):
+        pairs = []
+        for key, value in labels.items():
+            if value is None:
+                continue
+            escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            pairs.append(f'{key}="{escaped}"')
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self):
+        lines = []
+        for name, (kind, help_text, samples) in self.families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines += [f"{name}{self._labels(labels)} {value}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
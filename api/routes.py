@@ -1,84 +1,384 @@
-from fastapi import APIRouter, HTTPException, Query
+import json
+import time
 
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+
+from api.jobs import FINISHED_STATUSES, JobManager
 from api.schemas import (
+    ApplyFleetRequest,
+    CatalogResponse,
     ConfigItem,
     ConfigsResponse,
     CountriesResponse,
+    CreateUserRequest,
+    GatewayStatusResponse,
+    JobListResponse,
+    JobResponse,
+    LatencyResponse,
     MessageResponse,
+    PoolStatusResponse,
+    ProxyUser,
+    ResetQuotaRequest,
+    ResourcesResponse,
+    StartBatchRequest,
     StartProxyRequest,
     StatusResponse,
     StopProxyRequest,
+    UpdateUserRequest,
+    UserListResponse,
 )
 from api.service import ProxyService
+from core import logfile
+from core.logfile import READ_LIMIT
 
 router = APIRouter(prefix="/api/v1", tags=["proxies"])
 
 service = ProxyService()
+jobs = JobManager()
+
+
+@router.post("/proxies/start", response_model=JobResponse, status_code=202, summary="Start a proxy")
+def start_proxy(request: StartProxyRequest):
+    """
+    Queue the start of a new proxy instance with the given country, config, and port.
+
+    Returns a job right away; poll `/jobs/{id}` or stream `/jobs/{id}/events` for the outcome.
+    """
+    job = jobs.submit("start", service.start_proxy, params=request.model_dump(), **request.model_dump())
+    return JobResponse(**job.to_dict())
+
+
+@router.post("/proxies/start-batch", response_model=JobResponse, status_code=202, summary="Start several proxies")
+def start_batch(request: StartBatchRequest):
+    """
+    Queue the concurrent start of several proxy instances.
+
+    The job result lists the outcome of each instance.
+    """
+    specs = [spec.model_dump() for spec in request.proxies]
+    job = jobs.submit(
+        "start-batch",
+        service.start_many,
+        params=request.model_dump(),
+        specs=specs,
+        parallelism=request.parallelism,
+    )
+    return JobResponse(**job.to_dict())
+
+
+@router.post("/fleet/apply", response_model=JobResponse, status_code=202, summary="Apply a fleet spec")
+def apply_fleet(request: ApplyFleetRequest):
+    """
+    Queue converging the running proxies on a desired set, touching only the ports that differ.
+
+    Missing proxies are started, changed or dead ones replaced and unlisted ones
+    stopped (unless `prune` is false). The job result holds the plan and, without
+    `dry_run`, the outcome of every start.
+    """
+    job = jobs.submit(
+        "apply-fleet",
+        service.apply_fleet,
+        params=request.model_dump(),
+        proxies=[spec.model_dump() for spec in request.proxies],
+        dry_run=request.dry_run,
+        prune=request.prune,
+        parallelism=request.parallelism,
+    )
+    return JobResponse(**job.to_dict())
+
+
+@router.post("/proxies/stop", response_model=JobResponse, status_code=202, summary="Stop a proxy")
+def stop_proxy(request: StopProxyRequest):
+    """
+    Queue the stop of a running proxy on the specified port.
+    """
+    job = jobs.submit("stop", service.stop_proxy, params=request.model_dump(), port=request.port)
+    return JobResponse(**job.to_dict())
+
+
+@router.post("/proxies/stop-all", response_model=JobResponse, status_code=202, summary="Stop all proxies")
+def stop_all_proxies():
+    """
+    Queue the stop of all running proxy instances.
+    """
+    job = jobs.submit("stop-all", service.stop_all_proxies)
+    return JobResponse(**job.to_dict())
+
+
+@router.post("/proxies/quota/reset", response_model=MessageResponse, summary="Reset a traffic quota")
+def reset_quota(request: ResetQuotaRequest):
+    """
+    Start the traffic quota of a proxy over; a throttled proxy gets its own rate limits back.
+    """
+    result = service.reset_quota(request.port)
+    if not result["success"]:
+        raise HTTPException(status_code=404, detail=result["message"])
+    return MessageResponse(**result)
+
+
+@router.get("/users", response_model=UserListResponse, tags=["users"], summary="List proxy users")
+def list_users():
+    """
+    List the proxy users with the ports and countries each may use.
+    """
+    users = service.list_users()
+    return UserListResponse(users=users, total=len(users))
+
+
+@router.post("/users", response_model=ProxyUser, status_code=201, tags=["users"], summary="Create a proxy user")
+def create_user(request: CreateUserRequest):
+    """
+    Create a proxy user. Running proxies accept it within a second, without restarting any tunnel.
+    """
+    result = service.add_user(**request.model_dump())
+    if not result["success"]:
+        raise HTTPException(status_code=409, detail=result["message"])
+    return ProxyUser(**result["user"])
+
+
+@router.get("/users/{username}", response_model=ProxyUser, tags=["users"], summary="Get a proxy user")
+def get_user(username: str):
+    """
+    Return a proxy user.
+    """
+    user = service.get_user(username)
+    if user is None:
+        raise HTTPException(status_code=404, detail=f"No user {username}.")
+    return ProxyUser(**user)
+
+
+@router.patch("/users/{username}", response_model=ProxyUser, tags=["users"], summary="Change a proxy user")
+def update_user(username: str, request: UpdateUserRequest):
+    """
+    Change the password, ports or countries of a proxy user; omitted fields stay as they are.
+    """
+    changes = request.model_dump(exclude_unset=True)
+    if changes.get("password", "") is None:
+        raise HTTPException(status_code=422, detail="The password cannot be null")
+    result = service.update_user(username, **changes)
+    if not result["success"]:
+        raise HTTPException(status_code=404 if result.get("missing") else 422, detail=result["message"])
+    return ProxyUser(**result["user"])
 
 
-@router.post("/proxies/start", response_model=MessageResponse, summary="Start a proxy")
-async def start_proxy(request: StartProxyRequest):
+@router.delete("/users/{username}", response_model=MessageResponse, tags=["users"], summary="Delete a proxy user")
+def delete_user(username: str):
     """
-    Start a new proxy instance with the given country, config, and port.
+    Delete a proxy user; running proxies refuse it within a second.
     """
-    result = service.start_proxy(request.country, request.config, request.port, request.label)
+    result = service.remove_user(username)
     if not result["success"]:
-        raise HTTPException(status_code=400, detail=result["message"])
-    return MessageResponse(success=True, message=result["message"])
+        raise HTTPException(status_code=404, detail=result["message"])
+    return MessageResponse(**result)
+
+
+@router.post("/proxies/reconcile", response_model=JobResponse, status_code=202, summary="Reconcile state")
+def reconcile(dry_run: bool = Query(False, description="Only report what would be changed")):
+    """
+    Queue a reconciliation of the state with the running processes, interfaces and routing.
+
+    Stale entries are removed, moved tunnels updated, missing routing or 3proxy
+    daemons restored and orphaned processes, interfaces and tables cleaned up.
+    """
+    job = jobs.submit("reconcile", service.reconcile, params={"dry_run": dry_run}, dry_run=dry_run)
+    return JobResponse(**job.to_dict())
+
+
+@router.get("/jobs", response_model=JobListResponse, summary="List recent jobs")
+def list_jobs():
+    """
+    List the most recent start/stop jobs, oldest first.
+    """
+    items = [JobResponse(**job.to_dict()) for job in jobs.list()]
+    return JobListResponse(jobs=items, total=len(items))
 
 
-@router.post("/proxies/stop", response_model=MessageResponse, summary="Stop a proxy")
-async def stop_proxy(request: StopProxyRequest):
+@router.get("/jobs/{job_id}", response_model=JobResponse, summary="Get a job")
+def get_job(job_id: str):
     """
-    Stop a running proxy on the specified port.
+    Return the current status, events and result of a job.
     """
-    result = service.stop_proxy(request.port)
-    return MessageResponse(success=result["success"], message=result["message"])
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return JobResponse(**job.to_dict())
 
 
-@router.post("/proxies/stop-all", response_model=MessageResponse, summary="Stop all proxies")
-async def stop_all_proxies():
+@router.get("/jobs/{job_id}/events", summary="Stream job progress")
+async def stream_job_events(job_id: str):
     """
-    Stop all running proxy instances.
+    Stream the progress events of a job as Server-Sent Events.
+
+    Events recorded before the connection are replayed first; the stream ends once
+    the job has finished.
     """
-    result = service.stop_all_proxies()
-    return MessageResponse(success=result["success"], message=result["message"])
+    if jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    async def event_stream():
+        subscription = jobs.subscribe(job_id)
+        if subscription is None:
+            # Trimmed since the check above
+            yield _sse({"type": "gone", "message": f"Job {job_id} is no longer kept", "time": time.time()})
+            return
+        queue, backlog = subscription
+        try:
+            for event in backlog:
+                yield _sse(event)
+                if event["type"] in FINISHED_STATUSES:
+                    return
+            while True:
+                event = await queue.get()
+                yield _sse(event)
+                if event["type"] in FINISHED_STATUSES:
+                    return
+        finally:
+            jobs.unsubscribe(job_id, queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+def _sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
 
 
 @router.get("/proxies/status", response_model=StatusResponse, summary="Get status of all proxies")
-async def get_status():
+def get_status(live: bool = Query(False, description="Check processes and tun interfaces, not just the state")):
     """
     Return the status of all running proxy instances.
+
+    With `live=1` each proxy also reports whether its OpenVPN and 3proxy processes
+    run (PID, uptime, RSS, CPU time) and the state of its tun interface.
     """
-    result = service.get_status()
+    result = service.get_status(live)
     return StatusResponse(**result)
 
 
+@router.get("/proxies/resources", response_model=ResourcesResponse, summary="Get resource usage of all proxies")
+def get_resources():
+    """
+    Return the cgroup, limits and usage counters (CPU time, memory, pids, OOM kills) of each proxy.
+
+    The counters cover the proxy's OpenVPN process and, in per-port mode, its 3proxy daemon.
+    """
+    return ResourcesResponse(**service.get_resources())
+
+
+@router.get("/pool", response_model=PoolStatusResponse, summary="Get warm tunnel pool status")
+def get_pool_status():
+    """
+    Return the number of warm, starting and wanted tunnels per country.
+    """
+    return PoolStatusResponse(enabled=service.pool is not None, countries=service.get_pool_status())
+
+
+@router.get("/gateway", response_model=GatewayStatusResponse, summary="Get rotating gateway status")
+def get_gateway_status():
+    """
+    Return the gateway port, its balancing policy and the open connections per exit.
+    """
+    return GatewayStatusResponse(enabled=service.gateway is not None, **service.get_gateway_status())
+
+
 @router.get("/proxies/logs/{port}", summary="Get logs for a proxy")
-async def get_logs(port: int):
+def get_logs(
+    port: int,
+    tail: int | None = Query(None, ge=0, description="Number of last lines to return (default: the whole log)"),
+    offset: int | None = Query(None, ge=0, description="Byte offset to read from instead of the tail"),
+    limit: int = Query(READ_LIMIT, ge=1, le=READ_LIMIT, description="Maximum number of bytes to return"),
+    follow: bool = Query(False, description="Keep streaming new lines as Server-Sent Events"),
+):
     """
     Get OpenVPN logs for a specific proxy port.
+
+    Returns the whole log, the last `tail` lines, or the bytes from `offset` on; continue from
+    `next_offset`. With `follow=true` the selected part is sent as a first `log`
+    event and every line written afterwards follows as further `log` events.
     """
-    result = service.get_logs(port)
+    result = service.get_logs(port, tail, offset, limit)
     if not result["success"]:
         raise HTTPException(status_code=404, detail=result["message"])
-    return result
+    if not follow:
+        return result
+
+    async def event_stream():
+        yield _sse(
+            {"type": "log", "offset": result["offset"], "next_offset": result["next_offset"], "logs": result["logs"]}
+        )
+        async for text, start, end in logfile.follow(service.log_file(port), result["next_offset"]):
+            yield _sse({"type": "log", "offset": start, "next_offset": end, "logs": text})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+def _catalog_etag(request: Request, response: Response):
+    """
+    Set the catalog ETag on the response.
+
+    Returns:
+        Response or None: A 304 response when the client's If-None-Match is current.
+    """
+    etag = f'"{service.catalog_version()}"'
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
 
 
 @router.get("/countries", response_model=CountriesResponse, summary="List available countries")
-async def list_countries():
+def list_countries(request: Request, response: Response):
     """
     List all available VPN countries.
     """
+    not_modified = _catalog_etag(request, response)
+    if not_modified:
+        return not_modified
     countries = service.list_countries()
     return CountriesResponse(countries=countries, total=len(countries))
 
 
 @router.get("/configs", response_model=ConfigsResponse, summary="List VPN configs")
-async def list_configs(country: str | None = Query(None, description="Filter by country name")):
+def list_configs(
+    request: Request, response: Response, country: str | None = Query(None, description="Filter by country name")
+):
     """
     List available VPN configurations, optionally filtered by country.
     """
+    not_modified = _catalog_etag(request, response)
+    if not_modified:
+        return not_modified
     configs = service.list_configs(country)
     items = [ConfigItem(country=c, configs=cfgs) for c, cfgs in configs.items()]
     return ConfigsResponse(items=items, total=len(items))
+
+
+@router.get("/catalog", response_model=CatalogResponse, summary="Get VPN config metadata")
+def get_catalog(
+    request: Request, response: Response, country: str | None = Query(None, description="Filter by country name")
+):
+    """
+    Return the parsed remotes, protocol, cipher and content hash of every VPN config.
+    """
+    not_modified = _catalog_etag(request, response)
+    if not_modified:
+        return not_modified
+    configs = service.get_catalog(country)
+    return CatalogResponse(version=service.catalog_version(), configs=configs, total=len(configs))
+
+
+@router.get("/latency", response_model=LatencyResponse, summary="Get config latencies of a country")
+def get_latency(
+    country: str = Query(..., description="Country name"),
+    refresh: bool = Query(False, description="Probe again instead of using cached results"),
+):
+    """
+    Return every config of a country with the round-trip time to its fastest server.
+
+    Configs are sorted fastest first; servers that did not answer have no latency.
+    """
+    if country not in service.list_countries():
+        raise HTTPException(status_code=404, detail=f"Country {country} not found")
+    configs = service.get_latencies(country, refresh)
+    fastest = configs[0]["config"] if configs and configs[0]["latency_ms"] is not None else None
+    return LatencyResponse(country=country, configs=configs, fastest=fastest)
@@ -1,17 +1,99 @@
+from typing import Any
+
 from pydantic import BaseModel, Field
 
 
+class ResourceLimits(BaseModel):
+    cpu_weight: int | None = Field(
+        None, description="Relative CPU share (cgroup cpu.weight, 100 by default)", ge=1, le=10000, examples=[50]
+    )
+    memory_max: str | None = Field(
+        None,
+        description="Memory limit in bytes with an optional K, M or G suffix, or 'max'",
+        pattern=r"^(\d+[KMG]?|max)$",
+        examples=["256M"],
+    )
+    pids_max: int | None = Field(None, description="Maximum number of processes and threads", ge=1, examples=[64])
+
+
+class TrafficLimits(BaseModel):
+    download_kbps: int | None = Field(None, description="Download rate limit in kbit/s", ge=1, examples=[10000])
+    upload_kbps: int | None = Field(None, description="Upload rate limit in kbit/s", ge=1, examples=[2000])
+    quota_bytes: int | None = Field(
+        None, description="Traffic allowed in both directions together", ge=1, examples=[10 * 1024**3]
+    )
+    quota_action: str = Field(
+        "throttle",
+        description="What happens once the quota is used up: 'throttle' to QUOTA_THROTTLE_KBPS or 'stop'",
+        pattern=r"^(throttle|stop)$",
+    )
+
+
 class StartProxyRequest(BaseModel):
     country: str = Field(..., description="Country folder name", examples=["usa"])
-    config: str = Field(..., description="Config file name (with or without .ovpn)", examples=["us-free-44"])
+    config: str | None = Field(
+        None, description="Config file name (with or without .ovpn); omit to pick one", examples=["us-free-44"]
+    )
     port: int = Field(..., description="Port for the proxy", ge=1024, le=65535, examples=[8011])
     label: str | None = Field(None, description="Optional label for this proxy instance", examples=["user-123"])
+    limits: ResourceLimits | None = Field(None, description="Resource limits of the proxy's cgroup (cgroup v2)")
+    traffic: TrafficLimits | None = Field(None, description="Rate limits and traffic quota of the proxy")
+
+
+class StartBatchRequest(BaseModel):
+    proxies: list[StartProxyRequest] = Field(..., description="Proxies to start", min_length=1)
+    parallelism: int | None = Field(None, description="Maximum number of proxies started at once", ge=1, le=256)
+
+
+class ApplyFleetRequest(BaseModel):
+    proxies: list[StartProxyRequest] = Field(
+        ..., description="Every proxy that should run; config 'auto' or omitted accepts any config of the country"
+    )
+    dry_run: bool = Field(False, description="Only return the plan")
+    prune: bool = Field(True, description="Stop running proxies that are not listed")
+    parallelism: int | None = Field(None, description="Maximum number of proxies started at once", ge=1, le=256)
 
 
 class StopProxyRequest(BaseModel):
     port: int = Field(..., description="Port of the proxy to stop", ge=1024, le=65535, examples=[8011])
 
 
+class ResetQuotaRequest(BaseModel):
+    port: int = Field(..., description="Port of the proxy whose quota starts over", ge=1024, le=65535, examples=[8011])
+
+
+class CreateUserRequest(BaseModel):
+    username: str = Field(
+        ..., description="Name the user authenticates with", pattern=r"^[A-Za-z0-9_.@+-]{1,64}$", examples=["alice"]
+    )
+    password: str = Field(..., description="Password; only its md5-crypt hash is stored", min_length=1)
+    ports: list[int] | None = Field(
+        None, description="Proxy ports the user may use (all if omitted)", examples=[[8011, 8012]]
+    )
+    countries: list[str] | None = Field(
+        None, description="Countries whose proxies the user may use (all if omitted)", examples=[["usa"]]
+    )
+
+
+class UpdateUserRequest(BaseModel):
+    password: str | None = Field(None, description="New password", min_length=1)
+    ports: list[int] | None = Field(None, description="Proxy ports the user may use; null allows all")
+    countries: list[str] | None = Field(None, description="Countries the user may use; null allows all")
+
+
+class ProxyUser(BaseModel):
+    username: str
+    ports: list[int] | None = None
+    countries: list[str] | None = None
+    created: str | None = None
+    updated: str | None = None
+
+
+class UserListResponse(BaseModel):
+    users: list[ProxyUser]
+    total: int
+
+
 class ProxyInfo(BaseModel):
     port: str
     country: str
@@ -20,6 +102,13 @@ class ProxyInfo(BaseModel):
     tun_ip: str
     start_time: str
     label: str | None = None
+    limits: dict[str, Any] | None = None
+    traffic: dict[str, Any] | None = None
+    quota: dict[str, Any] | None = None
+    health: dict[str, Any] | None = None
+    processes: dict[str, Any] | None = None
+    vpn: dict[str, Any] | None = None
+    live: dict[str, Any] | None = None
 
 
 class StatusResponse(BaseModel):
@@ -27,6 +116,19 @@ class StatusResponse(BaseModel):
     total: int
 
 
+class ProxyResources(BaseModel):
+    port: str
+    cgroup: str | None = None
+    limits: dict[str, Any]
+    usage: dict[str, Any] | None = None
+
+
+class ResourcesResponse(BaseModel):
+    enabled: bool
+    proxies: list[ProxyResources]
+    total: int
+
+
 class MessageResponse(BaseModel):
     success: bool
     message: str
@@ -45,3 +147,88 @@ class ConfigItem(BaseModel):
 class ConfigsResponse(BaseModel):
     items: list[ConfigItem]
     total: int
+
+
+class RemoteInfo(BaseModel):
+    host: str
+    port: int
+    proto: str
+
+
+class ConfigMetadata(BaseModel):
+    name: str
+    country: str
+    path: str
+    sha256: str
+    proto: str
+    cipher: str | None = None
+    remotes: list[RemoteInfo]
+
+
+class CatalogResponse(BaseModel):
+    version: str
+    configs: list[ConfigMetadata]
+    total: int
+
+
+class ConfigLatency(BaseModel):
+    config: str
+    latency_ms: float | None = None
+
+
+class LatencyResponse(BaseModel):
+    country: str
+    configs: list[ConfigLatency]
+    fastest: str | None = None
+
+
+class PoolCountryStatus(BaseModel):
+    target: int
+    warm: int
+    starting: int
+    configs: list[str]
+
+
+class PoolStatusResponse(BaseModel):
+    enabled: bool
+    countries: dict[str, PoolCountryStatus]
+
+
+class GatewayExit(BaseModel):
+    port: int
+    country: str | None = None
+    tun_ip: str
+    active: int
+
+
+class GatewayStatusResponse(BaseModel):
+    enabled: bool
+    port: int | None = None
+    policy: str | None = None
+    exits: list[GatewayExit] = []
+
+
+class JobEvent(BaseModel):
+    type: str
+    message: str
+    time: float
+    port: int | None = None
+    success: bool | None = None
+
+
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    params: dict[str, Any]
+    status: str
+    created_at: float
+    started_at: float | None = None
+    finished_at: float | None = None
+    result: dict[str, Any] | None = None
+    error: str | None = None
+    events: list[JobEvent]
+
+
+class JobListResponse(BaseModel):
+    jobs: list[JobResponse]
+    total: int
@@ -1,9 +1,17 @@
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from core.config import START_PARALLELISM
+from core.logfile import READ_LIMIT, read_range, read_tail
 from core.state import StateManager
-from proxy.instance import ProxyInstance
-from proxy.server import ProxyServer
+from proxy.fleet import parse_fleet, plan_fleet
+from proxy.instance import ProxyInstance, stop_instances
+from proxy.live import LiveStatus
+from proxy.quota import QuotaMonitor, new_quota
+from proxy.reconcile import Reconciler
+from proxy.server import SHARED_NAME, ProxyServer
 from vpn.manager import VPNManager
 
 
@@ -16,30 +24,182 @@ class ProxyService:
     def __init__(self):
         self.state_manager = StateManager()
         self.vpn_manager = VPNManager()
-        self.proxy_server = ProxyServer()
+        self.proxy_server = ProxyServer(state_manager=self.state_manager)
+        # Ports with a start in progress, guarded by _starting_lock
+        self._starting = set()
+        self._starting_lock = threading.Lock()
+        # Process and interface scans shared by live status requests for a short TTL
+        self.live = LiveStatus()
+        # Optional TunnelPool providing already connected tunnels (set up by the API)
+        self.pool = None
+        # Optional GatewayEngine serving the rotating gateway port (set up by the API)
+        self.gateway = None
+        # Optional Supervisor running OpenVPN and 3proxy as child processes (set up by the API)
+        self.supervisor = None
+        # Optional ManagementClient following OpenVPN over its management sockets (set up by the API)
+        self.management = None
+        # Optional QuotaMonitor accounting and enforcing traffic quotas (set up by the API)
+        self.quota = None
 
-    def start_proxy(self, country: str, config: str, port: int, label: str | None = None) -> dict:
-        """Start a new proxy instance. Returns dict with 'success' and 'message'."""
-        port_str = str(port)
-        state = self.state_manager.get_state()
-        instance = ProxyInstance(port, self.vpn_manager, self.proxy_server)
+    def start_proxy(
+        self,
+        country: str,
+        config: str | None,
+        port: int,
+        label: str | None = None,
+        limits: dict | None = None,
+        traffic: dict | None = None,
+        progress=None,
+    ) -> dict:
+        """
+        Start a new proxy instance. Returns dict with 'success' and 'message'.
+
+        A warm tunnel from the pool is used when one matches; with config=None any
+        config of the country may be used. `limits` ('cpu_weight', 'memory_max',
+        'pids_max') are applied to the instance's cgroup, `traffic` ('download_kbps',
+        'upload_kbps', 'quota_bytes', 'quota_action') to its tunnel.
+        """
+        if progress:
+            progress(f"Starting proxy for {country}/{config or 'auto'} on port {port}", port=port)
+        result, entry = self._start_instance(country, config, port, label, limits, traffic)
+        if entry is not None and not self._record_started({str(port): entry}):
+            return self._conflict(port)
+        return result
+
+    def start_many(self, specs: list[dict], parallelism: int | None = None, progress=None) -> dict:
+        """
+        Start several proxy instances concurrently.
+
+        Each spec is a dict with 'country', 'config', 'port' and optional 'label', 'limits' and 'traffic'.
+        At most `parallelism` instances are brought up at the same time and the
+        state is written once, after every instance has finished. `progress(message, **data)`
+        is called as each instance completes.
+        """
+        parallelism = max(1, parallelism or START_PARALLELISM)
+        ports = [int(spec["port"]) for spec in specs]
+        duplicates = sorted({p for p in ports if ports.count(p) > 1})
+        if duplicates:
+            return {
+                "success": False,
+                "message": f"Duplicate ports in batch: {', '.join(map(str, duplicates))}",
+                "results": [],
+            }
+
+        def start_one(spec):
+            # One failing instance must not lose the ones started alongside it
+            try:
+                outcome = self._start_instance(
+                    spec["country"],
+                    spec.get("config"),
+                    int(spec["port"]),
+                    spec.get("label"),
+                    spec.get("limits"),
+                    spec.get("traffic"),
+                )
+            except Exception as e:
+                outcome = {"success": False, "message": f"Failed to start: {e}"}, None
+            if progress:
+                progress(outcome[0]["message"], port=int(spec["port"]), success=outcome[0]["success"])
+            return outcome
 
-        if port_str in state:
+        with ThreadPoolExecutor(max_workers=min(parallelism, len(specs) or 1)) as executor:
+            outcomes = list(executor.map(start_one, specs))
+
+        entries = {str(spec["port"]): entry for spec, (_, entry) in zip(specs, outcomes, strict=True) if entry}
+        recorded = self._record_started(entries)
+
+        results = []
+        for spec, (result, entry) in zip(specs, outcomes, strict=True):
+            port = int(spec["port"])
+            if entry is not None and str(port) not in recorded:
+                result = self._conflict(port)
+            results.append({"port": port, **result})
+
+        started = sum(1 for r in results if r["success"])
+        return {
+            "success": started == len(results),
+            "message": f"Started {started} of {len(results)} proxies.",
+            "results": results,
+        }
+
+    def _start_instance(
+        self,
+        country: str,
+        config: str | None,
+        port: int,
+        label: str | None,
+        limits: dict | None = None,
+        traffic: dict | None = None,
+    ) -> tuple:
+        """
+        Bring up a single instance without recording it in the state.
+
+        Orphaned state entries for the port are removed. Concurrent starts on the
+        same port within this process are rejected.
+        Returns the result dict and the state entry to record (None on failure).
+        """
+        with self._starting_lock:
+            if port in self._starting:
+                return {"success": False, "message": f"Port {port} is already being started."}, None
+            self._starting.add(port)
+        try:
+            return self._launch_instance(country, config, port, label, limits, traffic)
+        finally:
+            with self._starting_lock:
+                self._starting.discard(port)
+
+    def _launch_instance(
+        self,
+        country: str,
+        config: str | None,
+        port: int,
+        label: str | None,
+        limits: dict | None,
+        traffic: dict | None,
+    ) -> tuple:
+        instance = ProxyInstance(port, self.vpn_manager, self.proxy_server, limits=limits, traffic=traffic)
+
+        info = self.state_manager.get(port)
+        if info is not None:
             running, pid = instance.is_running()
             if running:
-                return {"success": False, "message": f"Process with PID {pid} is already running for port {port}."}
-            # Orphaned state — clean up
-            del state[port_str]
-            self.state_manager.save_state(state)
+                message = f"Process with PID {pid} is already running for port {port}."
+                return {"success": False, "message": message}, None
+            # Orphaned state — clean up, unless someone else changed the entry meanwhile
+            self.state_manager.compare_and_swap(port, info, None)
 
         running, pid = instance.is_running()
         if running:
             return {
                 "success": False,
                 "message": f"Process with PID {pid} is already running for port {port}. Stop it first.",
-            }
+            }, None
 
-        success, result = instance.start(country, config)
+        tunnel = self.pool.claim(country, config) if self.pool else None
+        if tunnel:
+            instance = ProxyInstance(
+                port,
+                self.vpn_manager,
+                self.proxy_server,
+                tunnel_id=tunnel["tunnel_id"],
+                limits=limits,
+                traffic=traffic,
+            )
+            success, result = instance.enter_cgroup()
+            if success:
+                success, result = instance.shape()
+            if success:
+                instance.attach(tunnel["tun_ip"], country)
+                result = tunnel["tun_ip"]
+            else:
+                instance.stop(tunnel["tun_ip"])
+            config = tunnel["config"]
+        else:
+            if config is None:
+                config = self.vpn_manager.pick_config(country, {c for _, c in self.configs_in_use()})
+                if config is None:
+                    return {"success": False, "message": f"No configs found for country {country}."}, None
+            success, result = instance.start(country, config)
 
         if not success:
             log_tail = ""
@@ -47,10 +207,14 @@ class ProxyService:
             log_path = Path(instance.ovpn_log_file)
             if log_path.exists():
                 log_tail = log_path.read_text()[-2000:]
-            return {"success": False, "message": f"Failed to start: {result}", "log_tail": log_tail}
+            return {
+                "success": False,
+                "message": f"Failed to start: {result}",
+                "log_tail": log_tail,
+            }, None
 
         tun_ip = result
-        state[port_str] = {
+        entry = {
             "country": country,
             "config": config,
             "tun_interface": instance.tun_interface,
@@ -58,25 +222,90 @@ class ProxyService:
             "start_time": time.ctime(),
             "label": label,
         }
-        self.state_manager.save_state(state)
-        return {"success": True, "message": f"Proxy started on port {port}", "tun_ip": tun_ip}
+        if instance.limits:
+            entry["limits"] = instance.limits
+        if instance.traffic:
+            entry["traffic"] = instance.traffic
+            if instance.traffic.get("quota_bytes"):
+                entry["quota"] = new_quota(instance.tun_interface)
+        if instance.tunnel_id != port:
+            entry["tunnel_id"] = instance.tunnel_id
+        return {"success": True, "message": f"Proxy started on port {port}", "tun_ip": tun_ip}, entry
+
+    def _record_started(self, entries: dict) -> set:
+        """
+        Record freshly started instances in one transaction.
+
+        Ports that another process recorded in the meantime are left untouched.
+        Returns the set of recorded ports.
+        """
+        if not entries:
+            return set()
+        with self.state_manager.transaction() as state:
+            recorded = {port for port in entries if port not in state}
+            state.update({port: entries[port] for port in recorded})
+        return recorded
 
-    def stop_proxy(self, port: int) -> dict:
+    @staticmethod
+    def _conflict(port: int) -> dict:
+        return {"success": False, "message": f"Port {port} was claimed by another process while starting."}
+
+    def stop_proxy(self, port: int, progress=None) -> dict:
         """Stop a specific proxy instance."""
-        state = self.state_manager.get_state()
-        port_str = str(port)
-        info = state.get(port_str, {})
+        if progress:
+            progress(f"Stopping proxy on port {port}", port=port)
+        info = self.state_manager.get(port) or {}
 
-        instance = ProxyInstance(port, self.vpn_manager, self.proxy_server)
+        instance = ProxyInstance(port, self.vpn_manager, self.proxy_server, tunnel_id=info.get("tunnel_id"))
         instance.stop(info.get("tun_ip"))
 
-        if port_str in state:
-            del state[port_str]
-            self.state_manager.save_state(state)
+        self.state_manager.delete(port)
 
         return {"success": True, "message": f"Proxy on port {port} stopped and cleaned up."}
 
-    def stop_all_proxies(self) -> dict:
+    def restart_proxy(self, port: int, config: str | None = None, health: dict | None = None) -> dict:
+        """
+        Tear down the proxy on `port` and bring it up again on the same port and country.
+
+        Args:
+            port (int): The proxy port.
+            config (str): Config to switch to; None picks another unused config of the country.
+            health (dict): Health record to keep in the new state entry.
+        """
+        info = self.state_manager.get(port)
+        if info is None:
+            return {"success": False, "message": f"No proxy recorded on port {port}."}
+
+        instance = ProxyInstance(port, self.vpn_manager, self.proxy_server, tunnel_id=info.get("tunnel_id"))
+        instance.stop(info.get("tun_ip"))
+        if not self.state_manager.compare_and_swap(port, info, None):
+            return {"success": False, "message": f"Proxy on port {port} was changed by another process."}
+
+        country = info.get("country")
+        if config is None:
+            failed = str(info.get("config") or "").removesuffix(".ovpn")
+            in_use = {str(c).removesuffix(".ovpn") for _, c in self.configs_in_use() if c} | {failed}
+            config = self.vpn_manager.pick_config(country, in_use)
+            if config is not None and config.removesuffix(".ovpn") == failed:
+                # Every config is in use: rather share one than retry the one that failed
+                config = self.vpn_manager.pick_config(country, {failed})
+
+        result, entry = self._start_instance(
+            country, config, port, info.get("label"), info.get("limits"), info.get("traffic")
+        )
+        if entry is None:
+            # Keep the port recorded so the health monitor retries it later
+            self.state_manager.compare_and_swap(port, None, {**info, "health": health or info.get("health")})
+            return result
+        entry["health"] = health or info.get("health")
+        if "quota" in entry and info.get("quota"):
+            # The quota keeps counting on the new tunnel
+            entry["quota"]["used_bytes"] = info["quota"]["used_bytes"]
+        if not self._record_started({str(port): entry}):
+            return self._conflict(port)
+        return result
+
+    def stop_all_proxies(self, progress=None) -> dict:
         """Stop all running proxies."""
         state = self.state_manager.get_state()
         ports = set(state.keys())
@@ -91,13 +320,161 @@ class ProxyService:
         if not ports:
             return {"success": True, "message": "No active proxies found.", "stopped": []}
 
-        stopped = []
-        for port in sorted(ports, key=int):
-            self.stop_proxy(int(port))
-            stopped.append(port)
+        if progress:
+            progress(f"Stopping {len(ports)} proxies")
+        stopped = sorted(ports, key=int)
+        instances = [
+            ProxyInstance(
+                int(port),
+                self.vpn_manager,
+                self.proxy_server,
+                tunnel_id=state.get(port, {}).get("tunnel_id"),
+            )
+            for port in stopped
+        ]
+        # All proxies are torn down together under one deadline
+        stop_instances(instances)
+        if progress:
+            for port in stopped:
+                progress(f"Proxy on port {port} stopped", port=int(port))
+
+        with self.state_manager.transaction() as state:
+            for port in stopped:
+                state.pop(port, None)
 
         return {"success": True, "message": f"Stopped {len(stopped)} proxies.", "stopped": stopped}
 
+    def apply_fleet(
+        self,
+        proxies: list[dict],
+        dry_run: bool = False,
+        prune: bool = True,
+        parallelism: int | None = None,
+        progress=None,
+    ) -> dict:
+        """
+        Converge the running proxies on a fleet spec, touching only the ports that differ.
+
+        Proxies that are missing are started and those with another country, config,
+        limits or traffic, or whose processes died, are replaced; label changes
+        only update the state. With `prune`, recorded proxies the spec does not list
+        are stopped. All stops are done together, then all starts run concurrently
+        (at most `parallelism` at once); a replaced proxy keeps its quota consumption.
+
+        Args:
+            proxies (list): Proxies as in start requests; 'config' may be "auto" or omitted.
+            dry_run (bool): Only return the plan.
+
+        Returns:
+            dict: 'success', 'message', the plan (see proxy/fleet.py) and the 'results' of the starts.
+        """
+        try:
+            desired = parse_fleet(proxies)
+        except ValueError as e:
+            return {"success": False, "message": str(e), "results": []}
+        countries = set(self.list_countries())
+        for spec in desired:
+            # Checked up front, so a typo does not leave the fleet half torn down
+            try:
+                if spec["config"] is not None:
+                    self.vpn_manager.resolve_config(spec["country"], spec["config"])
+                elif spec["country"] not in countries:
+                    raise FileNotFoundError(f"No configs found for country {spec['country']}")
+            except FileNotFoundError as e:
+                return {"success": False, "message": f"Port {spec['port']}: {e}", "results": []}
+        state = self.state_manager.get_state()
+        live = LiveStatus(ttl=0)
+        alive = {int(port): live.get(int(port), info, self.proxy_server.mode)["alive"] for port, info in state.items()}
+        plan = plan_fleet(desired, state, alive, prune)
+        summary = (
+            f"{len(plan['start'])} to start, {len(plan['replace'])} to replace, {len(plan['stop'])} to stop, "
+            f"{len(plan['relabel'])} to relabel, {len(plan['keep'])} unchanged"
+        )
+        if progress:
+            progress(f"Fleet plan: {summary}")
+        if dry_run:
+            return {"success": True, "message": f"Would apply: {summary}.", **plan, "results": []}
+
+        teardown = sorted([*plan["stop"], *plan["replace"]])
+        if teardown:
+            if progress:
+                progress(f"Stopping {len(teardown)} proxies")
+            instances = [
+                ProxyInstance(port, self.vpn_manager, self.proxy_server, tunnel_id=state[str(port)].get("tunnel_id"))
+                for port in teardown
+            ]
+            stop_instances(instances)
+
+        specs = {spec["port"]: spec for spec in desired}
+        with self.state_manager.transaction() as current:
+            # Only the stopped entries go; a proxy started anew by someone else since the
+            # plan has another start time or tunnel. Health and quota updates do not count.
+            for port in teardown:
+                info, planned = current.get(str(port)), state[str(port)]
+                if info is not None and all(info.get(key) == planned.get(key) for key in ("start_time", "tunnel_id")):
+                    current.pop(str(port))
+            for port in plan["relabel"]:
+                if str(port) in current:
+                    current[str(port)]["label"] = specs[port]["label"]
+
+        results = []
+        starts = [specs[port] for port in sorted([*plan["start"], *plan["replace"]])]
+        if starts:
+            outcome = self.start_many(starts, parallelism, progress)
+            results = outcome["results"]
+            with self.state_manager.transaction() as current:
+                for port in plan["replace"]:
+                    old, new = state[str(port)].get("quota"), (current.get(str(port)) or {}).get("quota")
+                    if old and new:
+                        # The quota keeps counting on the new tunnel
+                        new["used_bytes"] = old["used_bytes"]
+
+        failed = sum(1 for result in results if not result["success"])
+        message = f"Applied: {summary}" + (f"; {failed} starts failed." if failed else ".")
+        return {"success": not failed, "message": message, **plan, "results": results}
+
+    def reconcile(self, dry_run: bool = False, progress=None) -> dict:
+        """
+        Repair or garbage-collect drift between the state and the running processes,
+        interfaces and routing tables in one pass (see proxy/reconcile.py).
+        """
+        with self._starting_lock:
+            busy_ports = set(self._starting)
+        plan = Reconciler(self.state_manager, self.vpn_manager, self.proxy_server).run(dry_run, busy_ports)
+        verb = "Would remove" if dry_run else "Removed"
+        message = (
+            f"{verb} {len(plan['stale'])} stale entries, {len(plan['moved'])} moved, "
+            f"{len(plan['healthy'])} healthy; {len(plan['kill'])} orphaned processes "
+            f"in {plan['duration_ms']} ms."
+        )
+        if progress:
+            progress(message)
+        return {"success": True, "message": message, **plan}
+
+    def tunnel_moved(self, tunnel_id: int, tun_ip: str) -> None:
+        """
+        Called by the ManagementClient when OpenVPN reconnected with another address.
+
+        A reconcile pass moves the routing and the listener of the proxy over.
+        """
+        threading.Thread(target=self.reconcile, name=f"tunnel-moved-{tunnel_id}", daemon=True).start()
+
+    def configs_in_use(self) -> set:
+        """Return the (country, config) pairs of all recorded proxies."""
+        return {(info.get("country"), info.get("config")) for info in self.state_manager.get_state().values()}
+
+    def tunnels_in_use(self) -> set:
+        """Return the tunnel ids of all recorded proxies."""
+        return {int(info.get("tunnel_id", port)) for port, info in self.state_manager.get_state().items()}
+
+    def get_pool_status(self) -> dict:
+        """Return the warm tunnel pool status per country (empty if the pool is disabled)."""
+        return self.pool.status() if self.pool else {}
+
+    def get_gateway_status(self) -> dict:
+        """Return the gateway port, policy and exits (empty if the gateway is disabled)."""
+        return self.gateway.status() if self.gateway else {}
+
     def list_countries(self) -> list[str]:
         """List available countries."""
         return self.vpn_manager.list_countries()
@@ -106,8 +483,28 @@ class ProxyService:
         """List available VPN configurations."""
         return self.vpn_manager.list_configs(country)
 
-    def get_status(self) -> dict:
-        """Get status of all running proxies."""
+    def get_catalog(self, country: str | None = None) -> list[dict]:
+        """Return the parsed metadata (remotes, protocol, cipher, hash) of the VPN configs."""
+        return self.vpn_manager.catalog.metadata(country)
+
+    def get_latencies(self, country: str, refresh: bool = False) -> list[dict]:
+        """Return the configs of a country with their measured latency, fastest first."""
+        latencies = self.vpn_manager.prober.latencies(country, force=refresh)
+        ordered = sorted(latencies, key=lambda name: (latencies[name] is None, latencies[name] or 0))
+        return [{"config": name, "latency_ms": latencies[name]} for name in ordered]
+
+    def catalog_version(self) -> str:
+        """Return a version string that changes whenever any VPN config changes."""
+        self.vpn_manager.catalog.refresh()
+        return self.vpn_manager.catalog.version
+
+    def get_status(self, live: bool = False) -> dict:
+        """
+        Get status of all running proxies.
+
+        With `live`, every proxy also gets the real state of its processes and tun
+        interface, from one /proc and /sys/class/net scan cached for LIVE_STATUS_TTL.
+        """
         state = self.state_manager.get_state()
         proxies = []
         for port, info in state.items():
@@ -120,13 +517,124 @@ class ProxyService:
                     "tun_ip": info.get("tun_ip", ""),
                     "start_time": info.get("start_time", ""),
                     "label": info.get("label"),
+                    "limits": info.get("limits"),
+                    "traffic": info.get("traffic"),
+                    "quota": info.get("quota"),
+                    "health": info.get("health"),
+                    "processes": self._process_status(int(port), info),
+                    "vpn": self.management.status(info.get("tunnel_id", port)) if self.management else None,
+                    "live": self.live.get(int(port), info, self.proxy_server.mode) if live else None,
                 }
             )
         return {"proxies": proxies, "total": len(proxies)}
 
-    def get_logs(self, port: int) -> dict:
-        """Get OpenVPN logs for a specific port."""
-        log_file = Path(f"/tmp/ovpn_{port}.log")
-        if log_file.exists():
-            return {"success": True, "port": port, "logs": log_file.read_text()}
-        return {"success": False, "port": port, "message": f"No log file found for port {port}."}
+    def reset_quota(self, port: int) -> dict:
+        """Start the traffic quota of a proxy over and lift its throttling."""
+        monitor = self.quota or QuotaMonitor(self)
+        if not monitor.reset(port):
+            return {"success": False, "message": f"No proxy with a traffic quota on port {port}."}
+        return {"success": True, "message": f"Traffic quota of port {port} reset."}
+
+    def list_users(self) -> list[dict]:
+        """Return every proxy user with the ports and countries it may use."""
+        return self.proxy_server.users.list()
+
+    def get_user(self, username: str) -> dict | None:
+        """Return a proxy user, or None."""
+        return self.proxy_server.users.get(username)
+
+    def add_user(
+        self, username: str, password: str, ports: list[int] | None = None, countries: list[str] | None = None
+    ) -> dict:
+        """
+        Create a proxy user; running proxies accept it right away, without a restart.
+
+        `ports` and `countries` limit the proxies the user may use (None = all).
+        """
+        try:
+            user = self.proxy_server.users.add(username, password, ports, countries)
+        except ValueError as e:
+            return {"success": False, "message": str(e)}
+        self.proxy_server.reload_users()
+        return {"success": True, "message": f"User {username} created.", "user": user}
+
+    def update_user(self, username: str, **changes) -> dict:
+        """Change the 'password', 'ports' or 'countries' of a proxy user, applied to running proxies."""
+        try:
+            user = self.proxy_server.users.update(username, **changes)
+        except ValueError as e:
+            return {"success": False, "message": str(e)}
+        if user is None:
+            return {"success": False, "message": f"No user {username}.", "missing": True}
+        self.proxy_server.reload_users()
+        return {"success": True, "message": f"User {username} updated.", "user": user}
+
+    def remove_user(self, username: str) -> dict:
+        """Delete a proxy user; running proxies refuse it right away."""
+        if not self.proxy_server.users.remove(username):
+            return {"success": False, "message": f"No user {username}."}
+        self.proxy_server.reload_users()
+        return {"success": True, "message": f"User {username} removed."}
+
+    def get_resources(self) -> dict:
+        """
+        Return the cgroup, the limits in effect and the resource usage of every proxy.
+
+        Proxies started while cgroups were disabled or unavailable have no cgroup
+        and report no usage.
+        """
+        cgroups = self.vpn_manager.cgroups
+        proxies = []
+        for port, info in self.state_manager.get_state().items():
+            tunnel_id = int(info.get("tunnel_id", port))
+            path = self.vpn_manager.cgroup_path(tunnel_id)
+            proxies.append(
+                {
+                    "port": port,
+                    "cgroup": str(path) if path else None,
+                    "limits": cgroups.limits(tunnel_id) if path else {},
+                    "usage": cgroups.usage(tunnel_id) if path else None,
+                }
+            )
+        enabled = cgroups is not None and cgroups.available()
+        return {"enabled": enabled, "proxies": proxies, "total": len(proxies)}
+
+    def _process_status(self, port: int, info: dict) -> dict | None:
+        """Return the supervisor records of a proxy's processes, None without a supervisor."""
+        if self.supervisor is None:
+            return None
+        names = {"openvpn": ("openvpn", int(info.get("tunnel_id", port))), "3proxy": ("3proxy", port)}
+        if self.proxy_server.mode == "shared":
+            names["3proxy"] = SHARED_NAME
+        return {process: self.supervisor.status(name) for process, name in names.items() if self.supervisor.knows(name)}
+
+    def log_file(self, port: int) -> str:
+        """Return the OpenVPN log path of a port, following the tunnel it uses."""
+        info = self.state_manager.get(port) or {}
+        return f"/tmp/ovpn_{info.get('tunnel_id', port)}.log"
+
+    def get_logs(self, port: int, tail: int | None = None, offset: int | None = None, limit: int = READ_LIMIT) -> dict:
+        """
+        Get OpenVPN logs for a specific port.
+
+        Returns the whole log, the last `tail` lines, or with `offset` up to `limit`
+        bytes from that byte offset on (`limit` also caps `tail`). 'next_offset' is
+        where to continue reading.
+        """
+        log_file = self.log_file(port)
+        if not Path(log_file).exists():
+            return {"success": False, "port": port, "message": f"No log file found for port {port}."}
+        limit = min(max(limit, 1), READ_LIMIT)
+        try:
+            if offset is not None:
+                logs, start, end, size = read_range(log_file, offset, limit)
+            elif tail is not None:
+                logs, start, end = read_tail(log_file, max(tail, 0), limit)
+                size = end
+            else:
+                # Kept small by the rotation at LOG_MAX_BYTES
+                data = Path(log_file).read_bytes()
+                logs, start, end, size = data.decode(errors="replace"), 0, len(data), len(data)
+        except OSError as e:
+            return {"success": False, "port": port, "message": f"Cannot read log for port {port}: {e}"}
+        return {"success": True, "port": port, "logs": logs, "offset": start, "next_offset": end, "size": size}
@@ -0,0 +1,296 @@
+"""
+Control-plane benchmark.
+
+Starts 1, 10, 100 and 500 proxies through the real ProxyService, measures the start
+latency of each, the latency and throughput of the REST API while other clients
+start and stop proxies through it, and the time stop-all takes to tear everything
+down. openvpn and 3proxy are replaced by the stand-ins of benchmarks/fakes, which
+connect after a configurable delay (or fail at a configurable rate) and create
+real tun devices, so routing, netlink, pid files, the management interface and the
+supervisor are exercised as in production. Everything runs in a throwaway sandbox
+(see harness.enter_sandbox), no root or VPN account needed.
+
+    uv run python -m benchmarks.control --sizes 1,10,100 --mode shared
+
+Every run is appended to benchmarks/results/control.jsonl and compared with the
+previous run of the same parameters; the exit status is 1 when a result got worse
+by more than --threshold.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import harness
+
+# Proxy ports of the measured proxies and of the ones started by API clients
+BASE_PORT = 20000
+CHURN_BASE_PORT = 40000
+# Endpoints read by the API clients, in turn
+READ_PATHS = [
+    "/api/v1/proxies/status",
+    "/api/v1/proxies/status?live=1",
+    "/metrics",
+    "/api/v1/countries",
+    "/api/v1/jobs",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark starting, serving and stopping proxies.")
+    parser.add_argument("--sizes", default="1,10,100,500", help="Comma-separated numbers of proxies")
+    parser.add_argument("--mode", default="per-port", choices=["per-port", "shared", "builtin"], help="PROXY_MODE")
+    parser.add_argument("--supervise", action="store_true", help="Run openvpn and 3proxy under the supervisor")
+    parser.add_argument("--parallelism", type=int, default=32, help="Concurrent proxy starts")
+    parser.add_argument("--connect-delay", type=float, default=0.2, help="Seconds until a fake tunnel connects")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Uniform +/- spread of the connect delay")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of fake tunnels that fail")
+    parser.add_argument("--api-clients", type=int, default=8, help="Concurrent API clients reading")
+    parser.add_argument("--api-requests", type=int, default=50, help="Requests per API client")
+    parser.add_argument("--churn-clients", type=int, default=2, help="API clients starting and stopping proxies")
+    parser.add_argument("--history", default=str(harness.RESULTS_DIR / "control.jsonl"), help="Results history")
+    parser.add_argument("--no-record", action="store_true", help="Do not append this run to the history")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative change reported as a regression")
+    return parser.parse_args()
+
+
+def configure(args):
+    """Set up the environment before core.config reads it."""
+    os.environ.update(
+        PATH=f"{harness.FAKES_DIR}:{os.environ.get('PATH', '')}",
+        PROXY_MODE=args.mode,
+        SUPERVISE="1" if args.supervise else "0",
+        OPENVPN_MANAGEMENT="1",
+        STATE_BACKEND="json",
+        # Latency probes would try to reach the real VPN servers
+        CONFIG_SELECTION="first",
+        HEALTH_CHECK_INTERVAL="0",
+        RECONCILE_ON_START="0",
+        GATEWAY_PORT="0",
+        POOL_TARGETS="",
+        API_AUTH_ENABLED="0",
+        PROXY_USER="bench",
+        PROXY_PASS="bench",
+        FAKE_OPENVPN_DELAY=str(args.connect_delay),
+        FAKE_OPENVPN_JITTER=str(args.jitter),
+        FAKE_OPENVPN_FAILURE_RATE=str(args.failure_rate),
+    )
+
+
+class APIServer:
+    """The FastAPI app served by uvicorn on a loopback port in a background thread."""
+
+    def __init__(self, app):
+        import uvicorn
+
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", access_log=False)
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, name="bench-api", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("The API server did not start")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=30)
+
+
+class Client:
+    """A keep-alive HTTP client recording the latency of every request."""
+
+    def __init__(self, port):
+        self.connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        self.latencies = []
+        self.errors = 0
+
+    def request(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.errors += 1
+            return None
+        self.latencies.append(time.perf_counter() - started)
+        if response.status >= 400:
+            self.errors += 1
+            return None
+        return json.loads(data) if response.getheader("Content-Type", "").startswith("application/json") else data
+
+    def run_job(self, path, body):
+        """Submit a job and poll it until it finished; returns the seconds it took, or None."""
+        started = time.perf_counter()
+        job = self.request("POST", path, body)
+        while job is not None and job["status"] not in ("succeeded", "failed"):
+            time.sleep(0.05)
+            job = self.request("GET", f"/api/v1/jobs/{job['id']}")
+        if job is None or job["status"] != "succeeded" or not (job["result"] or {}).get("success"):
+            return None
+        return time.perf_counter() - started
+
+    def close(self):
+        self.connection.close()
+
+
+def bench_starts(service, countries, size, parallelism):
+    """Start `size` proxies concurrently; returns each start's duration and the failures."""
+    specs = [(countries[i % len(countries)], BASE_PORT + i) for i in range(size)]
+
+    def start(spec):
+        started = time.perf_counter()
+        result = service.start_proxy(spec[0], None, spec[1])
+        return time.perf_counter() - started, result["success"]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(parallelism, size)) as executor:
+        outcomes = list(executor.map(start, specs))
+    wall = time.perf_counter() - started
+    durations = [duration for duration, success in outcomes if success]
+    return durations, size - len(durations), wall
+
+
+def bench_api(port, countries, clients, requests, churn_clients):
+    """
+    Read the API from `clients` threads while `churn_clients` start and stop proxies through it.
+
+    Returns:
+        dict: Read latencies, requests per second, job latencies and error counts.
+    """
+    readers = [Client(port) for _ in range(clients)]
+    churners = [Client(port) for _ in range(churn_clients)]
+    done = threading.Event()
+    job_durations, job_failures = [], []
+
+    def read(client):
+        for i in range(requests):
+            client.request("GET", READ_PATHS[i % len(READ_PATHS)])
+
+    def churn(index, client):
+        cycle = 0
+        while not done.is_set():
+            proxy_port = CHURN_BASE_PORT + index * 1000 + cycle % 1000
+            country = countries[(index + cycle) % len(countries)]
+            for path, body in [
+                ("/api/v1/proxies/start", {"country": country, "port": proxy_port}),
+                ("/api/v1/proxies/stop", {"port": proxy_port}),
+            ]:
+                duration = client.run_job(path, body)
+                (job_durations if duration is not None else job_failures).append(duration)
+            cycle += 1
+
+    threads = [threading.Thread(target=churn, args=(i, c), daemon=True) for i, c in enumerate(churners)]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(read, readers))
+    elapsed = time.perf_counter() - started
+    done.set()
+    for thread in threads:
+        thread.join()
+    for client in readers + churners:
+        client.close()
+
+    latencies = [latency for client in readers for latency in client.latencies]
+    return {
+        **harness.summarize("api", latencies),
+        "api_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "api_errors": sum(client.errors for client in readers),
+        **harness.summarize("job", job_durations),
+        "job_failures": len(job_failures),
+    }
+
+
+def bench_stop_all(service):
+    """Stop every proxy; returns the seconds it took and the processes left over."""
+    from core.procfs import find_processes
+
+    started = time.perf_counter()
+    service.stop_all_proxies()
+    duration = time.perf_counter() - started
+    return duration, len(find_processes({"openvpn", "3proxy"}))
+
+
+def run(args):
+    configure(args)
+
+    # Imported only now, as core.config reads the environment on import
+    from api.app import app
+    from api.routes import service
+    from core.state import StateManager
+
+    # The default state file lives in the repository
+    service.state_manager = StateManager(state_file="/tmp/bench_state.json")
+    service.proxy_server.state_manager = service.state_manager
+    countries = service.list_countries()
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+
+    rows, results = [], {}
+    with APIServer(app) as api:
+        for size in sizes:
+            print(f"Benchmarking {size} proxies ...", flush=True)
+            durations, failures, wall = bench_starts(service, countries, size, args.parallelism)
+            row = {
+                "proxies": size,
+                **harness.summarize("start", durations),
+                "start_wall_ms": round(wall * 1000, 1),
+                "start_failures": failures,
+            }
+            row.update(bench_api(api.port, countries, args.api_clients, args.api_requests, args.churn_clients))
+            stop_all, leftover = bench_stop_all(service)
+            row["stop_all_ms"] = round(stop_all * 1000, 1)
+            row["leftover_processes"] = leftover
+            rows.append(row)
+            results.update({f"{size}.{name}": value for name, value in row.items() if name != "proxies"})
+
+    print()
+    harness.print_table(
+        rows,
+        [
+            "proxies",
+            "start_p50_ms",
+            "start_p99_ms",
+            "start_wall_ms",
+            "start_failures",
+            "api_p50_ms",
+            "api_p99_ms",
+            "api_rps",
+            "job_p50_ms",
+            "job_p99_ms",
+            "stop_all_ms",
+            "leftover_processes",
+        ],
+    )
+    if args.no_record:
+        return 0
+    params = {
+        key: value for key, value in vars(args).items() if key not in ("sizes", "history", "no_record", "threshold")
+    }
+    regressions = harness.record(args.history, "control", params, results, args.threshold)
+    return harness.report_regressions(regressions)
+
+
+def main():
+    args = parse_args()
+    harness.enter_sandbox("benchmarks.control")
+    raise SystemExit(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""
+Data-plane benchmark.
+
+Pushes HTTP and HTTPS (CONNECT) load through N proxy ports and reports, per proxy
+mode, the aggregate and per-port requests per second and MB/s, the connection
+setup latency and the CPU the proxy processes spent.
+
+Everything runs in a throwaway sandbox (see harness.enter_sandbox). A local origin
+(benchmarks/origin.py) runs in a network namespace of its own, and every proxy
+port gets a veth pair standing in for its tun interface, with the routing set up
+by VPNManager like for a real tunnel, so traffic leaves each port through "its"
+interface exactly as in production. The proxies serve the configs ProxyServer
+generates:
+
+- builtin: the ForwardingEngine in a process of its own;
+- per-port: one 3proxy daemon per port;
+- shared: one 3proxy daemon serving every port.
+
+The 3proxy modes need the real 3proxy on PATH and are skipped without it.
+
+    uv run python -m benchmarks.dataplane --ports 1,10 --modes builtin,shared --size 65536
+
+Like the control-plane benchmark, every run is appended to
+benchmarks/results/dataplane.jsonl and compared with the previous run of the same
+parameters.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import resource
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from benchmarks import harness
+
+# Address of the origin, reached from every exit interface
+ORIGIN_IP = "192.0.2.1"
+BASE_PORT = 20000
+USER = "bench"
+PASSWORD = "bench"
+# Seconds proxies and the origin get to come up
+READY_TIMEOUT = 15
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark throughput through local proxy ports.")
+    parser.add_argument("--ports", default="1,10", help="Comma-separated numbers of proxy ports")
+    parser.add_argument("--modes", default="builtin,per-port,shared", help="ProxyServer modes to compare")
+    parser.add_argument("--schemes", default="http,https", help="http (forwarded GET) and/or https (CONNECT + TLS)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent connections per port")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds of load per run")
+    parser.add_argument("--size", type=int, default=65536, help="Response body size in bytes")
+    parser.add_argument("--per-port", action="store_true", help="Also print the throughput of every port")
+    parser.add_argument("--history", default=str(harness.RESULTS_DIR / "dataplane.jsonl"), help="Results history")
+    parser.add_argument("--no-record", action="store_true", help="Do not append this run to the history")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative change reported as a regression")
+    # Internal: run the builtin forwarding engine for the given listeners
+    parser.add_argument("--serve-forwarder", metavar="LISTENERS", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def tunnels(count):
+    """Return (port, tun_ip, interface) of the first `count` proxy ports."""
+    return [(BASE_PORT + i, f"10.200.{(i + 1) >> 8}.{(i + 1) & 255}", f"tun{BASE_PORT + i}") for i in range(count)]
+
+
+# ---------- Origin and network ----------
+
+
+def make_certificate():
+    """Create a self-signed certificate for the origin; returns (cert, key) or None without openssl."""
+    cert, key = "/tmp/origin.pem", "/tmp/origin.key"
+    try:
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=origin"]
+            + ["-keyout", key, "-out", cert],
+            check=True,
+            capture_output=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return cert, key
+
+
+def start_origin(certificate):
+    """Start the origin in a network namespace of its own; returns its process."""
+    command = ["unshare", "--net", "--", sys.executable, "-m", "benchmarks.origin"]
+    if certificate:
+        command += ["--cert", certificate[0], "--key", certificate[1]]
+    origin = subprocess.Popen(command, cwd=harness.REPO_DIR, stdout=subprocess.PIPE, text=True)
+    if origin.stdout.readline().strip() != "ready":
+        raise RuntimeError("The origin server did not start")
+    return origin
+
+
+def setup_network(origin, entries, vpn_manager):
+    """
+    Give every proxy port a veth pair leading into the origin's namespace.
+
+    The proxy side is named and addressed like the port's tun interface and gets
+    the port's policy routing; the origin side answers for ORIGIN_IP and routes
+    replies back over the same pair.
+    """
+    host, inside = [], []
+    for i, (_, tun_ip, interface) in enumerate(entries):
+        peer = f"origin{i}"
+        host += [
+            f"link add {interface} type veth peer name {peer}",
+            f"link set {peer} netns {origin.pid}",
+            f"addr add {tun_ip}/32 dev {interface}",
+            f"link set {interface} up",
+        ]
+        inside += [
+            f"addr add {ORIGIN_IP}/32 dev {peer}",
+            f"link set {peer} up",
+            f"route add {tun_ip}/32 dev {peer}",
+        ]
+    subprocess.run(["ip", "-batch", "-"], input="\n".join(host) + "\n", text=True, check=True)
+    subprocess.run(
+        ["nsenter", f"--net=/proc/{origin.pid}/ns/net", "ip", "-batch", "-"],
+        input="\n".join(inside) + "\n",
+        text=True,
+        check=True,
+    )
+    vpn_manager.setup_routing_many(entries)
+
+
+# ---------- Proxies ----------
+
+
+def find_3proxy():
+    """Return the path of the real 3proxy, ignoring the control-plane stand-in."""
+    path = shutil.which("3proxy")
+    if path is None or Path(path).resolve().parent == harness.FAKES_DIR:
+        return None
+    return path
+
+
+def serve_forwarder(listeners):
+    """Run the builtin forwarding engine for a fixed set of listeners until killed."""
+    from proxy.forwarder import ForwardingEngine
+
+    listeners = {int(port): tun_ip for port, tun_ip in json.loads(listeners).items()}
+    engine = ForwardingEngine(listener_source=lambda: listeners)
+    asyncio.run(engine.serve())
+
+
+def start_proxies(mode, entries, three_proxy):
+    """
+    Serve the ports of `entries` in `mode`.
+
+    Returns:
+        list: The PIDs of the proxy processes.
+    """
+    listeners = {port: tun_ip for port, tun_ip, _ in entries}
+    if mode == "builtin":
+        command = [sys.executable, "-m", "benchmarks.dataplane", "--serve-forwarder", json.dumps(listeners)]
+        pids = [subprocess.Popen(command, cwd=harness.REPO_DIR).pid]
+    else:
+        from proxy.server import ProxyServer
+
+        server = ProxyServer(user=USER, password=PASSWORD, mode=mode)
+        configs = {"shared": listeners} if mode == "shared" else {port: {port: ip} for port, ip in listeners.items()}
+        pid_files = []
+        for name, served in configs.items():
+            cfg_file, pid_file = f"/tmp/3proxy_{name}.cfg", f"/tmp/3proxy_{name}.pid"
+            Path(cfg_file).write_text(server.build_config(served, pid_file))
+            subprocess.run([three_proxy, cfg_file], check=True)
+            pid_files.append(pid_file)
+        pids = wait_for_pid_files(pid_files)
+    wait_for_ports(listeners)
+    return pids
+
+
+def wait_for_pid_files(pid_files):
+    from core.procfs import read_pid_file
+
+    deadline = time.monotonic() + READY_TIMEOUT
+    while True:
+        pids = [read_pid_file(path) for path in pid_files]
+        if all(pids):
+            return pids
+        if time.monotonic() > deadline:
+            raise RuntimeError("3proxy did not write its pid files")
+        time.sleep(0.05)
+
+
+def wait_for_ports(ports):
+    deadline = time.monotonic() + READY_TIMEOUT
+    for port in ports:
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Nothing listens on port {port}") from None
+                time.sleep(0.05)
+
+
+# ---------- Load ----------
+
+
+class PortResult:
+    """Requests, bytes, setup latencies and errors seen on one proxy port."""
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.setup = []
+        self.errors = 0
+
+
+async def read_head(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    status_line, *lines = head.decode("latin-1").split("\r\n")
+    headers = dict(line.lower().split(": ", 1) for line in lines if ": " in line)
+    return int(status_line.split(" ", 2)[1]), headers
+
+
+async def one_request(port, scheme, size, tls, result):
+    """
+    Fetch one response through `port` over a new connection.
+
+    The setup latency runs until the proxy answered CONNECT (https) or, for plain
+    HTTP where the upstream connection is not visible, until the response head.
+    """
+    authorization = base64.b64encode(f"{USER}:{PASSWORD}".encode()).decode()
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=1 << 20)
+    try:
+        if scheme == "https":
+            writer.write(
+                f"CONNECT {ORIGIN_IP}:443 HTTP/1.1\r\nHost: {ORIGIN_IP}:443\r\n"
+                f"Proxy-Authorization: Basic {authorization}\r\n\r\n".encode()
+            )
+            status, _ = await read_head(reader)
+            if status != 200:
+                raise ValueError(f"CONNECT answered {status}")
+            setup = time.perf_counter() - started
+            await writer.start_tls(tls, server_hostname="origin")
+            writer.write(f"GET /bytes/{size} HTTP/1.1\r\nHost: {ORIGIN_IP}\r\nConnection: close\r\n\r\n".encode())
+            status, headers = await read_head(reader)
+        else:
+            writer.write(
+                f"GET http://{ORIGIN_IP}/bytes/{size} HTTP/1.1\r\nHost: {ORIGIN_IP}\r\n"
+                f"Proxy-Authorization: Basic {authorization}\r\nConnection: close\r\n\r\n".encode()
+            )
+            status, headers = await read_head(reader)
+            setup = time.perf_counter() - started
+        if status != 200:
+            raise ValueError(f"Request answered {status}")
+        remaining = int(headers.get("content-length", 0))
+        while remaining:
+            chunk = await reader.read(min(remaining, 1 << 20))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            remaining -= len(chunk)
+    finally:
+        writer.close()
+    result.requests += 1
+    result.bytes += size
+    result.setup.append(setup)
+
+
+async def drive(ports, scheme, size, concurrency, duration):
+    """Keep `concurrency` requests in flight on every port for `duration` seconds."""
+    tls = ssl.create_default_context()
+    tls.check_hostname = False
+    tls.verify_mode = ssl.CERT_NONE
+    results = {port: PortResult() for port in ports}
+    deadline = time.monotonic() + duration
+
+    async def worker(port):
+        while time.monotonic() < deadline:
+            try:
+                await one_request(port, scheme, size, tls, results[port])
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ssl.SSLError):
+                results[port].errors += 1
+                await asyncio.sleep(0.01)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(port) for port in ports for _ in range(concurrency)))
+    return results, time.perf_counter() - started
+
+
+def cpu_seconds(pids):
+    from core.procfs import process_stats
+
+    return sum(stats["cpu_seconds"] for stats in process_stats(pids).values())
+
+
+def bench(mode, scheme, entries, args, three_proxy):
+    """Serve `entries` in `mode`, load them and stop the proxies again; returns the result row."""
+    from core.process import terminate
+
+    pids = start_proxies(mode, entries, three_proxy)
+    try:
+        proxy_cpu = cpu_seconds(pids)
+        client_cpu = resource.getrusage(resource.RUSAGE_SELF)
+        results, elapsed = asyncio.run(
+            drive([port for port, _, _ in entries], scheme, args.size, args.concurrency, args.duration)
+        )
+        proxy_cpu = cpu_seconds(pids) - proxy_cpu
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        client_cpu = usage.ru_utime + usage.ru_stime - client_cpu.ru_utime - client_cpu.ru_stime
+    finally:
+        terminate(pids)
+
+    requests = sum(r.requests for r in results.values())
+    port_rps = {port: r.requests / elapsed for port, r in results.items()}
+    row = {
+        "mode": mode,
+        "scheme": scheme,
+        "ports": len(entries),
+        "total_rps": round(requests / elapsed, 1),
+        "total_mb_s": round(sum(r.bytes for r in results.values()) / elapsed / 1e6, 2),
+        "port_min_rps": round(min(port_rps.values()), 1),
+        "port_max_rps": round(max(port_rps.values()), 1),
+        **harness.summarize("setup", [s for r in results.values() for s in r.setup]),
+        "errors": sum(r.errors for r in results.values()),
+        "proxy_cpu_pct": round(proxy_cpu / elapsed * 100, 1),
+        "proxy_cpu_us_per_req": round(proxy_cpu / requests * 1e6, 1) if requests else None,
+        "client_cpu_pct": round(client_cpu / elapsed * 100, 1),
+    }
+    per_port = [
+        {
+            "mode": mode,
+            "scheme": scheme,
+            "port": port,
+            "rps": round(port_rps[port], 1),
+            "mb_s": round(r.bytes / elapsed / 1e6, 2),
+            **harness.summarize("setup", r.setup),
+            "errors": r.errors,
+        }
+        for port, r in results.items()
+    ]
+    return row, per_port
+
+
+def run(args):
+    os.environ.update(PROXY_USER=USER, PROXY_PASS=PASSWORD)
+    from vpn.manager import VPNManager
+
+    sizes = [int(n) for n in args.ports.split(",") if n.strip()]
+    schemes = [s for s in args.schemes.split(",") if s.strip()]
+    modes = [m for m in args.modes.split(",") if m.strip()]
+    three_proxy = find_3proxy()
+    if three_proxy is None and any(mode != "builtin" for mode in modes):
+        print("3proxy not found on PATH: skipping the per-port and shared modes.")
+        modes = [mode for mode in modes if mode == "builtin"]
+    certificate = make_certificate() if "https" in schemes else None
+    if "https" in schemes and certificate is None:
+        print("openssl not found: skipping HTTPS.")
+        schemes.remove("https")
+
+    origin = start_origin(certificate)
+    rows, port_rows, results = [], [], {}
+    try:
+        entries = tunnels(max(sizes))
+        setup_network(origin, entries, VPNManager())
+        for size in sizes:
+            for mode in modes:
+                for scheme in schemes:
+                    print(f"Benchmarking {mode} over {scheme} on {size} ports ...", flush=True)
+                    row, per_port = bench(mode, scheme, entries[:size], args, three_proxy)
+                    rows.append(row)
+                    port_rows += per_port
+                    prefix = f"{mode}.{scheme}.{size}"
+                    results.update({f"{prefix}.{k}": v for k, v in row.items() if k not in ("mode", "scheme", "ports")})
+    finally:
+        origin.terminate()
+        origin.wait()
+
+    if args.per_port:
+        print()
+        harness.print_table(
+            port_rows, ["mode", "scheme", "port", "rps", "mb_s", "setup_p50_ms", "setup_p99_ms", "errors"]
+        )
+    print()
+    harness.print_table(
+        rows,
+        [
+            "mode",
+            "scheme",
+            "ports",
+            "total_rps",
+            "total_mb_s",
+            "port_min_rps",
+            "port_max_rps",
+            "setup_p50_ms",
+            "setup_p99_ms",
+            "errors",
+            "proxy_cpu_pct",
+            "proxy_cpu_us_per_req",
+            "client_cpu_pct",
+        ],
+    )
+    if args.no_record:
+        return 0
+    params = {"concurrency": args.concurrency, "duration": args.duration, "size": args.size, "cpus": os.cpu_count()}
+    regressions = harness.record(args.history, "dataplane", params, results, args.threshold)
+    return harness.report_regressions(regressions)
+
+
+def main():
+    args = parse_args()
+    if args.serve_forwarder:
+        serve_forwarder(args.serve_forwarder)
+        return
+    harness.enter_sandbox("benchmarks.dataplane")
+    raise SystemExit(run(args))
+
+
+if __name__ == "__main__":
+    main()
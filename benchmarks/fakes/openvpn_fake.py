@@ -0,0 +1,188 @@
+"""
+Stand-in for openvpn used by the benchmarks, started through the `openvpn` wrapper.
+
+Understands the options VPNManager passes: --dev, --daemon, --writepid, --log-append
+and --management <socket> unix (state history, real-time state and bytecount). After
+a connect delay it opens --dev as a tun device, assigns an address derived from the
+tunnel id and holds the device until it exits, or fails like an authentication error.
+
+Environment:
+    FAKE_OPENVPN_DELAY         Mean seconds until connected (default 0.2).
+    FAKE_OPENVPN_JITTER        Uniform +/- spread of the delay (default 0.1).
+    FAKE_OPENVPN_FAILURE_RATE  Probability a start fails (default 0).
+"""
+
+import contextlib
+import fcntl
+import os
+import random
+import selectors
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+TUNSETIFF = 0x400454CA
+IFF_TUN = 0x0001
+IFF_NO_PI = 0x1000
+
+
+def option(args, name, default=None):
+    return args[args.index(name) + 1] if name in args else default
+
+
+class FakeOpenVPN:
+    def __init__(self, args, log):
+        self.dev = option(args, "--dev", "tun0")
+        self.tunnel_id = int("".join(c for c in self.dev if c.isdigit()) or 0)
+        self.log = log
+        self.management = option(args, "--management")
+        self.history = []
+        self.clients = {}
+        self.bytecount = 0
+        self.selector = selectors.DefaultSelector()
+        self.stopping = False
+        self.server = None
+        self.tun = None
+        # Signals wake up the selector through this pipe
+        self.wake_r, wake_w = os.pipe()
+        os.set_blocking(wake_w, False)
+        signal.set_wakeup_fd(wake_w)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+
+    @property
+    def tun_ip(self):
+        n = self.tunnel_id
+        return f"10.{100 + (n >> 16)}.{(n >> 8) & 255}.{n & 255}"
+
+    def state(self, name, description="SUCCESS", tun_ip=""):
+        line = f"{int(time.time())},{name},{description},{tun_ip},192.0.2.1,1194,,"
+        self.history.append(line)
+        self.push(f">STATE:{line}")
+
+    def push(self, line):
+        for client in list(self.clients):
+            self.send(client, line)
+
+    def send(self, client, line):
+        try:
+            client.sendall(f"{line}\r\n".encode())
+        except OSError:
+            self.drop(client)
+
+    def drop(self, client):
+        if self.clients.pop(client, None) is not None:
+            self.selector.unregister(client)
+            client.close()
+
+    def listen(self):
+        if not self.management:
+            return
+        self.server = socket.socket(socket.AF_UNIX)
+        self.server.bind(self.management)
+        self.server.listen()
+        self.selector.register(self.server, selectors.EVENT_READ)
+
+    def accept(self):
+        client, _ = self.server.accept()
+        self.clients[client] = b""
+        self.selector.register(client, selectors.EVENT_READ)
+        self.send(client, ">INFO:OpenVPN Management Interface Version 5 -- benchmark stand-in")
+
+    def command(self, client):
+        data = client.recv(4096)
+        if not data:
+            self.drop(client)
+            return
+        buffer = self.clients[client] + data
+        *lines, self.clients[client] = buffer.split(b"\n")
+        for line in lines:
+            words = line.decode().split()
+            if words[:1] == ["state"]:
+                self.send(client, "SUCCESS: real-time state notification set to ON")
+                for entry in self.history:
+                    self.send(client, entry)
+                self.send(client, "END")
+            elif words[:1] == ["bytecount"]:
+                self.bytecount = int(words[1]) if len(words) > 1 else 0
+                self.send(client, "SUCCESS: bytecount interval changed")
+            else:
+                self.send(client, "ERROR: unknown command")
+
+    def run(self, delay, failure_rate):
+        self.listen()
+        self.log.write(f"{time.ctime()} OpenVPN benchmark stand-in\n")
+        self.state("CONNECTING")
+        connect_at = time.monotonic() + delay
+        next_bytecount = None
+        while not self.stopping:
+            now = time.monotonic()
+            if connect_at is not None and now >= connect_at:
+                connect_at = None
+                if random.random() < failure_rate:
+                    self.log.write(f"{time.ctime()} AUTH: Received control message: AUTH_FAILED\n")
+                    self.state("EXITING", "auth-failure")
+                    return 1
+                self.connect()
+                next_bytecount = now
+            if next_bytecount is not None and self.bytecount and now >= next_bytecount:
+                self.push(f">BYTECOUNT:{int(now * 1000) % 10**9},{int(now * 100) % 10**9}")
+                next_bytecount = now + self.bytecount
+            deadlines = [t for t in (connect_at, next_bytecount if self.bytecount else None) if t is not None]
+            timeout = max(min(deadlines) - now, 0) if deadlines else None
+            for key, _ in self.selector.select(timeout):
+                if key.fileobj == self.wake_r:
+                    os.read(self.wake_r, 512)
+                elif key.fileobj is self.server:
+                    self.accept()
+                else:
+                    self.command(key.fileobj)
+        # The tun device disappears with the last descriptor, as with the real OpenVPN
+        self.state("EXITING", "exit-with-notification")
+        return 0
+
+    def connect(self):
+        self.tun = os.open("/dev/net/tun", os.O_RDWR)
+        fcntl.ioctl(self.tun, TUNSETIFF, struct.pack("16sH", self.dev.encode(), IFF_TUN | IFF_NO_PI))
+        commands = f"link set {self.dev} up\naddr add {self.tun_ip}/32 dev {self.dev}\n"
+        subprocess.run(["ip", "-batch", "-"], input=commands.encode(), stderr=subprocess.DEVNULL)
+        self.log.write(f"{time.ctime()} Initialization Sequence Completed\n")
+        self.state("CONNECTED", tun_ip=self.tun_ip)
+
+    def stop(self, *_):
+        self.stopping = True
+
+
+def main():
+    args = sys.argv[1:]
+    if "--daemon" in args:
+        if os.fork():
+            return 0
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+    pid_file = option(args, "--writepid")
+    if pid_file:
+        with open(pid_file, "w") as f:
+            f.write(f"{os.getpid()}\n")
+
+    delay = float(os.environ.get("FAKE_OPENVPN_DELAY", "0.2"))
+    jitter = float(os.environ.get("FAKE_OPENVPN_JITTER", "0.1"))
+    failure_rate = float(os.environ.get("FAKE_OPENVPN_FAILURE_RATE", "0"))
+    with open(option(args, "--log-append", os.devnull), "a", buffering=1) as log:
+        vpn = FakeOpenVPN(args, log)
+        signal.signal(signal.SIGTERM, vpn.stop)
+        signal.signal(signal.SIGINT, vpn.stop)
+        try:
+            return vpn.run(max(delay + random.uniform(-jitter, jitter), 0), failure_rate)
+        finally:
+            if vpn.management:
+                with contextlib.suppress(OSError):
+                    os.unlink(vpn.management)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+Shared helpers of the benchmarks.
+
+Runs a benchmark in a throwaway sandbox, summarizes latencies and keeps a JSON Lines
+history in which every run is compared with the previous run of the same benchmark
+and parameters.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+FAKES_DIR = BENCH_DIR / "fakes"
+RESULTS_DIR = BENCH_DIR / "results"
+
+# Results whose name ends like this are throughputs (higher is better); all others
+# are durations or counts (lower is better)
+HIGHER_IS_BETTER = ("_rps", "_mb_s")
+# Changes of durations below this many milliseconds are noise, whatever the ratio
+NOISE_FLOOR_MS = 5
+
+
+def enter_sandbox(module):
+    """
+    Re-run `python -m module` with the current arguments inside a sandbox.
+
+    The sandbox has its own user, network, mount and PID namespaces: the benchmark
+    acts as root without being root, gets a private loopback, interfaces and routing
+    tables and a private /tmp, and sees only its own processes. Nothing the proxies
+    create reaches the host, and everything still running is killed when the
+    benchmark exits. Returns in the sandboxed process; the caller exits with its status.
+    """
+    if os.environ.get("BENCH_SANDBOX") == "1":
+        return
+    command = [
+        "unshare",
+        "--user",
+        "--map-root-user",
+        "--net",
+        "--mount",
+        "--pid",
+        "--fork",
+        "--mount-proc",
+        "--",
+        sys.executable,
+        "-m",
+        "benchmarks.harness",
+        module,
+        *sys.argv[1:],
+    ]
+    try:
+        returncode = subprocess.run(command, cwd=REPO_DIR).returncode
+    except FileNotFoundError:
+        sys.exit("unshare (util-linux) is required to run the benchmarks")
+    sys.exit(returncode)
+
+
+def _init(module, args):
+    """
+    Act as PID 1 of the sandbox.
+
+    Prepares /tmp and the loopback, runs the benchmark and reaps the daemons that
+    are orphaned when openvpn and 3proxy detach, as init would on a real host.
+    """
+    subprocess.run(["mount", "-t", "tmpfs", "tmpfs", "/tmp"], check=True)
+    # /sys/class/net shows the interfaces of the namespace sysfs was mounted in
+    subprocess.run(["mount", "-t", "sysfs", "sysfs", "/sys"], check=True)
+    subprocess.run(["ip", "link", "set", "lo", "up"], check=True)
+    env = {**os.environ, "BENCH_SANDBOX": "1"}
+    benchmark = subprocess.Popen([sys.executable, "-m", module, *args], cwd=REPO_DIR, env=env)
+    while True:
+        try:
+            pid, status = os.wait()
+        except InterruptedError:
+            continue
+        if pid == benchmark.pid:
+            return os.waitstatus_to_exitcode(status)
+
+
+def percentile(values, pct):
+    """Return the `pct` percentile of `values` (linear interpolation), or None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(prefix, durations):
+    """Return p50, p99 and max of `durations` (seconds) in milliseconds, keyed `<prefix>_p50_ms`, ..."""
+    return {
+        f"{prefix}_p50_ms": _ms(percentile(durations, 50)),
+        f"{prefix}_p99_ms": _ms(percentile(durations, 99)),
+        f"{prefix}_max_ms": _ms(max(durations, default=None)),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def print_table(rows, columns):
+    """Print `rows` (dicts) as an aligned table of `columns`."""
+    cells = [[_format(row.get(column)) for column in columns] for row in rows]
+    widths = [max(len(column), *(len(line[i]) for line in cells)) for i, column in enumerate(columns)]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths, strict=True)))
+    for line in cells:
+        print("  ".join(cell.rjust(width) for cell, width in zip(line, widths, strict=True)))
+
+
+def _format(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.1f}"
+    return str(value)
+
+
+def git_revision():
+    """Return the current commit (with a "+" when the tree has local changes), or None."""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "-uno"], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("+" if dirty else "")
+
+
+def record(history, benchmark, params, results, threshold):
+    """
+    Append a run to the JSON Lines file `history` and compare it with the previous one.
+
+    Only runs of the same benchmark with identical `params` are compared. A result
+    regresses when it is more than `threshold` (a fraction) worse than before.
+
+    Args:
+        history (str): The history file; created with its directory if missing.
+        benchmark (str): The benchmark name.
+        params (dict): Everything that makes runs comparable (sizes, mode, delays, ...).
+        results (dict): Flat mapping of result names to numbers.
+        threshold (float): Allowed relative change, e.g. 0.2 for 20 %.
+
+    Returns:
+        list: (name, previous, current, change) of every regressed result.
+    """
+    history = Path(history)
+    previous = None
+    if history.exists():
+        for line in history.read_text().splitlines():
+            try:
+                run = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if run.get("benchmark") == benchmark and run.get("params") == params:
+                previous = run
+
+    regressions = []
+    for name, value in results.items():
+        old = (previous or {}).get("results", {}).get(name)
+        if not isinstance(value, int | float) or not isinstance(old, int | float) or old == 0:
+            continue
+        change = (value - old) / old
+        if name.endswith(HIGHER_IS_BETTER):
+            change = -change
+        elif name.endswith("_ms") and abs(value - old) < NOISE_FLOOR_MS:
+            continue
+        if change > threshold:
+            regressions.append((name, old, value, change))
+
+    history.parent.mkdir(parents=True, exist_ok=True)
+    run = {
+        "benchmark": benchmark,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "revision": git_revision(),
+        "host": {"machine": platform.machine(), "kernel": platform.release(), "cpus": os.cpu_count()},
+        "params": params,
+        "results": results,
+    }
+    with history.open("a") as f:
+        f.write(json.dumps(run, sort_keys=True) + "\n")
+    return regressions
+
+
+def report_regressions(regressions):
+    """Print regressions; returns the exit status for the benchmark (1 if any)."""
+    if not regressions:
+        print("\nNo regressions against the previous comparable run.")
+        return 0
+    print("\nRegressions against the previous comparable run:")
+    for name, old, new, change in regressions:
+        print(f"  {name}: {old} -> {new} ({change:+.0%})")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(_init(sys.argv[1], sys.argv[2:]))
@@ -0,0 +1,72 @@
+"""
+Local HTTP and HTTPS origin server for the data-plane benchmark.
+
+`GET /bytes/<n>` is answered with n bytes, over HTTP on port 80 and, given a
+certificate, HTTPS on port 443. Connections are kept alive unless the client sends
+"Connection: close". Prints "ready" once it listens.
+
+    python -m benchmarks.origin [--cert cert.pem --key key.pem]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import ssl
+
+HTTP_PORT = 80
+HTTPS_PORT = 443
+# Response bodies are sent as slices of this buffer
+PAYLOAD = memoryview(bytes(1 << 20))
+
+
+async def handle(reader, writer):
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            request_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+            _, path, _ = request_line.split(" ", 2)
+            size = int(path.rsplit("/", 1)[1]) if path.startswith("/bytes/") else 0
+            close = b"\r\nconnection: close" in head.lower()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n"
+                + f"Content-Length: {size}\r\n".encode()
+                + (b"Connection: close\r\n" if close else b"")
+                + b"\r\n"
+            )
+            while size:
+                chunk = min(size, len(PAYLOAD))
+                writer.write(PAYLOAD[:chunk])
+                size -= chunk
+                await writer.drain()
+            await writer.drain()
+            if close:
+                return
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError, ssl.SSLError):
+        pass
+    finally:
+        writer.close()
+        with contextlib.suppress(ConnectionError, ssl.SSLError):
+            await writer.wait_closed()
+
+
+async def serve(cert, key):
+    servers = [await asyncio.start_server(handle, "0.0.0.0", HTTP_PORT, backlog=4096)]
+    if cert:
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(cert, key)
+        servers.append(await asyncio.start_server(handle, "0.0.0.0", HTTPS_PORT, ssl=context, backlog=4096))
+    print("ready", flush=True)
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP/HTTPS origin for the data-plane benchmark.")
+    parser.add_argument("--cert", help="PEM certificate; enables HTTPS")
+    parser.add_argument("--key", help="PEM private key of --cert")
+    args = parser.parse_args()
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(serve(args.cert, args.key))
+
+
+if __name__ == "__main__":
+    main()
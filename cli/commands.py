@@ -1,9 +1,20 @@
+import asyncio
+import contextlib
 import subprocess
 import time
 from pathlib import Path
 
+from api.service import ProxyService
+from core import logfile
+from core.config import START_PARALLELISM
 from core.state import StateManager
-from proxy.instance import ProxyInstance
+from proxy.fleet import load_fleet
+from proxy.forwarder import ForwardingEngine
+from proxy.gateway import GatewayEngine
+from proxy.health import HealthMonitor
+from proxy.instance import ProxyInstance, stop_instances
+from proxy.live import LiveStatus
+from proxy.quota import QuotaMonitor, new_quota
 from proxy.server import ProxyServer
 from vpn.manager import VPNManager
 
@@ -16,16 +27,15 @@ class ProxyApp:
     def __init__(self):
         self.state_manager = StateManager()
         self.vpn_manager = VPNManager()
-        self.proxy_server = ProxyServer()
+        self.proxy_server = ProxyServer(state_manager=self.state_manager)
 
-    def start_proxy(self, country, config, port, label=None):
-        """Start a new proxy instance."""
-        port_str = str(port)
-        state = self.state_manager.get_state()
+    def start_proxy(self, country, config, port, label=None, limits=None, traffic=None):
+        """Start a new proxy instance, with optional cgroup resource limits and traffic limits."""
+        info = self.state_manager.get(port)
 
-        instance = ProxyInstance(port, self.vpn_manager, self.proxy_server)
+        instance = ProxyInstance(port, self.vpn_manager, self.proxy_server, limits=limits, traffic=traffic)
 
-        if port_str in state:
+        if info is not None:
             print(f"Port {port} is already recorded in state.")
             # Verify if it's actually running
             running, pid = instance.is_running()
@@ -33,14 +43,20 @@ class ProxyApp:
                 print(f"Error: Process with PID {pid} is already running for port {port}.")
                 return False
             print("It seems to be an orphaned state. Cleaning up...")
-            del state[port_str]
-            self.state_manager.save_state(state)
+            self.state_manager.compare_and_swap(port, info, None)
 
         running, pid = instance.is_running()
         if running:
             print(f"Error: Process with PID {pid} is already running for port {port}. Please run 'stop {port}' first.")
             return False
 
+        if config is None:
+            in_use = {info.get("config") for info in self.state_manager.get_state().values()}
+            config = self.vpn_manager.pick_config(country, in_use)
+            if config is None:
+                print(f"Error: no configs found for country {country}.")
+                return False
+
         print(f"Starting OpenVPN for {country}/{config} on {instance.tun_interface}...")
         success, result = instance.start(country, config)
 
@@ -56,7 +72,7 @@ class ProxyApp:
         tun_ip = result
         print(f"Interface {instance.tun_interface} got IP: {tun_ip}")
 
-        state[port_str] = {
+        entry = {
             "country": country,
             "config": config,
             "tun_interface": instance.tun_interface,
@@ -64,24 +80,48 @@ class ProxyApp:
             "start_time": time.ctime(),
             "label": label,
         }
-        self.state_manager.save_state(state)
+        if instance.limits:
+            entry["limits"] = instance.limits
+        if instance.traffic:
+            entry["traffic"] = instance.traffic
+            if instance.traffic.get("quota_bytes"):
+                entry["quota"] = new_quota(instance.tun_interface)
+        if not self.state_manager.compare_and_swap(port, None, entry):
+            print(f"Error: port {port} was claimed by another process while starting.")
+            return False
         print(f"Proxy successfully started on port {port}")
         return True
 
+    def start_batch(self, specs, parallelism=None):
+        """Start several proxy instances concurrently."""
+        if not specs:
+            print("No proxies to start.")
+            return False
+
+        print(f"Starting {len(specs)} proxies (parallelism: {parallelism or START_PARALLELISM})...")
+        result = ProxyService().start_many(specs, parallelism)
+        if not result["results"]:
+            print(f"Error: {result['message']}")
+            return False
+
+        for item in result["results"]:
+            if item["success"]:
+                print(f"  [ OK ] port {item['port']}: {item['tun_ip']}")
+            else:
+                print(f"  [FAIL] port {item['port']}: {item['message']}")
+        print(result["message"])
+        return result["success"]
+
     def stop_proxy(self, port):
         """Stop a specific proxy instance."""
-        state = self.state_manager.get_state()
-        port_str = str(port)
-        info = state.get(port_str, {})
+        info = self.state_manager.get(port) or {}
 
         print(f"Stopping proxy on port {port}...")
 
-        instance = ProxyInstance(port, self.vpn_manager, self.proxy_server)
+        instance = ProxyInstance(port, self.vpn_manager, self.proxy_server, tunnel_id=info.get("tunnel_id"))
         instance.stop(info.get("tun_ip"))
 
-        if port_str in state:
-            del state[port_str]
-            self.state_manager.save_state(state)
+        self.state_manager.delete(port)
         print(f"Proxy on port {port} stopped and cleaned up.")
 
     def stop_all_proxies(self):
@@ -101,8 +141,159 @@ class ProxyApp:
             print("No active proxies or PID files found.")
             return
 
-        for port in sorted(ports, key=int):
-            self.stop_proxy(port)
+        print(f"Stopping {len(ports)} proxies...")
+        instances = [
+            ProxyInstance(
+                int(port),
+                self.vpn_manager,
+                self.proxy_server,
+                tunnel_id=state.get(port, {}).get("tunnel_id"),
+            )
+            for port in sorted(ports, key=int)
+        ]
+        stop_instances(instances)
+
+        with self.state_manager.transaction() as state:
+            for port in ports:
+                state.pop(port, None)
+        print(f"Stopped {len(ports)} proxies.")
+
+    def reconcile(self, dry_run=False):
+        """Repair drift between the state and running processes, interfaces and routing."""
+        result = ProxyService().reconcile(dry_run)
+        labels = {
+            "stale": "Stale entries",
+            "moved": "Moved tunnels",
+            "repair_routing": "Routing repaired",
+            "restart_3proxy": "3proxy restarted",
+            "kill": "Orphaned processes",
+            "delete_links": "Orphaned interfaces",
+            "cleanup_tables": "Orphaned routing tables",
+            "remove_cgroups": "Orphaned cgroups",
+            "remove_files": "Leftover files",
+        }
+        for key, label in labels.items():
+            if result[key]:
+                items = result[key].items() if isinstance(result[key], dict) else result[key]
+                print(f"{label}: {', '.join(map(str, items))}")
+        print(result["message"])
+
+    def apply_fleet(self, path, dry_run=False, prune=True, parallelism=None):
+        """Converge the running proxies on a fleet spec file, printing the plan."""
+        try:
+            proxies = load_fleet(path)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            return False
+        result = ProxyService().apply_fleet(proxies, dry_run, prune, parallelism)
+        if "start" not in result:
+            # Rejected before anything was planned
+            print(f"Error: {result['message']}")
+            return False
+
+        specs = {spec["port"]: spec for spec in proxies}
+
+        def describe(port):
+            spec = specs[port]
+            return f"{port} {spec['country']}/{spec['config'] or 'auto'}"
+
+        for port in result["start"]:
+            print(f"  + {describe(port)}")
+        for port, reason in sorted(result["replace"].items()):
+            print(f"  ~ {describe(port)} ({reason})")
+        for port in result["relabel"]:
+            print(f"  ~ {port} label -> {specs[port]['label']}")
+        for port in result["stop"]:
+            print(f"  - {port}")
+        for item in result["results"]:
+            if not item["success"]:
+                print(f"  [FAIL] port {item['port']}: {item['message']}")
+        print(result["message"])
+        return result["success"]
+
+    def run_forwarder(self):
+        """Serve every proxy port from the builtin forwarding engine until interrupted."""
+        if self.proxy_server.mode != "builtin":
+            print("Warning: PROXY_MODE is not 'builtin'; ports served by 3proxy will fail to bind.")
+        engine = ForwardingEngine(
+            authenticate=self.proxy_server.authenticate, listener_source=self.proxy_server.current_listeners
+        )
+        print("Forwarding engine running, following proxy state. Press Ctrl+C to stop.")
+        with contextlib.suppress(KeyboardInterrupt):
+            asyncio.run(engine.serve())
+
+    def run_gateway(self, port=None, policy=None):
+        """Serve the rotating gateway port until interrupted."""
+        kwargs = {key: value for key, value in (("port", port), ("policy", policy)) if value is not None}
+        try:
+            engine = GatewayEngine(
+                self.state_manager,
+                authenticate=self.proxy_server.authenticate,
+                permits=self.proxy_server.permits,
+                **kwargs,
+            )
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        if not engine.port:
+            print("Error: no gateway port given (set GATEWAY_PORT or pass --port).")
+            return
+        print(f"Gateway listening on port {engine.port} ({engine.policy}). Press Ctrl+C to stop.")
+        with contextlib.suppress(KeyboardInterrupt):
+            asyncio.run(engine.serve())
+
+    def reset_quota(self, port):
+        """Start the traffic quota of a proxy over."""
+        result = ProxyService().reset_quota(port)
+        print(result["message"] if result["success"] else f"Error: {result['message']}")
+
+    def list_users(self):
+        """List the proxy users with the ports and countries each may use."""
+        users = ProxyService().list_users()
+        if not users:
+            print("No proxy users besides PROXY_USER.")
+            return
+        print(f"{'USER':<24} {'PORTS':<24} {'COUNTRIES':<24} {'CREATED'}")
+        print("-" * 100)
+        for user in users:
+            ports = ",".join(map(str, user["ports"])) if user["ports"] is not None else "all"
+            countries = ",".join(user["countries"]) if user["countries"] is not None else "all"
+            print(f"{user['username']:<24} {ports:<24} {countries:<24} {user['created']}")
+
+    def add_user(self, username, password, ports=None, countries=None):
+        """Create a proxy user, taken up by running proxies without a restart."""
+        result = ProxyService().add_user(username, password, ports, countries)
+        print(result["message"] if result["success"] else f"Error: {result['message']}")
+
+    def update_user(self, username, **changes):
+        """Change the password, ports or countries of a proxy user."""
+        result = ProxyService().update_user(username, **changes)
+        print(result["message"] if result["success"] else f"Error: {result['message']}")
+
+    def remove_user(self, username):
+        """Delete a proxy user."""
+        result = ProxyService().remove_user(username)
+        print(result["message"] if result["success"] else f"Error: {result['message']}")
+
+    def run_monitor(self, interval=None, url=None):
+        """Health-check every proxy, restart broken ones and enforce traffic quotas until interrupted."""
+        kwargs = {key: value for key, value in (("interval", interval), ("url", url)) if value is not None}
+        service = ProxyService()
+        monitor = HealthMonitor(service, **kwargs)
+        quota = QuotaMonitor(service)
+        if monitor.interval <= 0:
+            print("Error: the check interval must be positive.")
+            return
+        target = f", fetching {monitor.url}" if monitor.url else ""
+        print(f"Checking proxies every {monitor.interval:g}s{target}. Press Ctrl+C to stop.")
+        with contextlib.suppress(KeyboardInterrupt):
+            while True:
+                for port, reason in sorted(monitor.check_all().items()):
+                    if reason:
+                        print(f"Port {port}: {reason}")
+                for port, action in sorted(quota.check_all().items()):
+                    print(f"Port {port}: traffic quota used up, {action}")
+                time.sleep(monitor.interval)
 
     def list_countries(self):
         """List all available countries."""
@@ -132,13 +323,16 @@ class ProxyApp:
                 for cfg in cfg_list:
                     print(f"  - {cfg}")
 
-    def show_status(self):
-        """Show the status of running proxies."""
+    def show_status(self, live=False):
+        """Show the status of running proxies, with `live` checked against processes and interfaces."""
         state = self.state_manager.get_state()
         if not state:
             print("No proxies running.")
             return
 
+        if live:
+            self._show_live_status(state)
+            return
         print(f"{'PORT':<8} {'COUNTRY':<15} {'CONFIG':<25} {'TUN IP':<15} {'LABEL':<15} {'STARTED'}")
         print("-" * 100)
         for port, info in state.items():
@@ -148,14 +342,46 @@ class ProxyApp:
                 f"{info['tun_ip']:<15} {label:<15} {info['start_time']}"
             )
 
-    def show_logs(self, port):
-        """Show OpenVPN logs for a specific port."""
-        log_file = Path(f"/tmp/ovpn_{port}.log")
-        if log_file.exists():
-            print(f"--- OpenVPN logs for port {port} ---")
-            subprocess.run(["cat", str(log_file)])
-        else:
+    def _show_live_status(self, state):
+        live = LiveStatus()
+        print(
+            f"{'PORT':<8} {'COUNTRY':<15} {'TUN IP':<15} {'STATUS':<8} {'OPENVPN':<9} {'UPTIME':>9} "
+            f"{'RSS MB':>7} {'CPU s':>8} {'3PROXY':<9} {'LINK'}"
+        )
+        print("-" * 100)
+        for port, info in state.items():
+            status = live.get(int(port), info, self.proxy_server.mode)
+            openvpn, proxy, tun = status["openvpn"], status["3proxy"], status["tun"]
+            uptime = rss = cpu = "-"
+            if openvpn["running"]:
+                seconds = int(openvpn["uptime_seconds"])
+                uptime = f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+                rss = f"{openvpn['rss_bytes'] / 2**20:.1f}"
+                cpu = f"{openvpn['cpu_seconds']:.1f}"
+            proxy_pid = "-" if proxy is None else proxy["pid"] or "dead"
+            print(
+                f"{port:<8} {info['country']:<15} {info['tun_ip']:<15} "
+                f"{'up' if status['alive'] else 'DOWN':<8} {openvpn['pid'] or 'dead':<9} {uptime:>9} "
+                f"{rss:>7} {cpu:>8} {proxy_pid:<9} {tun['operstate'] if tun['exists'] else 'missing'}"
+            )
+
+    def show_logs(self, port, lines=None, follow=False):
+        """Show the OpenVPN log of a port (or its last `lines` lines), optionally following new lines."""
+        result = ProxyService().get_logs(port, tail=lines)
+        if not result["success"]:
             print(f"No log file found for port {port}. Use 'status' to see running proxies.")
+            return
+        print(f"--- OpenVPN logs for port {port} ---")
+        print(result["logs"], end="")
+        if not follow:
+            return
+
+        async def follow_log():
+            async for text, _, _ in logfile.follow(ProxyService().log_file(port), result["next_offset"]):
+                print(text, end="", flush=True)
+
+        with contextlib.suppress(KeyboardInterrupt):
+            asyncio.run(follow_log())
 
 
 # Keep legacy functional wrappers for compatibility if needed,
@@ -165,8 +391,12 @@ class ProxyApp:
 _app = ProxyApp()
 
 
-def cmd_start(country, config, port, label=None):
-    _app.start_proxy(country, config, port, label)
+def cmd_start(country, config, port, label=None, limits=None, traffic=None):
+    _app.start_proxy(country, config, port, label, limits, traffic)
+
+
+def cmd_start_batch(specs, parallelism=None):
+    _app.start_batch(specs, parallelism)
 
 
 def cmd_stop(port):
@@ -177,6 +407,46 @@ def cmd_stop_all():
     _app.stop_all_proxies()
 
 
+def cmd_reconcile(dry_run=False):
+    _app.reconcile(dry_run)
+
+
+def cmd_reset_quota(port):
+    _app.reset_quota(port)
+
+
+def cmd_users_list():
+    _app.list_users()
+
+
+def cmd_users_add(username, password, ports=None, countries=None):
+    _app.add_user(username, password, ports, countries)
+
+
+def cmd_users_set(username, **changes):
+    _app.update_user(username, **changes)
+
+
+def cmd_users_remove(username):
+    _app.remove_user(username)
+
+
+def cmd_apply(path, dry_run=False, prune=True, parallelism=None):
+    _app.apply_fleet(path, dry_run, prune, parallelism)
+
+
+def cmd_forwarder():
+    _app.run_forwarder()
+
+
+def cmd_gateway(port=None, policy=None):
+    _app.run_gateway(port, policy)
+
+
+def cmd_monitor(interval=None, url=None):
+    _app.run_monitor(interval, url)
+
+
 def cmd_list_countries():
     _app.list_countries()
 
@@ -185,9 +455,9 @@ def cmd_list_configs(country=None):
     _app.list_configs(country)
 
 
-def cmd_status():
-    _app.show_status()
+def cmd_status(live=False):
+    _app.show_status(live)
 
 
-def cmd_logs(port):
-    _app.show_logs(port)
+def cmd_logs(port, lines=None, follow=False):
+    _app.show_logs(port, lines, follow)
@@ -0,0 +1,251 @@
+import contextlib
+import errno
+import threading
+import time
+from pathlib import Path
+
+from .config import CGROUP_PARENT
+
+CONTROLLERS = ("cpu", "memory", "pids")
+# Resource limits of a start request: the cgroup file each is written to and its controller
+LIMITS = {
+    "cpu_weight": ("cpu.weight", "cpu"),
+    "memory_max": ("memory.max", "memory"),
+    "pids_max": ("pids.max", "pids"),
+}
+# Seconds a cgroup that still holds processes after cgroup.kill is retried for removal
+REMOVE_TIMEOUT = 1
+
+
+def cgroup2_mount():
+    """Return where the cgroup v2 hierarchy is mounted (the "unified" mount on hybrid hosts), or None."""
+    try:
+        for line in Path("/proc/self/mounts").read_text().splitlines():
+            fields = line.split()
+            if len(fields) > 2 and fields[2] == "cgroup2":
+                return fields[1]
+    except OSError:
+        pass
+    return None
+
+
+def enter_command(cgroup, argv):
+    """
+    Wrap `argv` so the process moves itself into `cgroup` before it executes.
+
+    Writing "0" to cgroup.procs moves the writer, so the program and everything it
+    forks (daemonized OpenVPN and 3proxy included) start inside the cgroup.
+    """
+    if cgroup is None:
+        return list(argv)
+    return ["sh", "-c", 'echo 0 > "$0" && exec "$@"', str(Path(cgroup) / "cgroup.procs"), *argv]
+
+
+def _read_keyed(path):
+    """Read a flat-keyed cgroup file ("key value" lines) into a dict of ints, or None."""
+    try:
+        lines = Path(path).read_text().splitlines()
+    except OSError:
+        return None
+    values = {}
+    for line in lines:
+        key, _, value = line.partition(" ")
+        with contextlib.suppress(ValueError):
+            values[key] = int(value)
+    return values
+
+
+def _read_value(path):
+    """Read a single-value cgroup file: an int, "max", or None if it does not exist."""
+    try:
+        value = Path(path).read_text().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else value
+
+
+class CgroupManager:
+    """
+    Places each proxy instance in its own cgroup v2 and reads its resource usage.
+
+    Instance cgroups are named after the tunnel (tun<tunnel_id>) below the
+    CGROUP_PARENT cgroup, which is created on first use with the cpu, memory and
+    pids controllers enabled for its children where the kernel allows. The
+    OpenVPN process of the tunnel and, in per-port mode, its 3proxy daemon run
+    inside it; the shared 3proxy daemon and the builtin engine serve all proxies
+    and stay outside. Without a writable cgroup v2 hierarchy nothing is placed and
+    only starts asking for limits fail.
+    """
+
+    def __init__(self, parent=CGROUP_PARENT):
+        mount = cgroup2_mount()
+        self.mount = Path(mount) if mount else None
+        self.root = self.mount / parent.strip("/") if mount else None
+        self._ready = None
+        self._lock = threading.Lock()
+
+    def available(self):
+        """Return whether instance cgroups can be created, preparing the parent cgroup once."""
+        with self._lock:
+            if self._ready is None:
+                self._ready = self._prepare()
+            return self._ready
+
+    def _prepare(self):
+        if self.root is None:
+            return False
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+        except OSError:
+            return False
+        # Controllers are handed down one level at a time, from the mount to the parent;
+        # each is enabled on its own so a missing one does not keep the others away
+        levels = [self.root, *self.root.parents]
+        for directory in reversed(levels[: levels.index(self.mount) + 1]):
+            for controller in CONTROLLERS:
+                with contextlib.suppress(OSError):
+                    (directory / "cgroup.subtree_control").write_text(f"+{controller}")
+        return True
+
+    def controllers(self):
+        """Return the controllers instance cgroups get."""
+        try:
+            return set((self.root / "cgroup.subtree_control").read_text().split())
+        except (OSError, TypeError):
+            return set()
+
+    def path(self, tunnel_id):
+        """Return the cgroup directory of a tunnel, or None if cgroups are unavailable."""
+        return self.root / f"tun{tunnel_id}" if self.root is not None else None
+
+    def create(self, tunnel_id, limits=None):
+        """
+        Create the cgroup of a tunnel, or reuse it, and apply resource limits.
+
+        Args:
+            tunnel_id (int): The tunnel the cgroup is named after.
+            limits (dict): Optional 'cpu_weight', 'memory_max' and 'pids_max'.
+
+        Returns:
+            Path: The cgroup directory.
+
+        Raises:
+            ValueError: If cgroups are unavailable or a limit cannot be applied.
+        """
+        if not self.available():
+            raise ValueError("cgroup v2 is not available or not writable")
+        directory = self.path(tunnel_id)
+        try:
+            directory.mkdir(exist_ok=True)
+        except OSError as e:
+            raise ValueError(f"Cannot create cgroup {directory}: {e.strerror}") from e
+        try:
+            self.set_limits(tunnel_id, limits)
+        except ValueError:
+            # Only goes away if nothing runs in it yet
+            with contextlib.suppress(OSError):
+                directory.rmdir()
+            raise
+        return directory
+
+    def set_limits(self, tunnel_id, limits):
+        """
+        Write resource limits to the cgroup of a tunnel.
+
+        Raises:
+            ValueError: If a controller is not enabled or the kernel rejects a value.
+        """
+        limits = {name: value for name, value in (limits or {}).items() if value is not None}
+        controllers = self.controllers() if limits else set()
+        for name, value in limits.items():
+            file_name, controller = LIMITS[name]
+            if controller not in controllers:
+                raise ValueError(f"Cannot set {name}: the {controller} controller is not enabled in {self.root}")
+            try:
+                (self.path(tunnel_id) / file_name).write_text(str(value))
+            except OSError as e:
+                raise ValueError(f"Cannot set {name} to {value}: {e.strerror}") from e
+
+    def limits(self, tunnel_id):
+        """Return the limits in effect for a tunnel (None where its controller is missing)."""
+        directory = self.path(tunnel_id)
+        if directory is None:
+            return {}
+        return {name: _read_value(directory / file_name) for name, (file_name, _) in LIMITS.items()}
+
+    def usage(self, tunnel_id):
+        """
+        Read the resource usage of a tunnel's cgroup.
+
+        Returns:
+            dict or None: 'cpu_seconds', 'cpu_user_seconds', 'cpu_system_seconds',
+            'cpu_throttled_seconds', 'memory_bytes', 'memory_peak_bytes', 'pids' and
+            'oom_kills' (None where the controller is not enabled), or None if the
+            cgroup does not exist.
+        """
+        directory = self.path(tunnel_id)
+        cpu = _read_keyed(directory / "cpu.stat") if directory is not None else None
+        if cpu is None:
+            return None
+        events = _read_keyed(directory / "memory.events") or {}
+
+        def seconds(key):
+            return cpu[key] / 1_000_000 if key in cpu else None
+
+        return {
+            "cpu_seconds": seconds("usage_usec"),
+            "cpu_user_seconds": seconds("user_usec"),
+            "cpu_system_seconds": seconds("system_usec"),
+            "cpu_throttled_seconds": seconds("throttled_usec"),
+            "memory_bytes": _read_value(directory / "memory.current"),
+            "memory_peak_bytes": _read_value(directory / "memory.peak"),
+            "pids": _read_value(directory / "pids.current"),
+            "oom_kills": events.get("oom_kill"),
+        }
+
+    def existing(self):
+        """Return the tunnel ids that have a cgroup, mapped to the cgroup's modification time."""
+        cgroups = {}
+        if self.root is None:
+            return cgroups
+        with contextlib.suppress(OSError):
+            for directory in self.root.iterdir():
+                if directory.name.startswith("tun") and directory.name[3:].isdigit():
+                    with contextlib.suppress(OSError):
+                        cgroups[int(directory.name[3:])] = directory.stat().st_mtime
+        return cgroups
+
+    def remove_many(self, tunnel_ids):
+        """
+        Remove the cgroups of several tunnels.
+
+        Their processes are normally gone already; any that are left are killed
+        through cgroup.kill and the removal is retried for up to REMOVE_TIMEOUT seconds.
+        """
+        if self.root is None:
+            return
+        busy = []
+        for tunnel_id in tunnel_ids:
+            directory = self.path(tunnel_id)
+            try:
+                directory.rmdir()
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                if e.errno != errno.EBUSY:
+                    continue
+                with contextlib.suppress(OSError):
+                    (directory / "cgroup.kill").write_text("1")
+                busy.append(directory)
+
+        deadline = time.monotonic() + REMOVE_TIMEOUT
+        while busy and time.monotonic() < deadline:
+            time.sleep(0.05)
+            for directory in list(busy):
+                try:
+                    directory.rmdir()
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+                busy.remove(directory)
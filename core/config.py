@@ -7,6 +7,7 @@ from dotenv import load_dotenv
 SCRIPT_DIR = Path(__file__).resolve().parent.parent
 CONFIG_DIR = SCRIPT_DIR / "vpn_configs"
 STATE_FILE = SCRIPT_DIR / ".proxy_state.json"
+STATE_DB = SCRIPT_DIR / ".proxy_state.db"
 
 env_file = SCRIPT_DIR / ".env"
 dotenv_loaded = load_dotenv(dotenv_path=env_file)
@@ -20,9 +21,105 @@ OPENVPN_PASS = os.environ.get("OPENVPN_PASS")
 PROXY_USER = os.environ.get("PROXY_USER")
 PROXY_PASS = os.environ.get("PROXY_PASS")
 
+# Additional proxy users with hashed passwords and per-user ports and countries, and the
+# seconds between checks for users changed by another process (0 = only on own changes)
+USERS_FILE = SCRIPT_DIR / ".proxy_users.json"
+USERS_RELOAD_INTERVAL = float(os.environ.get("USERS_RELOAD_INTERVAL", "1"))
+
+# "per-port" runs one 3proxy daemon per proxy, "shared" serves all ports from one daemon,
+# "builtin" serves all ports from the asyncio forwarding engine instead of 3proxy
+PROXY_MODE = os.environ.get("PROXY_MODE", "per-port")
+
+# Builtin forwarding engine: connection limit per port (0 = unlimited) and how often
+# it re-reads the state for added or removed proxies
+FORWARDER_MAX_CONNECTIONS = int(os.environ.get("FORWARDER_MAX_CONNECTIONS", "0"))
+FORWARDER_SYNC_INTERVAL = float(os.environ.get("FORWARDER_SYNC_INTERVAL", "1"))
+
+# State storage backend: "json" (STATE_FILE) or "sqlite" (STATE_DB, WAL mode)
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "json")
+
+# Maximum number of proxies brought up concurrently by batch starts
+START_PARALLELISM = int(os.environ.get("START_PARALLELISM", "8"))
+
+# Seconds to wait for a tunnel interface to get its IP address
+TUN_READY_TIMEOUT = float(os.environ.get("TUN_READY_TIMEOUT", "30"))
+
+# Run openvpn and 3proxy as child processes of the API server that are restarted when they
+# exit (backing off up to SUPERVISOR_MAX_BACKOFF seconds) instead of as daemons
+SUPERVISE = os.environ.get("SUPERVISE", "0") == "1"
+SUPERVISOR_MAX_BACKOFF = float(os.environ.get("SUPERVISOR_MAX_BACKOFF", "60"))
+
+# Follow OpenVPN state, tun IP and traffic through its management socket in the API server,
+# with byte counts pushed every MANAGEMENT_BYTECOUNT_INTERVAL seconds
+OPENVPN_MANAGEMENT = os.environ.get("OPENVPN_MANAGEMENT", "1") == "1"
+MANAGEMENT_BYTECOUNT_INTERVAL = int(os.environ.get("MANAGEMENT_BYTECOUNT_INTERVAL", "5"))
+
+# Seconds stopped processes get to exit after SIGTERM before they are killed; stop-all
+# applies it once to all proxies together
+STOP_TIMEOUT = float(os.environ.get("STOP_TIMEOUT", "5"))
+
+# Put the OpenVPN and per-port 3proxy processes of every proxy in their own cgroup v2
+# (tun<id>) below CGROUP_PARENT, relative to the cgroup2 mount, to apply resource limits
+# and account their usage
+CGROUPS = os.environ.get("CGROUPS", "1") == "1"
+CGROUP_PARENT = os.environ.get("CGROUP_PARENT", "proxyforfree")
+
+# Traffic quotas: seconds between accounting rounds (0 = disabled) and the rate in kbit/s
+# proxies with quota_action "throttle" are limited to in each direction once over quota
+QUOTA_CHECK_INTERVAL = float(os.environ.get("QUOTA_CHECK_INTERVAL", "10"))
+QUOTA_THROTTLE_KBPS = int(os.environ.get("QUOTA_THROTTLE_KBPS", "256"))
+
+# Seconds a live status scan of /proc and /sys/class/net is reused by `status --live`
+# and /proxies/status?live=1
+LIVE_STATUS_TTL = float(os.environ.get("LIVE_STATUS_TTL", "2"))
+
+# Minimum seconds between checks of vpn_configs/ for added, removed or edited configs
+CATALOG_CHECK_INTERVAL = float(os.environ.get("CATALOG_CHECK_INTERVAL", "2"))
+
+# How configs are chosen when only a country is given: "fastest" (lowest measured latency)
+# or "first" (catalog order), and the latency probe's cache lifetime, timeout and concurrency
+CONFIG_SELECTION = os.environ.get("CONFIG_SELECTION", "fastest")
+PROBE_TTL = float(os.environ.get("PROBE_TTL", "300"))
+PROBE_TIMEOUT = float(os.environ.get("PROBE_TIMEOUT", "2"))
+PROBE_CONCURRENCY = int(os.environ.get("PROBE_CONCURRENCY", "64"))
+
+# Warm tunnel pool: "country:count,..." tunnels kept connected per country (empty = disabled),
+# the first tunnel id used by pooled tunnels and how often the pool is topped up
+POOL_TARGETS = os.environ.get("POOL_TARGETS", "")
+POOL_TUNNEL_BASE = int(os.environ.get("POOL_TUNNEL_BASE", "70000"))
+POOL_REFILL_INTERVAL = float(os.environ.get("POOL_REFILL_INTERVAL", "5"))
+
+# Gateway port spreading connections over all running proxies (0 = disabled) and its
+# policy: "round-robin", "least-connections", "random" or "sticky" (per client IP)
+GATEWAY_PORT = int(os.environ.get("GATEWAY_PORT", "0"))
+GATEWAY_POLICY = os.environ.get("GATEWAY_POLICY", "round-robin")
+
+# Health monitor: seconds between checks (0 = disabled), optional URL fetched through
+# every proxy, failed checks in a row before a restart, and the restart backoff cap
+HEALTH_CHECK_INTERVAL = float(os.environ.get("HEALTH_CHECK_INTERVAL", "30"))
+HEALTH_CHECK_URL = os.environ.get("HEALTH_CHECK_URL", "")
+HEALTH_CHECK_TIMEOUT = float(os.environ.get("HEALTH_CHECK_TIMEOUT", "10"))
+HEALTH_MAX_FAILURES = int(os.environ.get("HEALTH_MAX_FAILURES", "3"))
+HEALTH_MAX_BACKOFF = float(os.environ.get("HEALTH_MAX_BACKOFF", "600"))
+
+# OpenVPN logs are rotated (copy and truncate) past LOG_MAX_BYTES (0 = never),
+# keeping LOG_BACKUPS old copies
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+LOG_BACKUPS = int(os.environ.get("LOG_BACKUPS", "1"))
+
+# Policy routing backend: "auto" (netlink when available), "netlink" or "ip"
+ROUTING_BACKEND = os.environ.get("ROUTING_BACKEND", "auto")
+
 # REST API settings
 API_HOST = os.environ.get("API_HOST", "0.0.0.0")
 API_PORT = int(os.environ.get("API_PORT", "8080"))
 API_AUTH_ENABLED = os.environ.get("API_AUTH_ENABLED", "0") == "1"
 API_USER = os.environ.get("API_USER")
 API_PASS = os.environ.get("API_PASS")
+
+# Reconcile the state with running processes when the API server starts
+RECONCILE_ON_START = os.environ.get("RECONCILE_ON_START", "1") == "1"
+
+# Background jobs run by the REST API
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_HISTORY = int(os.environ.get("JOB_HISTORY", "200"))
@@ -0,0 +1,202 @@
+import asyncio
+import contextlib
+import ctypes
+import ctypes.util
+import os
+import shutil
+import struct
+from pathlib import Path
+
+from .config import LOG_BACKUPS, LOG_MAX_BYTES
+
+# Most bytes returned by a single read, so one request never loads a huge log
+READ_LIMIT = 256 * 1024
+BLOCK_SIZE = 8192
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVE_SELF = 0x00000800
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+# struct inotify_event: wd, mask, cookie, len (followed by len bytes of name)
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def read_tail(path, lines, limit=READ_LIMIT):
+    """
+    Return the last `lines` lines of a file, reading backwards block by block.
+
+    Returns:
+        tuple: (text, start offset, end offset); at most `limit` bytes are read.
+    """
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        start = end
+        data = b""
+        # One more newline than lines is needed unless the file ends without one
+        wanted = lines + 1 if end and _last_byte(f, end) == b"\n" else lines
+        while start > 0 and data.count(b"\n") < wanted and end - start < limit:
+            size = min(BLOCK_SIZE, start, limit - (end - start))
+            start -= size
+            f.seek(start)
+            data = f.read(size) + data
+    if data.count(b"\n") >= wanted:
+        cut = len(data)
+        for _ in range(wanted):
+            cut = data.rindex(b"\n", 0, cut)
+        start += cut + 1
+        data = data[cut + 1 :]
+    return data.decode(errors="replace"), start, end
+
+
+def _last_byte(f, end):
+    f.seek(end - 1)
+    return f.read(1)
+
+
+def read_range(path, offset, limit=READ_LIMIT):
+    """
+    Return up to `limit` bytes of a file starting at byte `offset`.
+
+    The chunk is cut after its last complete line unless that would leave it empty.
+
+    Returns:
+        tuple: (text, start offset, end offset, file size).
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        offset = min(max(offset, 0), size)
+        f.seek(offset)
+        data = f.read(limit)
+    if b"\n" in data:
+        data = data[: data.rindex(b"\n") + 1]
+    return data.decode(errors="replace"), offset, offset + len(data), size
+
+
+def rotate(path, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+    """
+    Rotate `path` by copy and truncate once it exceeds `max_bytes`.
+
+    The writer keeps its file descriptor, so it has to open the log with O_APPEND
+    (OpenVPN's --log-append) for its next write to land at the new end of file.
+    Older copies are shifted to .2, .3 ... up to `backups`; 0 keeps none.
+
+    Returns:
+        bool: True if the file was rotated.
+    """
+    path = Path(path)
+    try:
+        if max_bytes <= 0 or path.stat().st_size <= max_bytes:
+            return False
+    except OSError:
+        return False
+    for index in range(backups - 1, 0, -1):
+        with contextlib.suppress(OSError):
+            Path(f"{path}.{index}").replace(f"{path}.{index + 1}")
+    if backups > 0:
+        shutil.copyfile(path, f"{path}.1")
+    with path.open("r+b") as f:
+        f.truncate(0)
+    return True
+
+
+def _load_inotify():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        return libc if hasattr(libc, "inotify_init1") else None
+    except OSError:
+        return None
+
+
+_libc = _load_inotify()
+
+
+class FileWatcher:
+    """
+    Waits for changes to a file.
+
+    Uses inotify through libc where available, so a waiting reader wakes up as
+    soon as a line is written; otherwise wait() simply sleeps for its timeout.
+    A file that is deleted and created again is watched again on the next wait().
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.fd = None
+        self.wd = None
+        if _libc is not None:
+            fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self.fd = fd
+
+    def _watch(self):
+        if self.fd is None or self.wd is not None:
+            return
+        wd = _libc.inotify_add_watch(self.fd, self.path.encode(), IN_MODIFY | IN_ATTRIB | IN_MOVE_SELF | IN_DELETE_SELF)
+        self.wd = wd if wd >= 0 else None
+
+    def _drain(self):
+        """Consume pending events; forget the watch if the file went away."""
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except (BlockingIOError, OSError):
+                return
+            offset = 0
+            while offset + INOTIFY_EVENT.size <= len(data):
+                _, mask, _, name_len = INOTIFY_EVENT.unpack_from(data, offset)
+                if mask & (IN_IGNORED | IN_MOVE_SELF | IN_DELETE_SELF):
+                    self.wd = None
+                offset += INOTIFY_EVENT.size + name_len
+
+    async def wait(self, timeout):
+        """Return once the file changed or `timeout` seconds passed."""
+        self._watch()
+        if self.wd is None:
+            await asyncio.sleep(timeout)
+            return
+        loop = asyncio.get_running_loop()
+        changed = loop.create_future()
+        loop.add_reader(self.fd, lambda: changed.done() or changed.set_result(None))
+        try:
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(changed, timeout)
+        finally:
+            loop.remove_reader(self.fd)
+        self._drain()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+async def follow(path, offset, poll_interval=1.0):
+    """
+    Yield (text, start, end) chunks appended to `path` from byte `offset` on, forever.
+
+    When the file shrinks (rotated or recreated) reading restarts at its beginning.
+    A missing file is waited for. Wakes up on inotify events and at least every
+    `poll_interval` seconds.
+    """
+    watcher = FileWatcher(path)
+    try:
+        while True:
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                size = None
+            if size is not None:
+                if size < offset:
+                    offset = 0
+                while size > offset:
+                    text, start, end, size = await asyncio.to_thread(read_range, path, offset)
+                    if end == start:
+                        break
+                    offset = end
+                    yield text, start, end
+            await watcher.wait(poll_interval)
+    finally:
+        watcher.close()
@@ -0,0 +1,122 @@
+import contextlib
+import os
+import selectors
+import signal
+import time
+
+from .config import STOP_TIMEOUT
+
+# How often processes without a pidfd are checked while waiting
+POLL_INTERVAL = 0.05
+# Seconds killed processes get to disappear (so their tun devices are released)
+KILL_TIMEOUT = 1
+
+
+def open_pidfd(pid):
+    """
+    Return a pidfd referring to `pid`, or None where pidfds are not supported.
+
+    Raises:
+        ProcessLookupError: If the process does not exist.
+    """
+    try:
+        return os.pidfd_open(pid)
+    except ProcessLookupError:
+        raise
+    except (AttributeError, OSError):
+        # Kernel older than 5.3, or the call is filtered (seccomp)
+        return None
+
+
+def _send(pid, pidfd, sig):
+    # Signalling through the pidfd cannot hit an unrelated process that reused the PID
+    with contextlib.suppress(OSError):
+        if pidfd is not None:
+            signal.pidfd_send_signal(pidfd, sig)
+        else:
+            os.kill(pid, sig)
+
+
+def _reap(pid):
+    # Collect the exit status if the process happens to be our child, so it does not linger as a zombie
+    with contextlib.suppress(ChildProcessError, OSError):
+        os.waitpid(pid, os.WNOHANG)
+
+
+def _exists(pid):
+    _reap(pid)
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def wait_for_exit(handles, deadline):
+    """
+    Wait until every process of `handles` has exited or `deadline` passes.
+
+    Args:
+        handles (dict): PID mapped to its pidfd, or None to poll that PID instead.
+        deadline (float): time.monotonic() value to give up at.
+
+    Returns:
+        set: The PIDs still running.
+    """
+    alive = set(handles)
+    polled = {pid for pid, pidfd in handles.items() if pidfd is None}
+    with selectors.DefaultSelector() as selector:
+        for pid, pidfd in handles.items():
+            if pidfd is not None:
+                # A pidfd becomes readable once its process exits
+                selector.register(pidfd, selectors.EVENT_READ, pid)
+        while alive:
+            alive -= {pid for pid in polled & alive if not _exists(pid)}
+            remaining = deadline - time.monotonic()
+            if not alive or remaining <= 0:
+                break
+            timeout = min(remaining, POLL_INTERVAL) if polled & alive else remaining
+            for key, _ in selector.select(timeout):
+                selector.unregister(key.fileobj)
+                alive.discard(key.data)
+                _reap(key.data)
+    return alive
+
+
+def terminate(pids, timeout=STOP_TIMEOUT, deadline=None):
+    """
+    Stop several processes together.
+
+    All of them get SIGTERM at once and are then waited for under a single deadline,
+    so the total time is bounded by the slowest process rather than their sum.
+    Survivors are killed with SIGKILL. Exits are detected through pidfds, waking up
+    as soon as the last process is gone; without pidfd support the processes are
+    polled every POLL_INTERVAL seconds.
+
+    Args:
+        pids (iterable): The processes to stop.
+        timeout (float): Seconds to wait before killing, unless `deadline` is given.
+        deadline (float): time.monotonic() value shared by several calls.
+
+    Returns:
+        list: The PIDs that had to be killed.
+    """
+    if deadline is None:
+        deadline = time.monotonic() + timeout
+    handles = {}
+    for pid in set(pids):
+        with contextlib.suppress(ProcessLookupError):
+            handles[pid] = open_pidfd(pid)
+    try:
+        for pid, pidfd in handles.items():
+            _send(pid, pidfd, signal.SIGTERM)
+        alive = wait_for_exit(handles, deadline)
+        for pid in alive:
+            _send(pid, handles[pid], signal.SIGKILL)
+        if alive:
+            wait_for_exit({pid: handles[pid] for pid in alive}, time.monotonic() + KILL_TIMEOUT)
+        return sorted(alive)
+    finally:
+        for pidfd in handles.values():
+            if pidfd is not None:
+                os.close(pidfd)
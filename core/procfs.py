@@ -0,0 +1,192 @@
+import os
+import time
+from pathlib import Path
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+TCP_ESTABLISHED = "01"
+IFF_UP = 0x1
+
+
+def read_pid_file(path):
+    """Return the PID stored in `path`, or None if the file is missing or invalid."""
+    try:
+        return int(Path(path).read_text().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def boot_time():
+    """Return the system boot time as a Unix timestamp."""
+    try:
+        for line in Path("/proc/stat").read_text().splitlines():
+            if line.startswith("btime "):
+                return int(line.split()[1])
+    except OSError:
+        pass
+    return time.time() - time.monotonic()
+
+
+def find_processes(names):
+    """
+    Scan /proc once for processes whose executable name is in `names`.
+
+    Returns:
+        dict: PID mapped to its argument list.
+    """
+    names = set(names)
+    found = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return found
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            data = Path(f"/proc/{entry}/cmdline").read_bytes()
+        except OSError:
+            continue
+        argv = data.decode(errors="replace").split("\0")
+        if argv and argv[-1] == "":
+            argv.pop()
+        if argv and os.path.basename(argv[0]) in names:
+            found[int(entry)] = argv
+    return found
+
+
+def process_stats(pids):
+    """
+    Read CPU time, memory and start time of several processes from /proc.
+
+    Returns:
+        dict: PID mapped to {'cpu_seconds', 'rss_bytes', 'start_time'} for every
+        PID that is still running.
+    """
+    btime = boot_time()
+    stats = {}
+    for pid in set(pids):
+        try:
+            data = Path(f"/proc/{pid}/stat").read_bytes()
+        except OSError:
+            continue
+        # The command name may contain spaces and parentheses; fields follow the last ")"
+        fields = data[data.rfind(b")") + 2 :].split()
+        stats[pid] = {
+            "cpu_seconds": (int(fields[11]) + int(fields[12])) / CLOCK_TICKS,
+            "rss_bytes": int(fields[21]) * PAGE_SIZE,
+            "start_time": btime + int(fields[19]) / CLOCK_TICKS,
+        }
+    return stats
+
+
+def interface_stats():
+    """
+    Read the traffic counters of every network interface from /proc/net/dev.
+
+    Returns:
+        dict: Interface name mapped to {'rx_bytes', 'rx_packets', 'tx_bytes', 'tx_packets'}.
+    """
+    stats = {}
+    try:
+        lines = Path("/proc/net/dev").read_text().splitlines()[2:]
+    except OSError:
+        return stats
+    for line in lines:
+        name, _, counters = line.partition(":")
+        values = counters.split()
+        if len(values) < 10:
+            continue
+        stats[name.strip()] = {
+            "rx_bytes": int(values[0]),
+            "rx_packets": int(values[1]),
+            "tx_bytes": int(values[8]),
+            "tx_packets": int(values[9]),
+        }
+    return stats
+
+
+def link_states(names=None):
+    """
+    Read the state of network interfaces from /sys/class/net in one pass.
+
+    Args:
+        names (iterable): Only read these interfaces; all of them by default.
+
+    Returns:
+        dict: Interface name mapped to {'operstate', 'up'} for every existing interface.
+    """
+    try:
+        existing = os.listdir("/sys/class/net")
+    except OSError:
+        return {}
+    if names is not None:
+        existing = set(existing) & set(names)
+    states = {}
+    for name in existing:
+        try:
+            operstate = Path(f"/sys/class/net/{name}/operstate").read_text().strip()
+            flags = int(Path(f"/sys/class/net/{name}/flags").read_text(), 16)
+        except (OSError, ValueError):
+            # Removed while reading
+            continue
+        states[name] = {"operstate": operstate, "up": bool(flags & IFF_UP)}
+    return states
+
+
+def established_connections(ports):
+    """
+    Count established TCP connections whose local port is in `ports`.
+
+    Returns:
+        dict: Port mapped to its number of established connections (IPv4 and IPv6).
+    """
+    ports = set(ports)
+    counts = dict.fromkeys(ports, 0)
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            lines = Path(table).read_text().splitlines()[1:]
+        except OSError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 4 or fields[3] != TCP_ESTABLISHED:
+                continue
+            port = int(fields[1].rpartition(":")[2], 16)
+            if port in ports:
+                counts[port] += 1
+    return counts
+
+
+class LogLineCounter:
+    """
+    Counts lines containing a marker in growing log files.
+
+    Only the bytes appended since the previous call are read, so repeated calls
+    on large logs stay cheap. A file that was replaced or truncated is counted
+    from its start again.
+    """
+
+    def __init__(self, marker):
+        self.marker = marker.encode()
+        # path -> (inode, offset, count)
+        self.positions = {}
+
+    def count(self, path):
+        try:
+            with open(path, "rb") as f:
+                st = os.fstat(f.fileno())
+                inode, offset, total = self.positions.get(path, (None, 0, 0))
+                if inode != st.st_ino or st.st_size < offset:
+                    offset, total = 0, 0
+                f.seek(offset)
+                data = f.read()
+        except OSError:
+            self.positions.pop(path, None)
+            return 0
+        # Leave a trailing partial line for the next call
+        complete = data[: data.rfind(b"\n") + 1]
+        total += complete.count(self.marker)
+        self.positions[path] = (st.st_ino, offset + len(complete), total)
+        return total
@@ -1,38 +1,236 @@
+import contextlib
+import copy
+import fcntl
 import json
+import os
+import sqlite3
+import threading
 from pathlib import Path
 
-from .config import STATE_FILE
+from .config import STATE_BACKEND, STATE_DB, STATE_FILE
+
+
+class JSONStateBackend:
+    """
+    Stores the state in a JSON file.
+
+    Writes happen under an exclusive fcntl lock on a sidecar lock file and go through
+    a temporary file that is atomically renamed over the state file, so concurrent
+    writers never lose each other's updates and a crash never leaves a truncated file.
+    Reads are served from memory until the file's mtime, size or inode changes.
+    """
+
+    def __init__(self, state_file=STATE_FILE):
+        self.state_file = Path(state_file)
+        self.lock_file = self.state_file.with_name(self.state_file.name + ".lock")
+        self._cache = {}
+        self._cache_key = None
+        self._lock = threading.RLock()
+
+    def _file_key(self):
+        try:
+            st = self.state_file.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def load(self):
+        """Return the current state, re-reading the file only if it changed."""
+        with self._lock:
+            key = self._file_key()
+            if key != self._cache_key:
+                self._cache = self._read() if key else {}
+                self._cache_key = key
+            return self._cache
+
+    def _read(self):
+        try:
+            with self.state_file.open() as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Lock the state, yield a mutable copy of it and persist the copy on success.
+        """
+        with self._lock, self.lock_file.open("a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                original = self.load()
+                state = copy.deepcopy(original)
+                yield state
+                if state != original:
+                    self._write(state)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write(self, state):
+        tmp_file = self.state_file.with_name(f"{self.state_file.name}.{os.getpid()}.tmp")
+        with tmp_file.open("w") as f:
+            json.dump(state, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        tmp_file.replace(self.state_file)
+        self._cache = state
+        self._cache_key = self._file_key()
+
+
+class SQLiteStateBackend:
+    """
+    Stores one row per port in an SQLite database running in WAL mode.
+
+    Transactions only rewrite the rows that changed. Reads are served from memory
+    until SQLite's data_version reports a commit from another connection.
+    """
+
+    def __init__(self, db_file=STATE_DB, import_from=STATE_FILE):
+        self.db_file = Path(db_file)
+        new_db = not self.db_file.exists()
+        self.conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS proxies (port TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._cache = None
+        self._data_version = None
+        self._lock = threading.RLock()
+
+        # Carry over the state of an existing JSON store the first time
+        if new_db and import_from and Path(import_from).exists():
+            with self.transaction() as state:
+                state.update(JSONStateBackend(import_from).load())
+
+    def _current_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def load(self):
+        """Return the current state, querying the database only after foreign commits."""
+        with self._lock:
+            version = self._current_version()
+            if self._cache is None or version != self._data_version:
+                rows = self.conn.execute("SELECT port, data FROM proxies").fetchall()
+                self._cache = {port: json.loads(data) for port, data in rows}
+                self._data_version = version
+            return self._cache
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Lock the database, yield a mutable copy of the state and write back changed rows.
+        """
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._cache = None
+                original = self.load()
+                state = copy.deepcopy(original)
+                yield state
+                for port in original.keys() - state.keys():
+                    self.conn.execute("DELETE FROM proxies WHERE port = ?", (port,))
+                for port, info in state.items():
+                    if original.get(port) != info:
+                        self.conn.execute(
+                            "INSERT OR REPLACE INTO proxies (port, data) VALUES (?, ?)",
+                            (str(port), json.dumps(info)),
+                        )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                self._cache = None
+                raise
+            self._cache = state
+            self._data_version = self._current_version()
+
+
+def get_state_backend(name=STATE_BACKEND):
+    """Return the state backend for `name` ("json" or "sqlite")."""
+    if name == "sqlite":
+        return SQLiteStateBackend()
+    return JSONStateBackend()
 
 
 class StateManager:
     """
     Manages the persistence of the proxy application state.
+
+    The state maps port strings to the info dict of the proxy on that port.
+    Every mutation runs as a locked read-modify-write transaction on the backend.
     """
 
-    def __init__(self, state_file=STATE_FILE):
-        self.state_file = state_file
+    def __init__(self, state_file=None, backend=None):
+        if backend is None:
+            backend = JSONStateBackend(state_file) if state_file else get_state_backend()
+        self.backend = backend
 
     def get_state(self):
         """
-        Read the current proxy state from the JSON file.
+        Read the current proxy state.
 
         Returns:
             dict: A dictionary containing the state of all running proxies.
         """
-        if Path(self.state_file).exists():
-            try:
-                with Path(self.state_file).open() as f:
-                    return json.load(f)
-            except Exception:
-                return {}
-        return {}
+        return copy.deepcopy(self.backend.load())
 
     def save_state(self, state):
         """
-        Save the current proxy state to the JSON file.
+        Replace the whole proxy state.
 
         Args:
             state (dict): The state dictionary to save.
         """
-        with Path(self.state_file).open("w") as f:
-            json.dump(state, f, indent=4)
+        with self.backend.transaction() as current:
+            current.clear()
+            current.update(state)
+
+    def transaction(self):
+        """
+        Context manager yielding the state for a read-modify-write cycle.
+
+        Changes made to the yielded dict are persisted atomically on exit.
+        """
+        return self.backend.transaction()
+
+    def get(self, port):
+        """Return a copy of the info recorded for `port`, or None."""
+        info = self.backend.load().get(str(port))
+        return copy.deepcopy(info)
+
+    def set(self, port, info):
+        """Record `info` for `port`, replacing any previous entry."""
+        with self.backend.transaction() as state:
+            state[str(port)] = info
+
+    def delete(self, port):
+        """Remove the entry of `port`. Returns the removed info, or None."""
+        with self.backend.transaction() as state:
+            return state.pop(str(port), None)
+
+    def update(self, port, **fields):
+        """Merge `fields` into the entry of `port`. Returns False if the port is not recorded."""
+        with self.backend.transaction() as state:
+            if str(port) not in state:
+                return False
+            state[str(port)].update(fields)
+            return True
+
+    def compare_and_swap(self, port, expected, new):
+        """
+        Replace the entry of `port` only if it still equals `expected`.
+
+        Args:
+            port (int or str): The proxy port.
+            expected (dict or None): The entry the caller last saw; None means "not recorded".
+            new (dict or None): The entry to store; None removes it.
+
+        Returns:
+            bool: True if the swap happened.
+        """
+        with self.backend.transaction() as state:
+            if state.get(str(port)) != expected:
+                return False
+            if new is None:
+                state.pop(str(port), None)
+            else:
+                state[str(port)] = new
+            return True
@@ -0,0 +1,249 @@
+import contextlib
+import os
+import selectors
+import subprocess
+import threading
+import time
+
+from .config import SUPERVISOR_MAX_BACKOFF
+from .process import POLL_INTERVAL, open_pidfd, terminate
+
+# Delay before the first restart of a child; doubled for every further restart
+RESTART_BACKOFF = 1
+# A child that stayed up this many seconds starts over with the shortest backoff
+STABLE_AFTER = 60
+
+
+class Supervisor:
+    """
+    Runs openvpn and 3proxy in the foreground as child processes and restarts them.
+
+    A watcher thread waits on one pidfd per child, so an exit is noticed the moment
+    it happens; hosts without pidfd support poll the children every POLL_INTERVAL
+    seconds instead. Exited children are restarted with the same command line after
+    an exponential backoff (RESTART_BACKOFF doubling up to `max_backoff`).
+
+    Children are addressed by name, e.g. ("openvpn", 8011) or ("3proxy", 8011).
+    is_running() and status() answer from the in-memory table without touching
+    pid files or /proc. Children are started in their own session and keep running
+    when the supervisor is closed; callers fall back to pid files for processes
+    the supervisor does not know.
+    """
+
+    def __init__(self, max_backoff=SUPERVISOR_MAX_BACKOFF):
+        self.max_backoff = max_backoff
+        # name -> child record, guarded by _lock
+        self.children = {}
+        self._lock = threading.Lock()
+        # Children started since the watcher last looked, and their pidfds
+        self._pending = []
+        self._wake_r, self._wake_w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the watcher thread."""
+        self._thread = threading.Thread(target=self._run, name="supervisor", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop watching; the children keep running and are found through their pid files."""
+        self._stop.set()
+        self._wake()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def spawn(self, name, argv):
+        """
+        Start `argv` as the child `name`, replacing any record of that name.
+
+        Returns:
+            int: The PID of the new process.
+
+        Raises:
+            OSError: If the program cannot be executed.
+        """
+        child = {
+            "argv": list(argv),
+            "process": None,
+            "pidfd": None,
+            "started": None,
+            "restarts": 0,
+            "last_exit_code": None,
+            "last_exit": None,
+            "next_restart": None,
+        }
+        with self._lock:
+            self._launch(name, child)
+            self.children[name] = child
+        self._wake()
+        return child["process"].pid
+
+    def _launch(self, name, child):
+        child["process"] = subprocess.Popen(
+            child["argv"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            # Keep Ctrl-C and signals meant for the API process away from the children
+            start_new_session=True,
+        )
+        try:
+            child["pidfd"] = open_pidfd(child["process"].pid)
+        except ProcessLookupError:
+            child["pidfd"] = None
+        child["started"] = time.time()
+        child["next_restart"] = None
+        self._pending.append((name, child["pidfd"]))
+
+    def _wake(self):
+        with contextlib.suppress(BlockingIOError):
+            os.write(self._wake_w, b"\0")
+
+    def knows(self, name):
+        """Return True if `name` is a supervised child."""
+        with self._lock:
+            return name in self.children
+
+    def pid(self, name):
+        """Return the PID of the child `name` if it is running, else None."""
+        with self._lock:
+            child = self.children.get(name)
+            if child is None or child["process"] is None or child["process"].returncode is not None:
+                return None
+            return child["process"].pid
+
+    def is_running(self, name):
+        """
+        Return whether the child `name` is running.
+
+        Returns:
+            bool or None: None if `name` is not supervised.
+        """
+        with self._lock:
+            if name not in self.children:
+                return None
+        return self.pid(name) is not None
+
+    def status(self, name):
+        """
+        Return the supervision record of `name`.
+
+        Returns:
+            dict or None: pid, running, started, restarts, last_exit_code, last_exit and
+            next_restart (Unix timestamps), or None if `name` is not supervised.
+        """
+        with self._lock:
+            child = self.children.get(name)
+            if child is None:
+                return None
+            running = child["process"] is not None and child["process"].returncode is None
+            return {
+                "pid": child["process"].pid if running else None,
+                "running": running,
+                "started": child["started"],
+                "restarts": child["restarts"],
+                "last_exit_code": child["last_exit_code"],
+                "last_exit": child["last_exit"],
+                "next_restart": child["next_restart"],
+            }
+
+    def signal(self, name, sig):
+        """Send `sig` to the child `name`; returns False if it is not running."""
+        with self._lock:
+            child = self.children.get(name)
+            if child is None or child["process"] is None or child["process"].returncode is not None:
+                return False
+            with contextlib.suppress(ProcessLookupError):
+                child["process"].send_signal(sig)
+            return True
+
+    def release(self, names):
+        """
+        Stop supervising `names` without stopping the processes.
+
+        Returns:
+            dict: Name mapped to the PID of its running process (None if it is down)
+            for every name that was supervised.
+        """
+        released = {}
+        with self._lock:
+            for name in names:
+                child = self.children.pop(name, None)
+                if child is None:
+                    continue
+                process = child["process"]
+                released[name] = process.pid if process is not None and process.poll() is None else None
+        return released
+
+    def stop(self, names, deadline=None):
+        """Stop supervising `names` and terminate their processes together."""
+        pids = [pid for pid in self.release(names).values() if pid is not None]
+        terminate(pids, deadline=deadline)
+
+    def _run(self):
+        watched = {}
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._wake_r, selectors.EVENT_READ)
+            while not self._stop.is_set():
+                with self._lock:
+                    for name, pidfd in self._pending:
+                        if pidfd is not None:
+                            selector.register(pidfd, selectors.EVENT_READ, name)
+                            watched[pidfd] = name
+                    self._pending.clear()
+                    polled = any(
+                        child["pidfd"] is None and child["process"] is not None for child in self.children.values()
+                    )
+                    due = [c["next_restart"] for c in self.children.values() if c["next_restart"] is not None]
+
+                timeout = max(min(due) - time.time(), 0) if due else None
+                if polled:
+                    timeout = POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL)
+                for key, _ in selector.select(timeout):
+                    if key.fd == self._wake_r:
+                        with contextlib.suppress(BlockingIOError):
+                            os.read(self._wake_r, 4096)
+                        continue
+                    selector.unregister(key.fd)
+                    name = watched.pop(key.fd)
+                    with self._lock:
+                        child = self.children.get(name)
+                        # Ignore pidfds of children that were replaced or released meanwhile
+                        if child is not None and child["pidfd"] == key.fd:
+                            self._exited(child)
+                    os.close(key.fd)
+                self._check()
+
+            for pidfd in watched:
+                selector.unregister(pidfd)
+                os.close(pidfd)
+
+    def _check(self):
+        """Notice polled children that exited and restart children that are due."""
+        now = time.time()
+        with self._lock:
+            for name, child in self.children.items():
+                process = child["process"]
+                if process is not None and child["pidfd"] is None and process.poll() is not None:
+                    self._exited(child)
+                if child["next_restart"] is not None and child["next_restart"] <= now:
+                    try:
+                        self._launch(name, child)
+                    except OSError:
+                        self._exited(child)
+
+    def _exited(self, child):
+        """Record the exit of a child and schedule its restart."""
+        now = time.time()
+        process = child["process"]
+        if process is not None:
+            with contextlib.suppress(subprocess.TimeoutExpired):
+                child["last_exit_code"] = process.wait(timeout=1)
+            child["last_exit"] = now
+            child["process"] = None
+            child["pidfd"] = None
+            if now - child["started"] >= STABLE_AFTER:
+                child["restarts"] = 0
+        child["next_restart"] = now + min(self.max_backoff, RESTART_BACKOFF * 2 ** child["restarts"])
+        child["restarts"] += 1
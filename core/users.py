@@ -0,0 +1,227 @@
+import hashlib
+import hmac
+import re
+import secrets
+import threading
+import time
+
+from .config import USERS_FILE, USERS_RELOAD_INTERVAL
+from .state import JSONStateBackend
+
+# Usernames end up in 3proxy configs and ACL lists, which split on ':', ',' and whitespace
+USERNAME_PATTERN = re.compile(r"^[A-Za-z0-9_.@+-]{1,64}$")
+CRYPT_ALPHABET = "./0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+# Fields of a user record that are returned to API and CLI callers
+PUBLIC_FIELDS = ("ports", "countries", "created", "updated")
+
+
+def _crypt64(value, length):
+    chars = []
+    for _ in range(length):
+        chars.append(CRYPT_ALPHABET[value & 0x3F])
+        value >>= 6
+    return "".join(chars)
+
+
+def md5_crypt(password, salt=None):
+    """
+    Hash a password with md5-crypt ("$1$salt$hash"), the one hash 3proxy verifies (CR).
+
+    Args:
+        password (str): The cleartext password.
+        salt (str): Up to 8 salt characters; a random salt is drawn when omitted.
+    """
+    if salt is None:
+        salt = "".join(secrets.choice(CRYPT_ALPHABET) for _ in range(8))
+    secret, salt_bytes, magic = password.encode(), salt[:8].encode(), b"$1$"
+
+    alternate = hashlib.md5(secret + salt_bytes + secret).digest()
+    context = secret + magic + salt_bytes
+    for remaining in range(len(secret), 0, -16):
+        context += alternate[: min(16, remaining)]
+    length = len(secret)
+    while length:
+        context += b"\0" if length & 1 else secret[:1]
+        length >>= 1
+    digest = hashlib.md5(context).digest()
+
+    for i in range(1000):
+        context = secret if i & 1 else digest
+        if i % 3:
+            context += salt_bytes
+        if i % 7:
+            context += secret
+        context += digest if i & 1 else secret
+        digest = hashlib.md5(context).digest()
+
+    encoded = "".join(
+        _crypt64(digest[a] << 16 | digest[b] << 8 | digest[c], 4)
+        for a, b, c in ((0, 6, 12), (1, 7, 13), (2, 8, 14), (3, 9, 15), (4, 10, 5))
+    )
+    return f"$1${salt[:8]}${encoded}{_crypt64(digest[11], 2)}"
+
+
+def permits(user, port, country=None):
+    """Return whether a user record may use the proxy on `port`, of `country`."""
+    if user.get("ports") is not None and int(port) not in user["ports"]:
+        return False
+    return user.get("countries") is None or country in user["countries"]
+
+
+def public(username, user):
+    """Return a user record without its password hash."""
+    return {"username": username, **{field: user.get(field) for field in PUBLIC_FIELDS}}
+
+
+class UserStore:
+    """
+    Proxy users with hashed passwords and the proxy ports and countries each may use.
+
+    Users are kept in USERS_FILE through the same locked, atomically replaced JSON
+    store as the state, so the API, the CLI and a separate forwarder process can
+    all change and read them. Passwords are stored as md5-crypt hashes, which 3proxy
+    checks itself; 'ports' and 'countries' of None leave a user unrestricted.
+    Reads are served from memory until the file changes, and load() returns a new
+    dict each time it did.
+    """
+
+    def __init__(self, users_file=USERS_FILE):
+        self.backend = JSONStateBackend(users_file)
+        # (username, password hash) -> SHA-256 of the password that last matched it,
+        # sparing the 1000 MD5 rounds on every connection of the builtin engine
+        self._verified = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Return the users by name; the dict is shared and must not be modified."""
+        return self.backend.load()
+
+    def list(self):
+        """Return every user, sorted by name, without password hashes."""
+        return [public(name, user) for name, user in sorted(self.load().items())]
+
+    def get(self, username):
+        """Return a user without password hash, or None."""
+        user = self.load().get(username)
+        return public(username, user) if user is not None else None
+
+    def add(self, username, password, ports=None, countries=None):
+        """
+        Create a user.
+
+        Raises:
+            ValueError: If the name is invalid or taken, or the password is empty.
+        """
+        if not USERNAME_PATTERN.match(username or ""):
+            raise ValueError(f"Invalid username {username!r}: use 1-64 letters, digits and _ . @ + -")
+        if not password:
+            raise ValueError("The password must not be empty")
+        user = {
+            "password_hash": md5_crypt(password),
+            "ports": sorted({int(port) for port in ports}) if ports is not None else None,
+            "countries": sorted(set(countries)) if countries is not None else None,
+            "created": time.ctime(),
+            "updated": None,
+        }
+        with self.backend.transaction() as users:
+            if username in users:
+                raise ValueError(f"User {username} already exists")
+            users[username] = user
+        return public(username, user)
+
+    def update(self, username, **changes):
+        """
+        Change the password, ports or countries of a user; fields not passed stay as they are.
+
+        Args:
+            username (str): The user to change.
+            **changes: 'password', and 'ports' or 'countries' (None lifts the restriction).
+
+        Returns:
+            dict or None: The updated user, or None if there is no such user.
+
+        Raises:
+            ValueError: If the new password is empty.
+        """
+        if "password" in changes and not changes["password"]:
+            raise ValueError("The password must not be empty")
+        with self.backend.transaction() as users:
+            user = users.get(username)
+            if user is None:
+                return None
+            if "password" in changes:
+                user["password_hash"] = md5_crypt(changes["password"])
+            if "ports" in changes:
+                ports = changes["ports"]
+                user["ports"] = sorted({int(port) for port in ports}) if ports is not None else None
+            if "countries" in changes:
+                user["countries"] = sorted(set(changes["countries"])) if changes["countries"] is not None else None
+            user["updated"] = time.ctime()
+        return public(username, user)
+
+    def remove(self, username):
+        """Delete a user. Returns False if there is no such user."""
+        with self.backend.transaction() as users:
+            return users.pop(username, None) is not None
+
+    def verify(self, username, password):
+        """Check a user's password against its stored hash."""
+        user = self.load().get(username)
+        if user is None:
+            return False
+        key = (username, user["password_hash"])
+        fingerprint = hashlib.sha256(password.encode()).digest()
+        with self._lock:
+            cached = self._verified.get(key)
+        if cached is not None:
+            return hmac.compare_digest(cached, fingerprint)
+        if not hmac.compare_digest(md5_crypt(password, user["password_hash"].split("$")[2]), user["password_hash"]):
+            return False
+        with self._lock:
+            users = self.load()
+            if len(self._verified) >= len(users):
+                # Drop the entries of changed passwords and removed users
+                self._verified = {
+                    k: v for k, v in self._verified.items() if users.get(k[0], {}).get("password_hash") == k[1]
+                }
+            self._verified[key] = fingerprint
+        return True
+
+    def permits(self, username, port, country=None):
+        """Return whether a user exists and may use the proxy on `port`, of `country`."""
+        user = self.load().get(username)
+        return user is not None and permits(user, port, country)
+
+
+class UserWatcher:
+    """
+    Calls `reload` every `interval` seconds in a background thread.
+
+    Lets a long-running process pick up users changed by another one (the CLI
+    while the API runs) within about a second; `reload` itself finds out
+    whether anything changed.
+    """
+
+    def __init__(self, reload, interval=USERS_RELOAD_INTERVAL):
+        self.reload = reload
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start watching in a background thread."""
+        self._thread = threading.Thread(target=self.run, name="user-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching."""
+        self._stopped.set()
+
+    def run(self):
+        """Call `reload` until stopped."""
+        while not self._stopped.is_set():
+            try:
+                self.reload()
+            except OSError as e:
+                print(f"UserWatcher: cannot reload users: {e}")
+            self._stopped.wait(self.interval)
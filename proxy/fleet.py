@@ -0,0 +1,141 @@
+import json
+from pathlib import Path
+
+# Fields of a proxy in a fleet spec
+SPEC_FIELDS = ("port", "country", "config", "label", "limits", "traffic")
+
+
+def load_fleet(path):
+    """
+    Read a fleet spec file.
+
+    YAML needs PyYAML (installed along with uvicorn[standard]); without it the
+    file is read as JSON, which is valid YAML as well.
+
+    Raises:
+        ValueError: If the file cannot be parsed or the spec is invalid.
+    """
+    text = Path(path).read_text()
+    try:
+        import yaml
+    except ImportError:
+        yaml = None
+    if yaml is not None:
+        try:
+            data = yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise ValueError(f"Cannot parse {path}: {e}") from e
+    else:
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Cannot parse {path} as JSON ({e}); install PyYAML to read YAML") from e
+    return parse_fleet(data)
+
+
+def parse_fleet(data):
+    """
+    Validate a fleet spec and return its proxies as start specs, sorted by port.
+
+    The spec is a list of proxies, or a mapping with 'proxies' and optional
+    'defaults' applied to every proxy. Each proxy has 'port' and 'country' and
+    optionally 'config' ("auto" or missing = any config of the country), 'label',
+    'limits' and 'traffic' as accepted by start requests.
+
+    Raises:
+        ValueError: If the spec is malformed or lists a port twice.
+    """
+    defaults = {}
+    if isinstance(data, dict):
+        defaults = data.get("defaults") or {}
+        data = data.get("proxies")
+    if not isinstance(data, list) or not isinstance(defaults, dict):
+        raise ValueError("A fleet spec is a list of proxies or a mapping with a 'proxies' list")
+
+    specs = {}
+    for index, item in enumerate(data, 1):
+        if not isinstance(item, dict):
+            raise ValueError(f"Proxy #{index} is not a mapping")
+        spec = {**defaults, **item}
+        unknown = set(spec) - set(SPEC_FIELDS)
+        if unknown:
+            raise ValueError(f"Proxy #{index} has unknown fields: {', '.join(sorted(unknown))}")
+        port = spec.get("port")
+        if not isinstance(port, int) or not 1024 <= port <= 65535:
+            raise ValueError(f"Proxy #{index} needs a port between 1024 and 65535")
+        if not spec.get("country") or not isinstance(spec["country"], str):
+            raise ValueError(f"Proxy on port {port} needs a country")
+        if port in specs:
+            raise ValueError(f"Port {port} is listed twice")
+        for field in ("limits", "traffic"):
+            if spec.get(field) is not None and not isinstance(spec[field], dict):
+                raise ValueError(f"The {field} of port {port} must be a mapping")
+        config = spec.get("config")
+        specs[port] = {
+            "port": port,
+            "country": spec["country"],
+            "config": None if config in (None, "auto") else str(config).removesuffix(".ovpn"),
+            "label": spec.get("label"),
+            "limits": _present(spec.get("limits")) or None,
+            "traffic": _traffic(spec.get("traffic")) or None,
+        }
+    return [specs[port] for port in sorted(specs)]
+
+
+def _present(values):
+    return {name: value for name, value in (values or {}).items() if value is not None}
+
+
+def _traffic(traffic):
+    """Drop unset traffic fields, and the quota action of a proxy without quota."""
+    traffic = _present(traffic)
+    if traffic.get("quota_bytes"):
+        traffic.setdefault("quota_action", "throttle")
+    else:
+        traffic.pop("quota_action", None)
+    return traffic
+
+
+def plan_fleet(desired, state, alive, prune=True):
+    """
+    Diff a fleet spec against the recorded proxies.
+
+    Args:
+        desired (list): Start specs from parse_fleet().
+        state (dict): The proxy state.
+        alive (dict): Port mapped to whether the proxy's processes and tunnel really run.
+        prune (bool): Stop recorded proxies the spec does not list.
+
+    Returns:
+        dict: 'start' (ports not running yet), 'replace' (port -> why it has to be
+        restarted: other country, config, limits or traffic, or not running),
+        'relabel' (only the label differs), 'stop' and 'keep' (ports left alone).
+    """
+    plan = {"start": [], "replace": {}, "relabel": [], "stop": [], "keep": []}
+    for spec in desired:
+        port = spec["port"]
+        info = state.get(str(port))
+        if info is None:
+            plan["start"].append(port)
+            continue
+        reasons = []
+        if info.get("country") != spec["country"]:
+            reasons.append(f"country {info.get('country')} -> {spec['country']}")
+        if spec["config"] is not None and str(info.get("config")).removesuffix(".ovpn") != spec["config"]:
+            reasons.append(f"config {info.get('config')} -> {spec['config']}")
+        if _present(info.get("limits")) != (spec["limits"] or {}):
+            reasons.append("limits changed")
+        if _traffic(info.get("traffic")) != (spec["traffic"] or {}):
+            reasons.append("traffic changed")
+        if not reasons and not alive.get(port):
+            reasons.append("not running")
+        if reasons:
+            plan["replace"][port] = ", ".join(reasons)
+        elif info.get("label") != spec["label"]:
+            plan["relabel"].append(port)
+        else:
+            plan["keep"].append(port)
+    if prune:
+        listed = {spec["port"] for spec in desired}
+        plan["stop"] = sorted(int(port) for port in state if int(port) not in listed)
+    return plan
@@ -0,0 +1,514 @@
+import asyncio
+import base64
+import contextlib
+import hmac
+import ipaddress
+import os
+import socket
+import struct
+import threading
+import time
+from urllib.parse import urlsplit
+
+from core.config import (
+    FORWARDER_MAX_CONNECTIONS,
+    FORWARDER_SYNC_INTERVAL,
+    PROXY_PASS,
+    PROXY_USER,
+)
+
+# Upper bound on a request head / SOCKS handshake before the client is dropped
+MAX_HEADER_SIZE = 64 * 1024
+RELAY_CHUNK = 64 * 1024
+CONNECT_TIMEOUT = 15
+HANDSHAKE_TIMEOUT = 30
+# Pause after a failed accept, e.g. while out of file descriptors
+ACCEPT_RETRY_DELAY = 0.5
+
+SOCKS_VERSION = 5
+SOCKS_AUTH_USERPASS = 0x02
+SOCKS_NO_ACCEPTABLE = 0xFF
+SOCKS_CMD_CONNECT = 1
+SOCKS_ATYP_IPV4 = 1
+SOCKS_ATYP_DOMAIN = 3
+SOCKS_ATYP_IPV6 = 4
+SOCKS_REPLY_OK = 0
+SOCKS_REPLY_FAILURE = 1
+SOCKS_REPLY_NOT_ALLOWED = 2
+SOCKS_REPLY_UNREACHABLE = 4
+SOCKS_REPLY_CMD_UNSUPPORTED = 7
+
+# Headers meant for the proxy itself, not forwarded upstream
+HOP_BY_HOP_HEADERS = {"proxy-authorization", "proxy-connection", "connection", "keep-alive", "x-proxy-session"}
+
+SPLICE_SUPPORTED = hasattr(os, "splice")
+
+
+class ProxyError(Exception):
+    """A client request that cannot be served; `status` is the HTTP status to answer with."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class BufferPool:
+    """Reusable receive buffers shared by every relay on the event loop."""
+
+    def __init__(self, size=RELAY_CHUNK, keep=256):
+        self.size = size
+        self.keep = keep
+        self.free = []
+
+    def acquire(self):
+        return self.free.pop() if self.free else bytearray(self.size)
+
+    def release(self, buf):
+        if len(self.free) < self.keep:
+            self.free.append(buf)
+
+
+class PortStats:
+    """Connection and byte counters of one listening port."""
+
+    def __init__(self):
+        self.active = 0
+        self.total = 0
+        self.rejected = 0
+        self.bytes_up = 0
+        self.bytes_down = 0
+
+    def to_dict(self):
+        return {
+            "active": self.active,
+            "total": self.total,
+            "rejected": self.rejected,
+            "bytes_up": self.bytes_up,
+            "bytes_down": self.bytes_down,
+        }
+
+
+def default_authenticate(username, password, port):
+    """Check credentials against PROXY_USER / PROXY_PASS."""
+    if not PROXY_USER:
+        return False
+    # compare_digest only takes ASCII str, clients may send anything
+    return hmac.compare_digest(username.encode(), PROXY_USER.encode()) and hmac.compare_digest(
+        password.encode(), (PROXY_PASS or "").encode()
+    )
+
+
+async def _wait_fd(loop, fd, writable=False):
+    """Wait until `fd` is readable (or writable)."""
+    future = loop.create_future()
+
+    def ready():
+        if not future.done():
+            future.set_result(None)
+
+    add, remove = (loop.add_writer, loop.remove_writer) if writable else (loop.add_reader, loop.remove_reader)
+    add(fd, ready)
+    try:
+        await future
+    finally:
+        remove(fd)
+
+
+class ForwardingEngine:
+    """
+    Pure-Python HTTP/SOCKS5 proxy serving many ports from one asyncio event loop.
+
+    Each listening port forwards through its own external IP: outgoing sockets are
+    bound to the instance's tun_ip, which the policy routing sends through the
+    matching VPN tunnel (like 3proxy's -e option). Relays move data with
+    os.splice where available, falling back to recv_into on pooled buffers.
+
+    Hooks:
+        on_connect(port, client, target) -> bool: return False to refuse a connection.
+        on_close(port, client, target, bytes_up, bytes_down, duration): called once per connection.
+    """
+
+    def __init__(
+        self,
+        authenticate=default_authenticate,
+        listener_source=None,
+        max_connections=FORWARDER_MAX_CONNECTIONS,
+        on_connect=None,
+        on_close=None,
+        bind_host="0.0.0.0",
+    ):
+        self.authenticate = authenticate
+        self.listener_source = listener_source
+        self.max_connections = max_connections
+        self.on_connect = on_connect
+        self.on_close = on_close
+        self.bind_host = bind_host
+        self.listeners = {}
+        self.stats = {}
+        self.buffers = BufferPool()
+        self.loop = None
+        self._sync_event = None
+
+    # ---------- Listener management ----------
+
+    async def add_listener(self, port, tun_ip):
+        """Start serving `port`, sending outgoing traffic from `tun_ip`."""
+        current = self.listeners.get(port)
+        if current is not None:
+            if current["tun_ip"] == tun_ip:
+                return
+            await self.remove_listener(port)
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.bind_host, port))
+        sock.listen(1024)
+        sock.setblocking(False)
+        listener = {"tun_ip": tun_ip, "sock": sock, "clients": set()}
+        listener["task"] = asyncio.create_task(self._accept_loop(port, listener))
+        self.listeners[port] = listener
+        self.stats.setdefault(port, PortStats())
+
+    async def remove_listener(self, port):
+        """Stop serving `port` and drop its open connections."""
+        listener = self.listeners.pop(port, None)
+        if listener is None:
+            return
+        listener["task"].cancel()
+        for task in list(listener["clients"]):
+            task.cancel()
+        listener["sock"].close()
+        self.stats.pop(port, None)
+
+    async def sync(self, listeners):
+        """Make the served ports match `listeners` (port -> tun_ip)."""
+        for port in set(self.listeners) - set(listeners):
+            await self.remove_listener(port)
+        for port, tun_ip in listeners.items():
+            try:
+                await self.add_listener(port, tun_ip)
+            except OSError as e:
+                print(f"Forwarder: cannot listen on port {port}: {e}")
+
+    def request_sync(self):
+        """Ask the engine to re-read its listener source now (thread-safe)."""
+        if self.loop is not None and self._sync_event is not None:
+            self.loop.call_soon_threadsafe(self._sync_event.set)
+
+    async def serve(self, sync_interval=FORWARDER_SYNC_INTERVAL):
+        """
+        Serve until cancelled, following `listener_source()` for the set of ports.
+
+        The source is polled every `sync_interval` seconds and whenever
+        request_sync() is called.
+        """
+        self.loop = asyncio.get_running_loop()
+        self._sync_event = asyncio.Event()
+        try:
+            while True:
+                if self.listener_source is not None:
+                    listeners = await asyncio.to_thread(self.listener_source)
+                    await self.sync(listeners)
+                self._sync_event.clear()
+                with contextlib.suppress(TimeoutError):
+                    await asyncio.wait_for(self._sync_event.wait(), sync_interval)
+        finally:
+            await self.sync({})
+
+    def start_in_thread(self):
+        """Run serve() on a dedicated event loop in a daemon thread."""
+        thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name="forwarder", daemon=True)
+        thread.start()
+        return thread
+
+    # ---------- Connection handling ----------
+
+    async def _accept_loop(self, port, listener):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                client, address = await loop.sock_accept(listener["sock"])
+            except OSError as e:
+                # Out of file descriptors or an aborted connection: keep the port served
+                print(f"Forwarder: accept on port {port} failed: {e}")
+                await asyncio.sleep(ACCEPT_RETRY_DELAY)
+                continue
+            try:
+                client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                client.close()
+                continue
+            task = asyncio.create_task(self._handle_client(port, listener["tun_ip"], client, address))
+            listener["clients"].add(task)
+            task.add_done_callback(listener["clients"].discard)
+
+    async def _handle_client(self, port, tun_ip, client, address):
+        loop = asyncio.get_running_loop()
+        stats = self.stats.setdefault(port, PortStats())
+        if self.max_connections and stats.active >= self.max_connections:
+            stats.rejected += 1
+            client.close()
+            return
+
+        stats.active += 1
+        stats.total += 1
+        started = time.monotonic()
+        target = None
+        upstream = None
+        counters = [0, 0]
+        try:
+            first = await asyncio.wait_for(loop.sock_recv(client, RELAY_CHUNK), HANDSHAKE_TIMEOUT)
+            if not first:
+                return
+            if first[0] == SOCKS_VERSION:
+                target, upstream, leftover = await self._socks5(loop, port, tun_ip, client, address, first)
+            else:
+                target, upstream, leftover = await self._http(loop, port, tun_ip, client, address, first)
+            if upstream is None:
+                return
+            if leftover:
+                await loop.sock_sendall(upstream, leftover)
+                counters[0] += len(leftover)
+            await self._relay(loop, client, upstream, counters)
+        except (OSError, TimeoutError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            stats.active -= 1
+            stats.bytes_up += counters[0]
+            stats.bytes_down += counters[1]
+            client.close()
+            if upstream is not None:
+                upstream.close()
+            if self.on_close and target is not None:
+                self.on_close(port, address, target, counters[0], counters[1], time.monotonic() - started)
+
+    def select_exit(self, port, tun_ip, address, username, headers):
+        """
+        Return the IP outgoing connections of a client are bound to.
+
+        The listener's own tun_ip here; subclasses may choose per client, using its
+        `address`, the authenticated `username` and, for HTTP clients, the request `headers`.
+        """
+        return tun_ip
+
+    async def _open_upstream(self, loop, port, tun_ip, address, host, target_port, username=None, headers=()):
+        """Connect to host:target_port from the client's exit IP, after consulting the on_connect hook."""
+        target = (host, target_port)
+        if self.on_connect and not self.on_connect(port, address, target):
+            raise ProxyError(403, "Connection refused by policy")
+        tun_ip = self.select_exit(port, tun_ip, address, username, headers)
+        try:
+            infos = await loop.getaddrinfo(host, target_port, family=socket.AF_INET, type=socket.SOCK_STREAM)
+        except OSError as e:
+            raise ProxyError(502, f"Cannot resolve {host}") from e
+        last_error = None
+        for family, sock_type, proto, _, sockaddr in infos:
+            upstream = socket.socket(family, sock_type, proto)
+            upstream.setblocking(False)
+            try:
+                upstream.bind((tun_ip, 0))
+                await asyncio.wait_for(loop.sock_connect(upstream, sockaddr), CONNECT_TIMEOUT)
+                upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                return upstream
+            except (OSError, TimeoutError) as e:
+                upstream.close()
+                last_error = e
+        raise ProxyError(502, f"Cannot connect to {host}:{target_port}: {last_error}")
+
+    # ---------- HTTP ----------
+
+    async def _read_until(self, loop, sock, data, marker):
+        while marker not in data:
+            if len(data) > MAX_HEADER_SIZE:
+                raise ProxyError(431, "Request header too large")
+            chunk = await asyncio.wait_for(loop.sock_recv(sock, RELAY_CHUNK), HANDSHAKE_TIMEOUT)
+            if not chunk:
+                raise asyncio.IncompleteReadError(data, None)
+            data += chunk
+        return data
+
+    async def _http(self, loop, port, tun_ip, client, address, data):
+        try:
+            data = await self._read_until(loop, client, data, b"\r\n\r\n")
+            head, leftover = data.split(b"\r\n\r\n", 1)
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            method, url, version = request_line.split(" ", 2)
+            headers = [line.split(":", 1) for line in header_lines if ":" in line]
+
+            username = self._http_username(headers, port)
+            if username is None:
+                await loop.sock_sendall(
+                    client,
+                    b"HTTP/1.1 407 Proxy Authentication Required\r\n"
+                    b'Proxy-Authenticate: Basic realm="proxy"\r\nContent-Length: 0\r\nConnection: close\r\n\r\n',
+                )
+                return None, None, b""
+
+            if method.upper() == "CONNECT":
+                host, _, target_port = url.rpartition(":")
+                host = host.strip("[]")
+                upstream = await self._open_upstream(
+                    loop, port, tun_ip, address, host, int(target_port), username, headers
+                )
+                await loop.sock_sendall(client, b"HTTP/1.1 200 Connection established\r\n\r\n")
+                return (host, int(target_port)), upstream, leftover
+
+            parts = urlsplit(url)
+            if parts.scheme != "http" or not parts.hostname:
+                raise ProxyError(400, "Only absolute http:// URLs can be forwarded")
+            target_port = parts.port or 80
+            upstream = await self._open_upstream(
+                loop, port, tun_ip, address, parts.hostname, target_port, username, headers
+            )
+            path = parts.path or "/"
+            if parts.query:
+                path += f"?{parts.query}"
+            lines = [f"{method} {path} {version}"]
+            lines += [f"{name}:{value}" for name, value in headers if name.strip().lower() not in HOP_BY_HOP_HEADERS]
+            lines.append("Connection: close")
+            request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+            return (parts.hostname, target_port), upstream, request + leftover
+        except ProxyError as e:
+            reason = str(e).encode("latin-1", "replace")
+            await loop.sock_sendall(
+                client,
+                f"HTTP/1.1 {e.status} Error\r\nContent-Length: {len(reason)}\r\nConnection: close\r\n\r\n".encode()
+                + reason,
+            )
+            return None, None, b""
+        except (ValueError, UnicodeDecodeError):
+            await loop.sock_sendall(client, b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+            return None, None, b""
+
+    def _http_username(self, headers, port):
+        """Return the username of valid Proxy-Authorization credentials, or None."""
+        for name, value in headers:
+            if name.strip().lower() != "proxy-authorization":
+                continue
+            scheme, _, encoded = value.strip().partition(" ")
+            if scheme.lower() != "basic":
+                return None
+            try:
+                username, _, password = base64.b64decode(encoded).decode().partition(":")
+            except (ValueError, UnicodeDecodeError):
+                return None
+            return username if self.authenticate(username, password, port) else None
+        return None
+
+    # ---------- SOCKS5 ----------
+
+    async def _recv_exact(self, loop, sock, buffer, size):
+        while len(buffer) < size:
+            chunk = await asyncio.wait_for(loop.sock_recv(sock, RELAY_CHUNK), HANDSHAKE_TIMEOUT)
+            if not chunk:
+                raise asyncio.IncompleteReadError(bytes(buffer), size)
+            buffer += chunk
+        data = bytes(buffer[:size])
+        del buffer[:size]
+        return data
+
+    async def _socks5(self, loop, port, tun_ip, client, address, data):
+        buffer = bytearray(data)
+        _, n_methods = await self._recv_exact(loop, client, buffer, 2)
+        methods = await self._recv_exact(loop, client, buffer, n_methods)
+        if SOCKS_AUTH_USERPASS not in methods:
+            await loop.sock_sendall(client, bytes([SOCKS_VERSION, SOCKS_NO_ACCEPTABLE]))
+            return None, None, b""
+        await loop.sock_sendall(client, bytes([SOCKS_VERSION, SOCKS_AUTH_USERPASS]))
+
+        # RFC 1929 username/password negotiation
+        _, user_len = await self._recv_exact(loop, client, buffer, 2)
+        username = (await self._recv_exact(loop, client, buffer, user_len)).decode(errors="replace")
+        (pass_len,) = await self._recv_exact(loop, client, buffer, 1)
+        password = (await self._recv_exact(loop, client, buffer, pass_len)).decode(errors="replace")
+        if not self.authenticate(username, password, port):
+            await loop.sock_sendall(client, b"\x01\x01")
+            return None, None, b""
+        await loop.sock_sendall(client, b"\x01\x00")
+
+        _, command, _, address_type = await self._recv_exact(loop, client, buffer, 4)
+        if address_type == SOCKS_ATYP_IPV4:
+            host = str(ipaddress.IPv4Address(await self._recv_exact(loop, client, buffer, 4)))
+        elif address_type == SOCKS_ATYP_DOMAIN:
+            (length,) = await self._recv_exact(loop, client, buffer, 1)
+            host = (await self._recv_exact(loop, client, buffer, length)).decode(errors="replace")
+        elif address_type == SOCKS_ATYP_IPV6:
+            host = str(ipaddress.IPv6Address(await self._recv_exact(loop, client, buffer, 16)))
+        else:
+            await self._socks_reply(loop, client, SOCKS_REPLY_CMD_UNSUPPORTED)
+            return None, None, b""
+        (target_port,) = struct.unpack("!H", await self._recv_exact(loop, client, buffer, 2))
+
+        if command != SOCKS_CMD_CONNECT:
+            await self._socks_reply(loop, client, SOCKS_REPLY_CMD_UNSUPPORTED)
+            return None, None, b""
+        try:
+            upstream = await self._open_upstream(loop, port, tun_ip, address, host, target_port, username)
+        except ProxyError as e:
+            reply = SOCKS_REPLY_NOT_ALLOWED if e.status == 403 else SOCKS_REPLY_UNREACHABLE
+            await self._socks_reply(loop, client, reply)
+            return None, None, b""
+        await self._socks_reply(loop, client, SOCKS_REPLY_OK, upstream.getsockname())
+        return (host, target_port), upstream, bytes(buffer)
+
+    async def _socks_reply(self, loop, client, code, bound=("0.0.0.0", 0)):
+        reply = bytes([SOCKS_VERSION, code, 0, SOCKS_ATYP_IPV4])
+        reply += ipaddress.IPv4Address(bound[0]).packed + struct.pack("!H", bound[1])
+        await loop.sock_sendall(client, reply)
+
+    # ---------- Relaying ----------
+
+    async def _relay(self, loop, client, upstream, counters):
+        """Copy data both ways until both sides have closed; counters are [up, down]."""
+        pump = self._pump_splice if SPLICE_SUPPORTED else self._pump_copy
+        await asyncio.gather(
+            pump(loop, client, upstream, counters, 0),
+            pump(loop, upstream, client, counters, 1),
+        )
+
+    async def _pump_splice(self, loop, src, dst, counters, index):
+        """Move bytes from src to dst through a kernel pipe, without copying them into Python."""
+        read_fd, write_fd = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+        try:
+            while True:
+                try:
+                    moved = os.splice(src.fileno(), write_fd, RELAY_CHUNK, flags=flags)
+                except BlockingIOError:
+                    await _wait_fd(loop, src.fileno())
+                    continue
+                if moved == 0:
+                    break
+                pending = moved
+                while pending:
+                    try:
+                        pending -= os.splice(read_fd, dst.fileno(), pending, flags=flags)
+                    except BlockingIOError:
+                        await _wait_fd(loop, dst.fileno(), writable=True)
+                counters[index] += moved
+        except OSError:
+            pass
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+            with contextlib.suppress(OSError):
+                dst.shutdown(socket.SHUT_WR)
+
+    async def _pump_copy(self, loop, src, dst, counters, index):
+        """Copy bytes from src to dst through a pooled buffer."""
+        buf = self.buffers.acquire()
+        view = memoryview(buf)
+        try:
+            while True:
+                received = await loop.sock_recv_into(src, buf)
+                if not received:
+                    break
+                await loop.sock_sendall(dst, view[:received])
+                counters[index] += received
+        except OSError:
+            pass
+        finally:
+            view.release()
+            self.buffers.release(buf)
+            with contextlib.suppress(OSError):
+                dst.shutdown(socket.SHUT_WR)
@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import itertools
+import random
+import threading
+
+from core.config import GATEWAY_POLICY, GATEWAY_PORT
+from proxy.forwarder import ForwardingEngine, ProxyError, default_authenticate
+
+POLICIES = ("round-robin", "least-connections", "random", "sticky")
+
+# Health states in which a proxy receives no new gateway connections
+UNAVAILABLE_HEALTH = {"unhealthy", "restarting", "failed"}
+
+
+def parse_username(username):
+    """
+    Split routing options off a gateway username.
+
+    "alice-country-usa-session-42" yields ("alice", {"country": "usa", "session": "42"}).
+
+    Returns:
+        tuple: The plain username and a dict of options.
+    """
+    parts = username.split("-")
+    options = {}
+    while len(parts) >= 3 and parts[-2] in ("country", "session") and parts[-2] not in options:
+        options[parts[-2]] = parts[-1]
+        del parts[-2:]
+    return "-".join(parts), options
+
+
+class GatewayEngine(ForwardingEngine):
+    """
+    One listening port spreading client connections over every running proxy.
+
+    For each connection an exit is picked among the proxies recorded in the state
+    (skipping those the health monitor reports as broken) and the outgoing socket is
+    bound to its tun_ip, exactly as if the client had used that proxy's own port.
+
+    Clients steer the choice through their username: "user-country-usa" only uses
+    proxies of that country and "user-session-<id>" (or an X-Proxy-Session header)
+    keeps a session on the same exit for as long as it is running. Connections
+    without a session follow `policy`; "sticky" treats each client IP as a session.
+    With `permits(username, port, country)`, users only get the exits it allows.
+    """
+
+    def __init__(
+        self,
+        state_manager,
+        port=GATEWAY_PORT,
+        policy=GATEWAY_POLICY,
+        authenticate=default_authenticate,
+        permits=None,
+        **kwargs,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown gateway policy {policy!r}, expected one of: {', '.join(POLICIES)}")
+        super().__init__(authenticate=self._authenticate, listener_source=self._refresh, **kwargs)
+        self.state_manager = state_manager
+        self.port = port
+        self.policy = policy
+        self.check_credentials = authenticate
+        self.permits = permits
+        # Running proxies as (port, country, tun_ip), refreshed on every listener sync
+        self.backends = []
+        # tun_ip -> upstream sockets opened through it, for least-connections
+        self.upstreams = {}
+        # Client task -> (tun_ip, upstream) pairs it opened, dropped when the connection ends
+        self._opened = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _authenticate(self, username, password, port):
+        # The gateway port is no proxy port: which proxies a user may use is checked per exit
+        user, _ = parse_username(username)
+        return self.check_credentials(user, password, None)
+
+    def _refresh(self):
+        """Re-read the running proxies from the state; returns the gateway listener."""
+        self.backends = [
+            (int(port), info.get("country"), info["tun_ip"])
+            for port, info in sorted(self.state_manager.get_state().items(), key=lambda item: int(item[0]))
+            if info.get("tun_ip") and (info.get("health") or {}).get("status") not in UNAVAILABLE_HEALTH
+        ]
+        return {self.port: None}
+
+    def active_connections(self, tun_ip):
+        """Number of open gateway connections leaving through `tun_ip`."""
+        with self._lock:
+            return len(self.upstreams.get(tun_ip, ()))
+
+    def select_exit(self, port, tun_ip, address, username, headers):
+        user, options = parse_username(username or "")
+        session = options.get("session") or next(
+            (value.strip() for name, value in headers if name.strip().lower() == "x-proxy-session"), None
+        )
+        if session is None and self.policy == "sticky":
+            # Without an explicit session the sticky policy keeps each client IP on one exit
+            session = address[0]
+        country = options.get("country")
+        candidates = [
+            b
+            for b in self.backends
+            if (country is None or b[1] == country) and (self.permits is None or self.permits(user, b[0], b[1]))
+        ]
+        if not candidates:
+            raise ProxyError(503, f"No running proxy{f' for {country}' if country else ''}")
+
+        if session:
+            # Rendezvous hashing: a session stays on its exit while that exit is running,
+            # and only the sessions of a removed exit move elsewhere
+            backend = max(candidates, key=lambda b: hashlib.sha1(f"{session}/{b[0]}".encode()).digest())
+        elif self.policy == "round-robin":
+            backend = candidates[next(self._counter) % len(candidates)]
+        elif self.policy == "least-connections":
+            backend = min(candidates, key=lambda b: self.active_connections(b[2]))
+        else:
+            backend = random.choice(candidates)
+        return backend[2]
+
+    async def _open_upstream(self, loop, port, tun_ip, address, host, target_port, username=None, headers=()):
+        upstream = await super()._open_upstream(loop, port, tun_ip, address, host, target_port, username, headers)
+        exit_ip = upstream.getsockname()[0]
+        with self._lock:
+            self.upstreams.setdefault(exit_ip, set()).add(upstream)
+            self._opened.setdefault(asyncio.current_task(), []).append((exit_ip, upstream))
+        return upstream
+
+    async def _handle_client(self, port, tun_ip, client, address):
+        try:
+            await super()._handle_client(port, tun_ip, client, address)
+        finally:
+            with self._lock:
+                for exit_ip, upstream in self._opened.pop(asyncio.current_task(), ()):
+                    sockets = self.upstreams.get(exit_ip, set())
+                    sockets.discard(upstream)
+                    if not sockets:
+                        self.upstreams.pop(exit_ip, None)
+
+    def status(self):
+        """Return the gateway port, policy and open connections per exit."""
+        return {
+            "port": self.port,
+            "policy": self.policy,
+            "exits": [
+                {"port": port, "country": country, "tun_ip": tun_ip, "active": self.active_connections(tun_ip)}
+                for port, country, tun_ip in self.backends
+            ],
+        }
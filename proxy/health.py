@@ -0,0 +1,217 @@
+import contextlib
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import quote
+
+from core import logfile
+from core.config import (
+    HEALTH_CHECK_INTERVAL,
+    HEALTH_CHECK_TIMEOUT,
+    HEALTH_CHECK_URL,
+    HEALTH_MAX_BACKOFF,
+    HEALTH_MAX_FAILURES,
+    PROXY_PASS,
+    PROXY_USER,
+)
+
+
+def rotate_logs():
+    """Rotate the OpenVPN logs (of proxies and warm tunnels) that outgrew LOG_MAX_BYTES."""
+    for log_file in Path("/tmp").glob("ovpn_*.log"):
+        with contextlib.suppress(OSError):
+            logfile.rotate(log_file)
+
+
+def pid_alive(pid_file):
+    """Return True if the PID in `pid_file` belongs to a running process."""
+    try:
+        os.kill(int(Path(pid_file).read_text().strip()), 0)
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+class HealthMonitor:
+    """
+    Periodically checks every proxy in the state and restarts the broken ones.
+
+    A check fails when the OpenVPN process is gone, the tun interface lost its
+    address, or (with HEALTH_CHECK_URL set) a request through the proxy port does
+    not succeed. After `max_failures` failed checks in a row the proxy is restarted
+    on another config of the same country. Failed restarts are retried with an
+    exponential backoff capped at HEALTH_MAX_BACKOFF seconds.
+
+    The outcome of the checks is stored under the 'health' key of each state entry,
+    which is only written when the status, the failure count (capped at
+    `max_failures`) or the restart count change, so a proxy that stays up or stays
+    down costs no state write per round. 'last_check' and 'last_failure_time' are
+    the times the status last changed and the proxy last went down.
+    Each round also rotates OpenVPN logs that outgrew LOG_MAX_BYTES.
+    """
+
+    def __init__(
+        self,
+        service,
+        interval=HEALTH_CHECK_INTERVAL,
+        url=HEALTH_CHECK_URL,
+        timeout=HEALTH_CHECK_TIMEOUT,
+        max_failures=HEALTH_MAX_FAILURES,
+        parallelism=8,
+    ):
+        self.service = service
+        self.state_manager = service.state_manager
+        self.interval = interval
+        self.url = url
+        self.timeout = timeout
+        self.max_failures = max(1, max_failures)
+        self.executor = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="health")
+        # Ports with a restart in progress
+        self._restarting = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start checking in a background thread."""
+        self._thread = threading.Thread(target=self.run, name="health-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop checking; restarts already running are allowed to finish."""
+        self._stopped.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self):
+        """Run check rounds until stopped."""
+        while not self._stopped.is_set():
+            # A failing round must not end the monitoring
+            try:
+                self.check_all()
+                rotate_logs()
+            except Exception as e:
+                print(f"HealthMonitor: check round failed: {e}")
+            self._stopped.wait(self.interval)
+
+    def check_all(self):
+        """
+        Check every recorded proxy concurrently.
+
+        Returns:
+            dict: Port mapped to the failure reason, or None for healthy proxies.
+        """
+        ports = [int(port) for port in self.state_manager.get_state()]
+        with self._lock:
+            ports = [port for port in ports if port not in self._restarting]
+        try:
+            reasons = list(self.executor.map(self.check_port, ports))
+        except RuntimeError:
+            return {}
+        results = dict(zip(ports, reasons, strict=True))
+        for port, reason in results.items():
+            self._record(port, reason)
+        return results
+
+    def check_port(self, port):
+        """
+        Check a single proxy.
+
+        Returns:
+            str or None: Why the proxy is unhealthy, or None if it is healthy.
+        """
+        info = self.state_manager.get(port)
+        if info is None:
+            return None
+        tunnel_id = info.get("tunnel_id", port)
+        supervisor = self.service.vpn_manager.supervisor
+        running = supervisor.is_running(("openvpn", tunnel_id)) if supervisor is not None else None
+        if running is None:
+            running = pid_alive(f"/tmp/ovpn_{tunnel_id}.pid")
+        if not running:
+            return "OpenVPN process is not running"
+        vpn = self.service.vpn_manager.management.status(tunnel_id) if self.service.vpn_manager.management else None
+        # No state yet means the management socket is unreachable (e.g. an older instance)
+        if vpn is not None and vpn["state"] not in (None, "CONNECTED"):
+            return f"OpenVPN is {vpn['state'].lower()}"
+        tun_interface = info.get("tun_interface", f"tun{tunnel_id}")
+        if not Path("/sys/class/net", tun_interface).exists():
+            return f"Interface {tun_interface} is missing"
+        if self.service.vpn_manager.get_tun_ip(tun_interface) != info.get("tun_ip"):
+            return f"Interface {tun_interface} lost its address {info.get('tun_ip')}"
+        if self.url:
+            return self._check_request(port)
+        return None
+
+    def _check_request(self, port):
+        proxy = f"http://{quote(PROXY_USER or '', safe='')}:{quote(PROXY_PASS or '', safe='')}@127.0.0.1:{port}"
+        opener = urllib.request.build_opener(urllib.request.ProxyHandler({"http": proxy, "https": proxy}))
+        try:
+            with opener.open(self.url, timeout=self.timeout) as response:
+                response.read(1024)
+        except Exception as e:
+            return f"Request to {self.url} failed: {e}"
+        return None
+
+    def _record(self, port, reason):
+        """Store the check result in the state and restart the proxy when due."""
+        info = self.state_manager.get(port)
+        if info is None:
+            return
+        now = time.time()
+        previous = info.get("health") or {}
+        health = dict(previous)
+        if reason is None:
+            health.update(status="healthy", consecutive_failures=0)
+            # A tunnel that stayed up long enough starts over with a short backoff
+            if now - health.get("last_restart", 0) > HEALTH_MAX_BACKOFF:
+                health["restarts"] = 0
+        else:
+            # Counting on past the threshold would change the record every round
+            failures = min(health.get("consecutive_failures", 0) + 1, self.max_failures)
+            health.update(status="unhealthy", consecutive_failures=failures, last_failure_reason=reason)
+        if any(health.get(key) != previous.get(key) for key in ("status", "consecutive_failures", "restarts")):
+            if health["status"] != previous.get("status"):
+                health["last_check"] = now
+                if reason is not None:
+                    health["last_failure_time"] = now
+            if not self.state_manager.update(port, health=health):
+                return
+
+        due = reason is not None and health["consecutive_failures"] >= self.max_failures
+        if due and now >= health.get("next_restart", 0):
+            with self._lock:
+                if port in self._restarting:
+                    return
+                self._restarting.add(port)
+            try:
+                self.executor.submit(self._restart, port, health)
+            except RuntimeError:
+                with self._lock:
+                    self._restarting.discard(port)
+
+    def _restart(self, port, health):
+        restarts = health.get("restarts", 0) + 1
+        backoff = min(HEALTH_MAX_BACKOFF, self.interval * 2 ** min(restarts, 16))
+        health = {
+            **health,
+            "status": "restarting",
+            "restarts": restarts,
+            "last_restart": time.time(),
+            "next_restart": time.time() + backoff,
+        }
+        try:
+            result = self.service.restart_proxy(port, health=health)
+            if result["success"]:
+                # Failures of the new tunnel count from zero, the backoff keeps growing
+                self.state_manager.update(port, health={**health, "status": "healthy", "consecutive_failures": 0})
+            else:
+                self.state_manager.update(
+                    port,
+                    health={**health, "status": "failed", "last_failure_reason": result["message"]},
+                )
+        finally:
+            with self._lock:
+                self._restarting.discard(port)
@@ -3,29 +3,61 @@ import os
 import time
 from pathlib import Path
 
+from core.config import STOP_TIMEOUT
 from proxy.server import ProxyServer
 from vpn.manager import VPNManager
+from vpn.shaping import traffic_rates
+
+# Seconds to wait for OpenVPN to write its PID file after daemonizing
+PID_FILE_GRACE = 2
 
 
 class ProxyInstance:
     """
     Represents a single proxy instance (OpenVPN + 3proxy).
+
+    The tunnel side (tun interface, routing table, OpenVPN files, cgroup) is keyed
+    by `tunnel_id`, which is the port itself unless the instance took over a warm
+    tunnel from the TunnelPool. `limits` are the resource limits of its cgroup,
+    `traffic` the rate limits and quota of its tunnel.
     """
 
-    def __init__(self, port, vpn_manager: VPNManager, proxy_server: ProxyServer):
+    def __init__(
+        self,
+        port,
+        vpn_manager: VPNManager,
+        proxy_server: ProxyServer,
+        tunnel_id=None,
+        limits=None,
+        traffic=None,
+    ):
         self.port = port
         self.vpn_manager = vpn_manager
         self.proxy_server = proxy_server
-        self.tun_interface = f"tun{port}"
+        self.tunnel_id = int(tunnel_id or port)
+        self.limits = {name: value for name, value in (limits or {}).items() if value is not None}
+        self.traffic = {name: value for name, value in (traffic or {}).items() if value is not None}
+        self.cgroup = None
+        self.tun_interface = f"tun{self.tunnel_id}"
         self.port_str = str(port)
-        self.ovpn_pid_file = f"/tmp/ovpn_{port}.pid"
-        self.ovpn_log_file = f"/tmp/ovpn_{port}.log"
-        self.temp_ovpn_cfg = f"/tmp/ovpn_cfg_{port}.ovpn"
+        self.ovpn_pid_file = f"/tmp/ovpn_{self.tunnel_id}.pid"
+        self.ovpn_log_file = f"/tmp/ovpn_{self.tunnel_id}.log"
+        self.temp_ovpn_cfg = f"/tmp/ovpn_cfg_{self.tunnel_id}.ovpn"
         self.proxy_cfg_file = f"/tmp/3proxy_{port}.cfg"
 
     def is_running(self):
         """Check if any processes are running for this port."""
-        for pid_file_path in [self.ovpn_pid_file, f"/tmp/3proxy_{self.port}.pid"]:
+        supervisor = self.vpn_manager.supervisor
+        for name, pid_file_path in [
+            (("openvpn", self.tunnel_id), self.ovpn_pid_file),
+            (("3proxy", self.port), f"/tmp/3proxy_{self.port}.pid"),
+        ]:
+            if supervisor is not None and supervisor.knows(name):
+                # Answered from the supervisor's table, no pid file involved
+                pid = supervisor.pid(name)
+                if pid is not None:
+                    return True, pid
+                continue
             pid_file = Path(pid_file_path)
             if pid_file.exists():
                 try:
@@ -40,54 +72,143 @@ class ProxyInstance:
 
     def start(self, country, config):
         """Starts the OpenVPN and 3proxy for this instance."""
+        success, result = self.start_tunnel(country, config)
+        if success:
+            shaped, error = self.shape()
+            if not shaped:
+                self.stop(result)
+                return False, error
+            self.attach(result, country)
+        return success, result
+
+    def attach(self, tun_ip, country=None):
+        """Start serving the proxy port through an already connected tunnel of `country`."""
+        self.proxy_server.start_3proxy(self.port, tun_ip, cgroup=self.cgroup, country=country)
+
+    def shape(self, throttled=False):
+        """
+        Apply the rate limits of `traffic` to the tun interface, or the throttled
+        rates once the quota is used up.
+
+        Returns:
+            tuple: (True, None) on success, (False, error message) otherwise.
+        """
+        download, upload = traffic_rates(self.traffic, throttled)
+        if download is None and upload is None:
+            return True, None
+        try:
+            self.vpn_manager.shaper.apply(self.tun_interface, download, upload)
+        except RuntimeError as e:
+            return False, f"Cannot limit the rate of {self.tun_interface}: {e}"
+        return True, None
+
+    def enter_cgroup(self):
+        """
+        Create the cgroup of the tunnel, or reuse it, and apply the limits.
+
+        Without cgroup support the processes run where the caller runs, which
+        only fails instances that ask for limits.
+
+        Returns:
+            tuple: (True, cgroup path or None) on success, (False, error message) otherwise.
+        """
+        cgroups = self.vpn_manager.cgroups
+        if cgroups is None or not cgroups.available():
+            if self.limits:
+                return False, "Resource limits need cgroup v2, which is disabled or not available"
+            return True, None
+        try:
+            self.cgroup = cgroups.create(self.tunnel_id, self.limits)
+        except ValueError as e:
+            return False, str(e)
+        return True, self.cgroup
+
+    def start_tunnel(self, country, config):
+        """
+        Connect OpenVPN and set up routing, without starting the proxy listener.
+
+        Returns:
+            tuple: (True, tun_ip) on success, (False, error message) otherwise.
+        """
+        success, result = self.enter_cgroup()
+        if not success:
+            return False, result
+
         ret_code, log_file, temp_cfg = self.vpn_manager.setup_vpn_process(
-            country, config, self.port, self.tun_interface
+            country, config, self.tunnel_id, self.tun_interface, cgroup=self.cgroup
         )
 
         if ret_code != 0:
+            if self.cgroup is not None:
+                self.vpn_manager.cgroups.remove_many([self.tunnel_id])
             return False, "Failed to start OpenVPN process"
 
-        # Give it a moment to initialize and create PID file
-        time.sleep(2)
+        # OpenVPN writes its PID file shortly after daemonizing, so a missing PID
+        # file only counts as a dead process once the grace period is over
+        started = time.monotonic()
 
-        # Wait for IP
-        tun_ip = None
-        for _ in range(30):
+        def is_alive():
             running, _ = self.is_running()
-            if not running:
-                return False, "OpenVPN process died unexpectedly"
+            return running or time.monotonic() - started < PID_FILE_GRACE
 
-            tun_ip = self.vpn_manager.get_tun_ip(self.tun_interface)
-            if tun_ip:
-                break
-            time.sleep(1)
+        tun_ip = self.vpn_manager.wait_for_tunnel(self.tunnel_id, self.tun_interface, is_alive=is_alive)
 
         if not tun_ip:
+            running, _ = self.is_running()
+            if not running:
+                # Keeps the log for the error report but stops a supervised OpenVPN from being restarted
+                self.vpn_manager.stop_vpn_processes(self.tunnel_id, proxy_port=self.port)
+                return False, "OpenVPN process died unexpectedly"
             error_msg = "Failed to get IP for interface (timeout)"
             self.stop()  # Cleanup
             return False, error_msg
 
         # Setup routing
-        self.vpn_manager.setup_routing(self.port, tun_ip, self.tun_interface)
-
-        # Start 3proxy
-        self.proxy_server.start_3proxy(self.port, tun_ip)
+        self.vpn_manager.setup_routing(self.tunnel_id, tun_ip, self.tun_interface)
 
         return True, tun_ip
 
-    def stop(self, tun_ip=None):
-        """Stops all processes and cleans up resources."""
-        self.vpn_manager.stop_vpn_processes(self.port)
+    def stop(self, tun_ip=None, cleanup_routing=True):
+        """
+        Stops all processes and cleans up resources.
+
+        Pass cleanup_routing=False when the caller removes the routing of many
+        instances at once through VPNManager.cleanup_routing_many.
+        """
+        self.proxy_server.stop_3proxy(self.port)
+        self.vpn_manager.stop_vpn_processes(self.tunnel_id, proxy_port=self.port)
+        self.remove_files()
+
+        if cleanup_routing:
+            self.vpn_manager.cleanup_routing(self.tunnel_id, tun_ip)
 
-        ovpn_log = Path(self.ovpn_log_file)
-        if ovpn_log.exists():
+    def remove_files(self):
+        """Remove the OpenVPN log with its rotated copies and the generated configs."""
+        for ovpn_log in Path(self.ovpn_log_file).parent.glob(f"{Path(self.ovpn_log_file).name}*"):
             with contextlib.suppress(Exception):
                 ovpn_log.unlink()
 
-        self.vpn_manager.cleanup_routing(self.port, tun_ip)
-
         for f_path in [self.temp_ovpn_cfg, self.proxy_cfg_file]:
             f = Path(f_path)
             if f.exists():
                 with contextlib.suppress(Exception):
                     f.unlink()
+
+
+def stop_instances(instances, timeout=STOP_TIMEOUT):
+    """
+    Stop several instances together under one deadline.
+
+    Listeners are dropped with one 3proxy reload, every OpenVPN and 3proxy process
+    is terminated at once, and tun interfaces and routing are removed in one batch
+    each, so stopping hundreds of proxies takes about as long as stopping one.
+    """
+    if not instances:
+        return
+    deadline = time.monotonic() + timeout
+    vpn_manager, proxy_server = instances[0].vpn_manager, instances[0].proxy_server
+    proxy_server.stop_3proxy_many([instance.port for instance in instances])
+    vpn_manager.stop_vpn_processes_many([(instance.tunnel_id, instance.port) for instance in instances], deadline)
+    for instance in instances:
+        instance.remove_files()
+    vpn_manager.cleanup_routing_many([instance.tunnel_id for instance in instances])
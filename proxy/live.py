@@ -0,0 +1,138 @@
+import os
+import re
+import threading
+import time
+
+from core.config import LIVE_STATUS_TTL
+from core.procfs import find_processes, link_states, process_stats
+from proxy.server import SHARED_CFG_FILE
+
+OVPN_DEV = re.compile(r"^tun(\d+)$")
+OVPN_PID_FILE = re.compile(r"/ovpn_(\d+)\.pid$")
+PROXY_CFG_FILE = re.compile(r"/3proxy_(\d+)\.cfg$")
+
+
+def _tunnel_id(argv):
+    """Return the tunnel id of an OpenVPN command line, from --dev or --writepid."""
+    for flag, value in zip(argv, argv[1:], strict=False):
+        if flag == "--dev" and OVPN_DEV.match(value):
+            return int(OVPN_DEV.match(value).group(1))
+        if flag == "--writepid" and OVPN_PID_FILE.search(value):
+            return int(OVPN_PID_FILE.search(value).group(1))
+    return None
+
+
+def _proxy_port(argv):
+    """Return the port of a per-port 3proxy command line."""
+    for arg in argv[1:]:
+        match = PROXY_CFG_FILE.search(arg)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def scan_processes():
+    """
+    Find every openvpn and 3proxy process of the proxies in one /proc scan.
+
+    Returns:
+        dict: 'openvpn' (tunnel id -> PIDs), '3proxy' (port -> PIDs of per-port
+        daemons) and '3proxy_shared' (PIDs of the shared daemon).
+    """
+    openvpn, proxies, shared = {}, {}, []
+    for pid, argv in find_processes({"openvpn", "3proxy"}).items():
+        if os.path.basename(argv[0]) == "openvpn":
+            tunnel_id = _tunnel_id(argv)
+            if tunnel_id is not None:
+                openvpn.setdefault(tunnel_id, []).append(pid)
+        elif SHARED_CFG_FILE in argv:
+            shared.append(pid)
+        else:
+            port = _proxy_port(argv)
+            if port is not None:
+                proxies.setdefault(port, []).append(pid)
+    return {"openvpn": openvpn, "3proxy": proxies, "3proxy_shared": shared}
+
+
+class LiveStatus:
+    """
+    Reports whether proxies really run, instead of what the state says.
+
+    A snapshot takes one pass over /proc (finding openvpn and 3proxy by their
+    command lines, then one stat file per process) and one over /sys/class/net.
+    It is reused for `ttl` seconds and concurrent callers wait for the same scan,
+    so a status request costs the same however large the fleet is or however often
+    it is asked; no pid file is read and nothing is spawned.
+    """
+
+    def __init__(self, ttl=LIVE_STATUS_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._taken = None
+
+    def snapshot(self):
+        """Return the current snapshot, scanning again once it is older than the TTL."""
+        with self._lock:
+            if self._snapshot is None or time.monotonic() - self._taken >= self.ttl:
+                self._snapshot = self._scan()
+                self._taken = time.monotonic()
+            return self._snapshot
+
+    @staticmethod
+    def _scan():
+        processes = scan_processes()
+        pids = [pid for group in ("openvpn", "3proxy") for pids in processes[group].values() for pid in pids]
+        return {
+            **processes,
+            "stats": process_stats(pids + processes["3proxy_shared"]),
+            "links": link_states(),
+            "checked_at": time.time(),
+        }
+
+    def get(self, port, info, mode):
+        """
+        Return the live status of one proxy.
+
+        Args:
+            port (int): The proxy port.
+            info (dict): Its state entry.
+            mode (str): The ProxyServer mode; there is no 3proxy to check in builtin mode.
+
+        Returns:
+            dict: 'alive', 'checked_at', 'openvpn' and '3proxy' (running, pid,
+            uptime_seconds, rss_bytes, cpu_seconds) and 'tun' (interface, exists,
+            operstate, up).
+        """
+        snapshot = self.snapshot()
+        tunnel_id = int(info.get("tunnel_id", port))
+        interface = info.get("tun_interface") or f"tun{tunnel_id}"
+        openvpn = self._process(snapshot, snapshot["openvpn"].get(tunnel_id, []))
+        proxy = None
+        if mode == "per-port":
+            proxy = self._process(snapshot, snapshot["3proxy"].get(int(port), []))
+        elif mode == "shared":
+            proxy = self._process(snapshot, snapshot["3proxy_shared"])
+        link = snapshot["links"].get(interface)
+        tun = {"interface": interface, "exists": link is not None, **(link or {"operstate": None, "up": False})}
+        return {
+            "alive": openvpn["running"] and tun["up"] and (proxy is None or proxy["running"]),
+            "checked_at": snapshot["checked_at"],
+            "openvpn": openvpn,
+            "3proxy": proxy,
+            "tun": tun,
+        }
+
+    @staticmethod
+    def _process(snapshot, pids):
+        for pid in pids:
+            stats = snapshot["stats"].get(pid)
+            if stats is not None:
+                return {
+                    "running": True,
+                    "pid": pid,
+                    "uptime_seconds": round(snapshot["checked_at"] - stats["start_time"], 1),
+                    "rss_bytes": stats["rss_bytes"],
+                    "cpu_seconds": stats["cpu_seconds"],
+                }
+        return {"running": False, "pid": None, "uptime_seconds": None, "rss_bytes": None, "cpu_seconds": None}
@@ -0,0 +1,215 @@
+import contextlib
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from core.config import POOL_REFILL_INTERVAL, POOL_TARGETS, POOL_TUNNEL_BASE
+from proxy.instance import ProxyInstance
+from proxy.server import ProxyServer
+from vpn.manager import VPNManager
+
+
+def parse_pool_targets(spec):
+    """
+    Parse a "country:count,country:count" string.
+
+    Returns:
+        dict: Country mapped to the number of warm tunnels to keep.
+    """
+    targets = {}
+    for item in (spec or "").split(","):
+        country, _, count = item.strip().partition(":")
+        if country and count.isdigit() and int(count) > 0:
+            targets[country] = int(count)
+    return targets
+
+
+class TunnelPool:
+    """
+    Keeps already connected OpenVPN tunnels ready for each configured country.
+
+    Warm tunnels have their routing in place but no proxy port attached. They use
+    tunnel ids from POOL_TUNNEL_BASE upwards, above the TCP port range, so their
+    tun interfaces, routing tables and PID files never clash with a port's own.
+    A background thread starts replacements as tunnels are claimed or die.
+    """
+
+    def __init__(
+        self,
+        vpn_manager: VPNManager,
+        proxy_server: ProxyServer,
+        targets=None,
+        configs_in_use=None,
+        tunnels_in_use=None,
+        refill_interval=POOL_REFILL_INTERVAL,
+        parallelism=4,
+    ):
+        self.vpn_manager = vpn_manager
+        self.proxy_server = proxy_server
+        self.targets = parse_pool_targets(POOL_TARGETS) if targets is None else targets
+        # Callable returning (country, config) pairs used by running proxies
+        self.configs_in_use = configs_in_use or (lambda: set())
+        # Callable returning the tunnel ids of running proxies, claimed pool tunnels among them
+        self.tunnels_in_use = tunnels_in_use or (lambda: set())
+        self.refill_interval = refill_interval
+        self.executor = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="pool")
+        self.warm = {country: [] for country in self.targets}
+        self.starting = dict.fromkeys(self.targets, 0)
+        # (country, config) pairs of tunnels being started
+        self.reserved = set()
+        self.failures = {}
+        self._ids = itertools.count(POOL_TUNNEL_BASE)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Remove leftovers of a previous run and start refilling in the background."""
+        self._cleanup_stale()
+        self._thread = threading.Thread(target=self._run, name="tunnel-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop refilling and tear down every warm tunnel."""
+        self._stopped.set()
+        self._wake.set()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            tunnels = [t for warm in self.warm.values() for t in warm]
+            for warm in self.warm.values():
+                warm.clear()
+        for tunnel in tunnels:
+            self._instance(tunnel["tunnel_id"]).stop(tunnel["tun_ip"])
+
+    def status(self):
+        """Return the warm, starting and target tunnel counts per country."""
+        with self._lock:
+            return {
+                country: {
+                    "target": target,
+                    "warm": len(self.warm[country]),
+                    "starting": self.starting[country],
+                    "configs": [t["config"] for t in self.warm[country]],
+                }
+                for country, target in self.targets.items()
+            }
+
+    def claim(self, country, config=None):
+        """
+        Take a warm tunnel for `country` (and `config`, if given) out of the pool.
+
+        Tunnels whose OpenVPN process died are discarded on the way.
+
+        Returns:
+            dict or None: The tunnel's 'tunnel_id', 'country', 'config', 'tun_ip' and
+            'tun_interface', or None if no matching tunnel is ready.
+        """
+        while True:
+            with self._lock:
+                candidates = [
+                    t for t in self.warm.get(country, []) if config is None or self._same_config(t["config"], config)
+                ]
+                if not candidates:
+                    return None
+                tunnel = candidates[0]
+                self.warm[country].remove(tunnel)
+            self._wake.set()
+            running, _ = self._instance(tunnel["tunnel_id"]).is_running()
+            if running and self.vpn_manager.get_tun_ip(tunnel["tun_interface"]) == tunnel["tun_ip"]:
+                return tunnel
+            self._instance(tunnel["tunnel_id"]).stop(tunnel["tun_ip"])
+
+    @staticmethod
+    def _same_config(a, b):
+        return a == b or a == f"{b}.ovpn" or b == f"{a}.ovpn"
+
+    def _instance(self, tunnel_id):
+        return ProxyInstance(tunnel_id, self.vpn_manager, self.proxy_server)
+
+    def _cleanup_stale(self):
+        """
+        Stop warm tunnels left behind by a previous process.
+
+        Tunnels claimed by a proxy are recorded in the state and keep running; new
+        tunnel ids are handed out above the highest one seen, so they never clash.
+        """
+        in_use = {int(tunnel_id) for tunnel_id in self.tunnels_in_use()}
+        highest = max(in_use, default=0)
+        for pid_file in Path("/tmp").glob("ovpn_*.pid"):
+            with contextlib.suppress(ValueError):
+                tunnel_id = int(pid_file.name.split("_")[-1].split(".")[0])
+                if tunnel_id >= POOL_TUNNEL_BASE:
+                    highest = max(highest, tunnel_id)
+                    if tunnel_id not in in_use:
+                        self._instance(tunnel_id).stop()
+        self._ids = itertools.count(max(highest + 1, POOL_TUNNEL_BASE))
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._refill()
+            self._wake.wait(self.refill_interval)
+            self._wake.clear()
+
+    def _refill(self):
+        with self._lock:
+            missing = {
+                country: target - len(self.warm[country]) - self.starting[country]
+                for country, target in self.targets.items()
+            }
+        for country, count in missing.items():
+            # Back off on countries whose tunnels keep failing
+            if time.monotonic() < self.failures.get(country, (0, 0))[1]:
+                continue
+            for _ in range(max(count, 0)):
+                config = self._pick_config(country)
+                if config is None:
+                    break
+                with self._lock:
+                    self.starting[country] += 1
+                    self.reserved.add((country, config))
+                try:
+                    self.executor.submit(self._start_tunnel, country, config)
+                except RuntimeError:
+                    return
+
+    def _pick_config(self, country):
+        """Pick a config of `country` not used by a running proxy, warm or starting tunnel."""
+        with self._lock:
+            busy = set(self.configs_in_use()) | self.reserved
+            busy |= {(t["country"], t["config"]) for warm in self.warm.values() for t in warm}
+        config = self.vpn_manager.pick_config(country, {c for busy_country, c in busy if busy_country == country})
+        taken = any(busy_country == country and self._same_config(c, config) for busy_country, c in busy)
+        return None if config is None or taken else config
+
+    def _start_tunnel(self, country, config):
+        tunnel_id = next(self._ids)
+        instance = self._instance(tunnel_id)
+        try:
+            success, result = instance.start_tunnel(country, config)
+        except Exception as e:
+            success, result = False, str(e)
+
+        with self._lock:
+            self.starting[country] -= 1
+            self.reserved.discard((country, config))
+            if success and not self._stopped.is_set():
+                self.warm[country].append(
+                    {
+                        "tunnel_id": tunnel_id,
+                        "country": country,
+                        "config": config,
+                        "tun_ip": result,
+                        "tun_interface": instance.tun_interface,
+                        "ready_since": time.time(),
+                    }
+                )
+                self.failures.pop(country, None)
+                return
+
+        instance.stop(result if success else None)
+        if not success:
+            count = self.failures.get(country, (0, 0))[0] + 1
+            self.failures[country] = (count, time.monotonic() + min(300, 5 * 2**count))
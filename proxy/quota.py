@@ -0,0 +1,135 @@
+import contextlib
+import threading
+
+from core.config import QUOTA_CHECK_INTERVAL
+from core.procfs import interface_stats
+from proxy.instance import ProxyInstance
+from vpn.shaping import traffic_rates
+
+COUNTERS = ("rx_bytes", "tx_bytes")
+
+
+def new_quota(interface, used_bytes=0):
+    """
+    Return the quota record of a freshly started proxy.
+
+    Consumption is counted from the current counters of its tun interface on, so
+    traffic a warm tunnel carried before it was claimed is not charged.
+    """
+    counters = interface_stats().get(interface, {})
+    return {"used_bytes": used_bytes, "throttled": False, **{key: counters.get(key, 0) for key in COUNTERS}}
+
+
+class QuotaMonitor:
+    """
+    Accounts the traffic of proxies that have a quota and enforces it.
+
+    Each round reads the counters of every tun interface from /proc/net/dev once
+    and adds their growth since the previous round to the 'used_bytes' of each
+    entry's 'quota' record, in one state transaction. Consumption therefore
+    survives API and proxy restarts; counters that went down belong to a new
+    interface and are counted from zero. A proxy at its quota is throttled to
+    QUOTA_THROTTLE_KBPS or stopped, following its 'quota_action'.
+    """
+
+    def __init__(self, service, interval=QUOTA_CHECK_INTERVAL):
+        self.service = service
+        self.state_manager = service.state_manager
+        self.interval = interval
+        # (port, start_time) of the proxies throttled by this process; a restarted
+        # proxy gets a new start time and a new tun interface to throttle
+        self._throttled = set()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start accounting in a background thread."""
+        self._thread = threading.Thread(target=self.run, name="quota-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop accounting after the current round."""
+        self._stopped.set()
+
+    def run(self):
+        """Run accounting rounds until stopped."""
+        while not self._stopped.is_set():
+            # A failing round must not end the accounting
+            try:
+                self.check_all()
+            except Exception as e:
+                print(f"QuotaMonitor: accounting round failed: {e}")
+            self._stopped.wait(self.interval)
+
+    def check_all(self):
+        """
+        Account the traffic of every proxy with a quota and enforce the quotas used up.
+
+        Returns:
+            dict: Port mapped to the action taken ("throttled" or "stopped") for
+            every proxy that went over its quota since the previous round.
+        """
+        if not any(_quota_bytes(info) for info in self.state_manager.get_state().values()):
+            return {}
+        stats = interface_stats()
+        over = {}
+        with self.state_manager.transaction() as state:
+            for port, info in state.items():
+                quota_bytes = _quota_bytes(info)
+                counters = stats.get(info.get("tun_interface"))
+                if not quota_bytes or counters is None:
+                    continue
+                quota = info.setdefault("quota", {"used_bytes": 0, "throttled": False})
+                for key in COUNTERS:
+                    previous = quota.get(key, 0)
+                    quota["used_bytes"] += counters[key] - previous if counters[key] >= previous else counters[key]
+                    quota[key] = counters[key]
+                if quota["used_bytes"] >= quota_bytes:
+                    if info["traffic"].get("quota_action", "throttle") == "throttle":
+                        quota["throttled"] = True
+                    over[int(port)] = dict(info)
+        actions = {port: self.enforce(port, info) for port, info in over.items()}
+        return {port: action for port, action in actions.items() if action}
+
+    def enforce(self, port, info):
+        """Throttle or stop a proxy that used up its quota; returns the action taken, if any."""
+        if info["traffic"].get("quota_action", "throttle") == "stop":
+            self.service.stop_proxy(port)
+            return "stopped"
+        key = (port, info.get("start_time"))
+        if key in self._throttled:
+            return None
+        instance = ProxyInstance(
+            port,
+            self.service.vpn_manager,
+            self.service.proxy_server,
+            tunnel_id=info.get("tunnel_id"),
+            traffic=info["traffic"],
+        )
+        shaped, _ = instance.shape(throttled=True)
+        if not shaped:
+            return None
+        self._throttled.add(key)
+        return "throttled"
+
+    def reset(self, port):
+        """
+        Start the quota of a proxy over and lift its throttling.
+
+        Returns:
+            bool: False if the port has no proxy with a quota.
+        """
+        info = self.state_manager.get(port)
+        if not _quota_bytes(info or {}):
+            return False
+        self.state_manager.update(port, quota=new_quota(info.get("tun_interface")))
+        if (info.get("quota") or {}).get("throttled"):
+            # Back to the proxy's own rate limits, if any
+            with contextlib.suppress(RuntimeError):
+                self.service.vpn_manager.shaper.apply(info.get("tun_interface"), *traffic_rates(info["traffic"]))
+        self._throttled = {key for key in self._throttled if key[0] != port}
+        return True
+
+
+def _quota_bytes(info):
+    return (info.get("traffic") or {}).get("quota_bytes")
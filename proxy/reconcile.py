@@ -0,0 +1,222 @@
+import contextlib
+import os
+import re
+import time
+from pathlib import Path
+
+from core.config import POOL_TUNNEL_BASE, TUN_READY_TIMEOUT
+from core.process import terminate
+from core.procfs import process_stats
+from proxy.live import OVPN_DEV, scan_processes
+
+# Processes younger than this may belong to a start that is not recorded yet
+START_GRACE = TUN_READY_TIMEOUT + 10
+# Tunnel ids of proxies are their ports; anything below belongs to the host (its own tun0)
+MIN_TUNNEL_ID = 1024
+
+TMP_FILE = re.compile(r"^(?:ovpn_(?:cfg_|auth_)?|3proxy_)(\d+)\.(?:pid|log|log\.\d+|ovpn|tmp|cfg|sock)$")
+
+
+class Reconciler:
+    """
+    Brings the state and the host back in line with each other.
+
+    One pass takes a snapshot of reality: a single /proc scan for openvpn and
+    3proxy processes, one interface dump and one rule/route dump. Each state entry
+    is then classified:
+
+    - healthy: OpenVPN runs and the tun interface holds the recorded IP; missing
+      routing or a dead per-port 3proxy is repaired.
+    - moved: OpenVPN reconnected with a new tun IP; state and routing are updated.
+    - stale: OpenVPN or its interface is gone; leftovers are stopped and the entry removed.
+
+    Processes, interfaces, routing tables, cgroups and /tmp files that no entry accounts for
+    are garbage-collected, as long as their tunnel id is a proxy port (MIN_TUNNEL_ID and
+    up): a VPN the host runs itself on tun0 is not ours to stop. Tunnel ids of the warm
+    pool and processes started within the last START_GRACE seconds are left alone, as
+    they may belong to a start in progress. Every kind of repair is applied in bulk.
+    """
+
+    def __init__(self, state_manager, vpn_manager, proxy_server):
+        self.state_manager = state_manager
+        self.vpn_manager = vpn_manager
+        self.proxy_server = proxy_server
+
+    def snapshot(self):
+        """Collect processes, interfaces and routing tables in one pass."""
+        processes = scan_processes()
+        pids = [pid for group in ("openvpn", "3proxy") for pids in processes[group].values() for pid in pids]
+        started = process_stats(pids + processes["3proxy_shared"])
+        return {
+            **processes,
+            "start_times": {pid: stats["start_time"] for pid, stats in started.items()},
+            "interfaces": self.vpn_manager.list_interfaces(),
+            "tables": self.vpn_manager.list_routing_tables(),
+            "cgroups": self.vpn_manager.cgroups.existing() if self.vpn_manager.cgroups is not None else {},
+        }
+
+    def plan(self, snapshot, state, busy_ports=()):
+        """
+        Diff the state against a snapshot.
+
+        Args:
+            snapshot (dict): The result of snapshot().
+            state (dict): The proxy state the snapshot is compared with.
+            busy_ports (iterable): Ports with a start in progress in this process.
+
+        Returns:
+            dict: What to keep, repair, update and remove.
+        """
+        now = time.time()
+        busy_ports = {int(p) for p in busy_ports}
+
+        def young(pids):
+            return any(now - snapshot["start_times"].get(pid, 0) < START_GRACE for pid in pids)
+
+        plan = {
+            "healthy": [],
+            "moved": {},
+            "stale": [],
+            "repair_routing": [],
+            "restart_3proxy": [],
+            "kill": [],
+            "delete_links": [],
+            "cleanup_tables": [],
+            "remove_cgroups": [],
+            "remove_files": [],
+        }
+        used_ids, used_ports = set(), set(busy_ports)
+        for port_str, info in state.items():
+            port = int(port_str)
+            tunnel_id = int(info.get("tunnel_id", port))
+            tun_interface = info.get("tun_interface") or f"tun{tunnel_id}"
+            pids = snapshot["openvpn"].get(tunnel_id, [])
+            tun_ip = snapshot["interfaces"].get(tun_interface)
+            if not pids or tun_ip is None:
+                if port not in busy_ports:
+                    plan["stale"].append(port)
+                    plan["kill"] += pids + snapshot["3proxy"].get(port, [])
+                    if tun_interface in snapshot["interfaces"]:
+                        plan["delete_links"].append(tun_interface)
+                    plan["cleanup_tables"].append(tunnel_id)
+                    if tunnel_id in snapshot["cgroups"]:
+                        plan["remove_cgroups"].append(tunnel_id)
+                continue
+
+            used_ids.add(tunnel_id)
+            used_ports.add(port)
+            proxy_pids = snapshot["3proxy"].get(port, [])
+            if tun_ip != info.get("tun_ip"):
+                # OpenVPN reconnected with another address: move routing and listener over
+                plan["moved"][port] = tun_ip
+                plan["cleanup_tables"].append(tunnel_id)
+                plan["repair_routing"].append((tunnel_id, tun_ip, tun_interface))
+                plan["kill"] += proxy_pids
+                continue
+            plan["healthy"].append(port)
+            table = snapshot["tables"].get(tunnel_id, {})
+            if tun_ip not in table.get("sources", []) or not table.get("routes"):
+                plan["repair_routing"].append((tunnel_id, tun_ip, tun_interface))
+            if (self.proxy_server.mode == "per-port" and not proxy_pids) or (
+                self.proxy_server.mode == "shared" and not snapshot["3proxy_shared"]
+            ):
+                plan["restart_3proxy"].append((port, tun_ip))
+
+        # Leave tunnels and listeners of starts in progress alone
+        for tunnel_id, pids in snapshot["openvpn"].items():
+            if young(pids):
+                used_ids.add(tunnel_id)
+        for port, pids in snapshot["3proxy"].items():
+            if young(pids):
+                used_ports.add(port)
+
+        # Processes, interfaces, tables and files nobody accounts for
+        def orphan(tunnel_id):
+            return (
+                MIN_TUNNEL_ID <= tunnel_id < POOL_TUNNEL_BASE
+                and tunnel_id not in used_ids
+                and tunnel_id not in used_ports
+            )
+
+        for tunnel_id, pids in snapshot["openvpn"].items():
+            if orphan(tunnel_id):
+                plan["kill"] += pids
+        for port, pids in snapshot["3proxy"].items():
+            if port not in used_ports:
+                plan["kill"] += pids
+        if self.proxy_server.mode != "shared":
+            plan["kill"] += [pid for pid in snapshot["3proxy_shared"] if not young([pid])]
+        for name in snapshot["interfaces"]:
+            match = OVPN_DEV.match(name)
+            if match and orphan(int(match.group(1))) and name not in plan["delete_links"]:
+                plan["delete_links"].append(name)
+        for table, entry in snapshot["tables"].items():
+            # Only tables with a single-address source rule, the way proxies are routed
+            if entry["sources"] and orphan(table) and table not in plan["cleanup_tables"]:
+                plan["cleanup_tables"].append(table)
+        for tunnel_id, modified in snapshot["cgroups"].items():
+            # Created just before OpenVPN is launched, so they are given the same grace
+            if orphan(tunnel_id) and now - modified >= START_GRACE and tunnel_id not in plan["remove_cgroups"]:
+                plan["remove_cgroups"].append(tunnel_id)
+        with contextlib.suppress(OSError), os.scandir("/tmp") as entries:
+            for entry in entries:
+                match = TMP_FILE.match(entry.name)
+                if match and orphan(int(match.group(1))):
+                    with contextlib.suppress(OSError):
+                        if now - entry.stat().st_mtime >= START_GRACE:
+                            plan["remove_files"].append(entry.path)
+
+        plan["kill"] = sorted(set(plan["kill"]))
+        return plan
+
+    def apply(self, plan, state):
+        """Carry out a plan: stop, delete and clean up in bulk, then update the state once."""
+        terminate(plan["kill"])
+        if plan["delete_links"]:
+            # Most tun devices vanish with their OpenVPN process
+            remaining = self.vpn_manager.list_interfaces()
+            self.vpn_manager.delete_interfaces([name for name in plan["delete_links"] if name in remaining])
+        if plan["cleanup_tables"]:
+            self.vpn_manager.cleanup_routing_many(plan["cleanup_tables"])
+        if plan["repair_routing"]:
+            self.vpn_manager.setup_routing_many(plan["repair_routing"])
+        if plan["remove_cgroups"]:
+            self.vpn_manager.cgroups.remove_many(plan["remove_cgroups"])
+        for path in plan["remove_files"]:
+            with contextlib.suppress(OSError):
+                Path(path).unlink()
+
+        # Entries changed by someone else since the snapshot are left alone
+        with self.state_manager.transaction() as current:
+            for port in plan["stale"]:
+                if current.get(str(port)) == state[str(port)]:
+                    current.pop(str(port))
+            for port, tun_ip in plan["moved"].items():
+                if current.get(str(port)) == state[str(port)]:
+                    current[str(port)]["tun_ip"] = tun_ip
+
+        for port in plan["stale"]:
+            self.proxy_server.stop_3proxy(port)
+        for port, tun_ip in [*plan["restart_3proxy"], *plan["moved"].items()]:
+            tunnel_id = int(state[str(port)].get("tunnel_id", port))
+            self.proxy_server.start_3proxy(port, tun_ip, cgroup=self.vpn_manager.cgroup_path(tunnel_id))
+
+    def run(self, dry_run=False, busy_ports=()):
+        """
+        Reconcile once.
+
+        Returns:
+            dict: The plan that was (or, with dry_run, would be) applied, plus its duration in ms.
+        """
+        started = time.perf_counter()
+        snapshot = self.snapshot()
+        state = self.state_manager.get_state()
+        plan = self.plan(snapshot, state, busy_ports)
+        if not dry_run:
+            self.apply(plan, state)
+        plan["moved"] = {str(port): tun_ip for port, tun_ip in plan["moved"].items()}
+        plan["repair_routing"] = [tunnel_id for tunnel_id, _, _ in plan["repair_routing"]]
+        plan["restart_3proxy"] = [port for port, _ in plan["restart_3proxy"]]
+        plan["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        plan["dry_run"] = dry_run
+        return plan
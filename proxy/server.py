@@ -1,38 +1,318 @@
+import contextlib
+import hmac
+import os
+import signal
 import subprocess
+import threading
 from pathlib import Path
 
-from core.config import PROXY_PASS, PROXY_USER
+from core.cgroup import enter_command
+from core.config import PROXY_MODE, PROXY_PASS, PROXY_USER
+from core.users import UserStore, permits
+
+SHARED_CFG_FILE = "/tmp/3proxy_shared.cfg"
+SHARED_PID_FILE = "/tmp/3proxy_shared.pid"
+# Stored users as "name:CR:hash" lines, included by every 3proxy config
+USERS_INCLUDE_FILE = "/tmp/3proxy_users"
+# Users per 3proxy deny line
+ACL_CHUNK = 100
+# Name of the shared daemon in the Supervisor
+SHARED_NAME = ("3proxy", "shared")
+
+
+def _started(info):
+    """Tell state entries of the same port apart: a restart has a new start time or tun IP."""
+    return (info.get("start_time"), info.get("tun_ip")) if info else None
 
 
 class ProxyServer:
     """
     Manages the 3proxy server configuration and process.
+
+    In "per-port" mode every proxy gets its own 3proxy daemon. In "shared" mode a
+    single daemon listens on all ports; its config is regenerated from the state
+    whenever a proxy is added or removed and the daemon is told to reload it.
+    In "builtin" mode no 3proxy runs at all: the asyncio ForwardingEngine follows
+    current_listeners() instead (see proxy/forwarder.py).
+
+    Clients authenticate as PROXY_USER, allowed on every port, or as one of the
+    `users`, each allowed on the ports and countries its record lists. 3proxy reads
+    the stored users from USERS_INCLUDE_FILE and gets a deny list per port;
+    reload_users() brings running daemons up to date with a config reload, which
+    leaves tunnels and open connections alone.
     """
 
-    def __init__(self, user=PROXY_USER, password=PROXY_PASS):
+    def __init__(self, user=PROXY_USER, password=PROXY_PASS, mode=PROXY_MODE, state_manager=None, users=None):
         self.user = user
         self.password = password
+        self.mode = mode
+        self.state_manager = state_manager
+        self.users = users if users is not None else UserStore()
+        # Listeners started (port -> tun_ip) or stopped (port -> (start_time, tun_ip) of
+        # the entry stopped) by this process that the state does not reflect yet
+        self._added = {}
+        self._removed = {}
+        # Country of the listeners started by this process, for the users' country restrictions
+        self._countries = {}
+        # User table last written to USERS_INCLUDE_FILE and last pushed to the daemons
+        self._users_written = None
+        self._users_applied = None
+        self._lock = threading.RLock()
+        # In-process ForwardingEngine to notify in builtin mode, if any
+        self.engine = None
+        # Optional Supervisor running 3proxy in the foreground (set up by the API)
+        self.supervisor = None
+
+    def build_config(self, listeners, pid_file):
+        """
+        Render a 3proxy config serving `listeners`, writing the users file it includes.
+
+        Every port is preceded by the users not allowed on it; consecutive ports
+        with the same list share one ACL.
+
+        Args:
+            listeners (dict): Port mapped to the external IP used for outgoing connections.
+            pid_file (str): Where the daemon writes its PID.
+
+        Returns:
+            str: The config file content.
+        """
+        users = self.users.load()
+        self._write_users(users)
+        lines = [f"pidfile {pid_file}", "nserver 8.8.8.8", "nserver 8.8.4.4"]
+        if self.supervisor is None:
+            lines.insert(0, "daemon")
+        if self.user:
+            lines.append(f"users {self.user}:CL:{self.password}")
+        if users:
+            lines.append(f"users ${USERS_INCLUDE_FILE}")
+        lines.append("auth strong")
+
+        restricted = [
+            (name, user)
+            for name, user in sorted(users.items())
+            if user.get("ports") is not None or user.get("countries") is not None
+        ]
+        countries = self._countries_of(listeners) if restricted else {}
+        acl = None
+        for port, tun_ip in sorted(listeners.items()):
+            denied = [name for name, user in restricted if not permits(user, port, countries.get(port))]
+            if denied != acl:
+                lines.append("flush")
+                lines += [f"deny {','.join(denied[i : i + ACL_CHUNK])}" for i in range(0, len(denied), ACL_CHUNK)]
+                lines.append("allow *")
+                acl = denied
+            lines.append(f"proxy -p{port} -e{tun_ip}")
+        return "\n".join(lines) + "\n"
+
+    def _write_users(self, users):
+        """Write the stored users to USERS_INCLUDE_FILE unless it already holds them."""
+        with self._lock:
+            if users is self._users_written:
+                return
+            include = Path(USERS_INCLUDE_FILE)
+            tmp_include = include.with_name(include.name + ".tmp")
+            tmp_include.touch(mode=0o600)
+            tmp_include.write_text("".join(f"{name}:CR:{user['password_hash']}\n" for name, user in users.items()))
+            tmp_include.replace(include)
+            self._users_written = users
+
+    def _countries_of(self, ports):
+        """Return the country of each of `ports`, from this process's listeners and the state."""
+        state = self.state_manager.get_state() if self.state_manager is not None else {}
+        with self._lock:
+            return {
+                int(port): self._countries.get(int(port)) or (state.get(str(port)) or {}).get("country")
+                for port in ports
+            }
+
+    def authenticate(self, username, password, port=None):
+        """
+        Check proxy credentials as the builtin engine and the gateway do.
+
+        Args:
+            username (str): PROXY_USER or a stored user.
+            password (str): The cleartext password.
+            port (int): The proxy port the client connected to; None only checks the credentials.
+        """
+        # compare_digest only takes ASCII str, clients may send anything
+        if self.user and hmac.compare_digest(username.encode(), self.user.encode()):
+            return hmac.compare_digest(password.encode(), (self.password or "").encode())
+        if not self.users.verify(username, password):
+            return False
+        return port is None or self.permits(username, port)
+
+    def permits(self, username, port, country=None):
+        """Return whether a user may use the proxy on `port` (of `country`, looked up when omitted)."""
+        if self.user and username == self.user:
+            return True
+        if country is None:
+            country = self._countries_of([port])[int(port)]
+        return self.users.permits(username, port, country)
+
+    def reload_users(self):
+        """
+        Make the running 3proxy daemons use the current users, if they changed.
+
+        The users file and the configs are rewritten and every daemon reloads them
+        on SIGUSR1; tunnels and established connections are not touched. The builtin
+        engine checks the store on every connection and needs nothing.
+
+        Returns:
+            bool: Whether the users changed since the last call.
+        """
+        users = self.users.load()
+        with self._lock:
+            if users is self._users_applied:
+                return False
+            self._users_applied = users
+            if self.mode == "builtin":
+                return True
+            self._write_users(users)
+            if self.mode == "shared":
+                if self._shared_pid():
+                    self._reload_shared()
+                return True
+        state = self.state_manager.get_state() if self.state_manager is not None else {}
+        for port, info in state.items():
+            pid = self._daemon_pid(("3proxy", int(port)), f"/tmp/3proxy_{port}.pid")
+            if not pid or not info.get("tun_ip"):
+                continue
+            cfg = Path(f"/tmp/3proxy_{port}.cfg")
+            tmp_cfg = cfg.with_name(cfg.name + ".tmp")
+            tmp_cfg.write_text(self.build_config({int(port): info["tun_ip"]}, f"/tmp/3proxy_{port}.pid"))
+            tmp_cfg.replace(cfg)
+            with contextlib.suppress(OSError):
+                os.kill(pid, signal.SIGUSR1)
+        return True
 
-    def start_3proxy(self, port, tun_ip):
+    def start_3proxy(self, port, tun_ip, cgroup=None, country=None):
         """
         Generate configuration and start the 3proxy server.
 
         Args:
             port (int): The port to listen on.
             tun_ip (str): The external IP address to use for outgoing connections.
+            cgroup (Path): Optional cgroup to run a per-port daemon in; the shared
+                daemon serves every proxy and is never placed in one.
+            country (str): Country of the proxy, for users limited to some countries;
+                taken from the state when omitted.
         """
+        if country is not None:
+            with self._lock:
+                self._countries[int(port)] = country
+        if self.mode in ("shared", "builtin"):
+            with self._lock:
+                self._added[int(port)] = tun_ip
+                self._removed.pop(int(port), None)
+                self._apply_listeners()
+            return
+
         proxy_cfg_file = f"/tmp/3proxy_{port}.cfg"
         proxy_pid_file = f"/tmp/3proxy_{port}.pid"
 
-        proxy_cfg = Path(proxy_cfg_file)
-        with proxy_cfg.open("w") as f:
-            f.write("daemon\n")
-            f.write(f"pidfile {proxy_pid_file}\n")
-            f.write("nserver 8.8.8.8\n")
-            f.write("nserver 8.8.4.4\n")
-            f.write(f"users {self.user}:CL:{self.password}\n")
-            f.write("auth strong\n")
-            f.write(f"allow {self.user}\n")
-            f.write(f"proxy -p{port} -e{tun_ip}\n")
-
-        subprocess.run(["3proxy", proxy_cfg_file])
+        Path(proxy_cfg_file).write_text(self.build_config({port: tun_ip}, proxy_pid_file))
+        self._run_3proxy(("3proxy", int(port)), proxy_cfg_file, cgroup)
+
+    def _run_3proxy(self, name, cfg_file, cgroup=None):
+        """Start 3proxy as a supervised child, or as a daemon without a supervisor."""
+        command = enter_command(cgroup, ["3proxy", cfg_file])
+        if self.supervisor is not None:
+            self.supervisor.spawn(name, command)
+        else:
+            subprocess.run(command)
+
+    def stop_3proxy(self, port):
+        """
+        Stop serving `port`.
+
+        Per-port daemons are terminated through their PID file by VPNManager, so
+        this only has work to do in shared and builtin mode.
+        """
+        self.stop_3proxy_many([port])
+
+    def stop_3proxy_many(self, ports):
+        """Stop serving several ports with a single config reload."""
+        if self.mode not in ("shared", "builtin"):
+            return
+        state = self.state_manager.get_state() if self.state_manager is not None else {}
+        with self._lock:
+            for port in ports:
+                self._added.pop(int(port), None)
+                self._countries.pop(int(port), None)
+                self._removed[int(port)] = _started(state.get(str(port)))
+            self._apply_listeners()
+
+    def current_listeners(self):
+        """
+        Return the ports to serve (port -> tun_ip) in shared and builtin mode.
+
+        Built from the state, plus listeners this process started or stopped that
+        are not recorded there yet. Those are forgotten as soon as the state catches
+        up, so a port stopped here and started again by another process is served.
+        """
+        state = self.state_manager.get_state() if self.state_manager is not None else {}
+        with self._lock:
+            for port, tun_ip in list(self._added.items()):
+                if (state.get(str(port)) or {}).get("tun_ip") == tun_ip:
+                    del self._added[port]
+            for port, started in list(self._removed.items()):
+                info = state.get(str(port))
+                if info is None or _started(info) != started:
+                    del self._removed[port]
+            listeners = {
+                int(port): info["tun_ip"]
+                for port, info in state.items()
+                if info.get("tun_ip") and int(port) not in self._removed
+            }
+            listeners.update(self._added)
+        return listeners
+
+    def _shared_pid(self):
+        return self._daemon_pid(SHARED_NAME, SHARED_PID_FILE)
+
+    def _daemon_pid(self, name, pid_file):
+        """Return the PID of a running 3proxy daemon, from the supervisor or its pid file."""
+        if self.supervisor is not None and self.supervisor.knows(name):
+            return self.supervisor.pid(name)
+        try:
+            pid = int(Path(pid_file).read_text().strip())
+            os.kill(pid, 0)
+            return pid
+        except (OSError, ValueError):
+            return None
+
+    def _apply_listeners(self):
+        if self.mode == "builtin":
+            if self.engine is not None:
+                self.engine.request_sync()
+            return
+        self._reload_shared()
+
+    def _reload_shared(self):
+        """Rewrite the shared config and reload, start or stop the shared daemon."""
+        listeners = self.current_listeners()
+        pid = self._shared_pid()
+
+        if not listeners:
+            if self.supervisor is not None:
+                # Released first so the supervisor does not restart it
+                self.supervisor.release([SHARED_NAME])
+            if pid:
+                with contextlib.suppress(OSError):
+                    os.kill(pid, signal.SIGTERM)
+            for f_path in [SHARED_CFG_FILE, SHARED_PID_FILE]:
+                with contextlib.suppress(OSError):
+                    Path(f_path).unlink()
+            return
+
+        cfg = Path(SHARED_CFG_FILE)
+        tmp_cfg = cfg.with_name(cfg.name + ".tmp")
+        tmp_cfg.write_text(self.build_config(listeners, SHARED_PID_FILE))
+        tmp_cfg.replace(cfg)
+
+        if pid:
+            # 3proxy re-reads its config on SIGUSR1; existing connections are kept
+            os.kill(pid, signal.SIGUSR1)
+        else:
+            self._run_3proxy(SHARED_NAME, SHARED_CFG_FILE)
@@ -1,23 +1,37 @@
 #!/usr/bin/env python3
 import argparse
+import getpass
 import subprocess
 import sys
+from pathlib import Path
 
 from cli.commands import (
+    cmd_apply,
+    cmd_forwarder,
+    cmd_gateway,
     cmd_list_configs,
     cmd_list_countries,
     cmd_logs,
+    cmd_monitor,
+    cmd_reconcile,
+    cmd_reset_quota,
     cmd_start,
+    cmd_start_batch,
     cmd_status,
     cmd_stop,
     cmd_stop_all,
+    cmd_users_add,
+    cmd_users_list,
+    cmd_users_remove,
+    cmd_users_set,
 )
-from core.config import OPENVPN_PASS, OPENVPN_USER
+from core.config import OPENVPN_PASS, OPENVPN_USER, PROXY_MODE
 
 
 def check_dependencies():
     """Verify that required system tools are installed."""
-    for cmd in ["openvpn", "3proxy", "ip"]:
+    required = ["openvpn", "ip"] if PROXY_MODE == "builtin" else ["openvpn", "3proxy", "ip"]
+    for cmd in required:
         if subprocess.run(["which", cmd], stdout=subprocess.DEVNULL).returncode != 0:
             print(f"Error: {cmd} is not installed.")
             sys.exit(1)
@@ -31,6 +45,114 @@ def check_auth():
         sys.exit(1)
 
 
+def parse_batch_specs(specs, spec_file=None):
+    """
+    Build start specs from 'country:config:port[:label]' strings and an optional file.
+
+    The file holds one proxy per line as 'country config port [label]'; blank lines
+    and lines starting with '#' are ignored.
+    """
+    entries = [spec.split(":", 3) for spec in specs]
+    if spec_file:
+        with Path(spec_file).open() as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    entries.append(line.split(maxsplit=3))
+
+    result = []
+    for entry in entries:
+        if len(entry) < 3 or not entry[2].isdigit():
+            print(f"Error: invalid batch spec {' '.join(entry)!r}, expected country, config and port.")
+            sys.exit(1)
+        result.append(
+            {
+                "country": entry[0],
+                "config": entry[1],
+                "port": int(entry[2]),
+                "label": entry[3] if len(entry) > 3 else None,
+            }
+        )
+    return result
+
+
+def parse_size(value):
+    """Parse a byte count with an optional K, M, G or T suffix (powers of 1024)."""
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    value = value.strip().upper()
+    try:
+        if value[-1:] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size {value!r}, expected e.g. 500M or 10G") from None
+
+
+def add_limit_arguments(parser):
+    """Add the cgroup resource limit and traffic options of start commands."""
+    parser.add_argument("--cpu-weight", type=int, help="Relative CPU share of the proxy (1-10000, default 100)")
+    parser.add_argument("--memory-max", help="Memory limit of the proxy, e.g. 256M")
+    parser.add_argument("--pids-max", type=int, help="Maximum number of processes and threads of the proxy")
+    parser.add_argument("--download-kbps", type=int, help="Download rate limit in kbit/s")
+    parser.add_argument("--upload-kbps", type=int, help="Upload rate limit in kbit/s")
+    parser.add_argument("--quota", type=parse_size, help="Traffic quota in both directions, e.g. 10G")
+    parser.add_argument(
+        "--quota-action", choices=["throttle", "stop"], default="throttle", help="What to do once the quota is used up"
+    )
+
+
+def limits_from(args):
+    """Return the resource limits given on the command line, or None."""
+    limits = {"cpu_weight": args.cpu_weight, "memory_max": args.memory_max, "pids_max": args.pids_max}
+    return {name: value for name, value in limits.items() if value is not None} or None
+
+
+def traffic_from(args):
+    """Return the rate limits and quota given on the command line, or None."""
+    traffic = {"download_kbps": args.download_kbps, "upload_kbps": args.upload_kbps, "quota_bytes": args.quota}
+    traffic = {name: value for name, value in traffic.items() if value is not None}
+    if args.quota:
+        traffic["quota_action"] = args.quota_action
+    return traffic or None
+
+
+def parse_list(value):
+    """Parse a comma-separated list, e.g. of countries."""
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
+def parse_ports(value):
+    """Parse a comma-separated list of ports."""
+    try:
+        return [int(part) for part in parse_list(value)]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid port list {value!r}, expected e.g. 8011,8012") from None
+
+
+def add_user_arguments(parser, changing=False):
+    """Add the password, port and country options of the user commands."""
+    parser.add_argument("username", help="Name of the proxy user")
+    parser.add_argument("--password", "-p", help="Password (prompted for when omitted)")
+    parser.add_argument("--ports", type=parse_ports, help="Allowed proxy ports, e.g. 8011,8012")
+    parser.add_argument("--countries", type=parse_list, help="Allowed countries, e.g. usa,japan")
+    if changing:
+        parser.add_argument("--new-password", action="store_true", help="Prompt for a new password")
+        parser.add_argument("--all-ports", action="store_true", help="Allow every proxy port again")
+        parser.add_argument("--all-countries", action="store_true", help="Allow every country again")
+
+
+def user_changes_from(args):
+    """Return the fields changed by 'users set'."""
+    changes = {}
+    if args.password or args.new_password:
+        changes["password"] = args.password or getpass.getpass(f"New password for {args.username}: ")
+    if args.ports is not None or args.all_ports:
+        changes["ports"] = None if args.all_ports else args.ports
+    if args.countries is not None or args.all_countries:
+        changes["countries"] = None if args.all_countries else args.countries
+    return changes
+
+
 def main():
     """Main entry point for the Proxy Manager CLI."""
     check_dependencies()
@@ -42,9 +164,24 @@ def main():
     # Start command
     start_parser = subparsers.add_parser("start", help="Start a new proxy")
     start_parser.add_argument("country", help="Country folder name")
-    start_parser.add_argument("config", help="Config file name (with or without .ovpn)")
+    start_parser.add_argument("config", help="Config file name (with or without .ovpn), or 'auto'")
     start_parser.add_argument("port", type=int, help="Port for the proxy")
     start_parser.add_argument("--label", "-l", help="Optional label for this proxy instance")
+    add_limit_arguments(start_parser)
+
+    # Start-batch command
+    batch_parser = subparsers.add_parser("start-batch", help="Start several proxies concurrently")
+    batch_parser.add_argument("specs", nargs="*", help="Proxy specs as country:config:port[:label]")
+    batch_parser.add_argument("--file", "-f", help="File with one 'country config port [label]' per line")
+    batch_parser.add_argument("--parallel", "-j", type=int, help="Maximum number of proxies started at once")
+    add_limit_arguments(batch_parser)
+
+    # Apply command
+    apply_parser = subparsers.add_parser("apply", help="Converge the running proxies on a fleet spec")
+    apply_parser.add_argument("file", help="YAML or JSON file listing every proxy that should run")
+    apply_parser.add_argument("--dry-run", action="store_true", help="Only show what would be changed")
+    apply_parser.add_argument("--keep-unlisted", action="store_true", help="Do not stop proxies missing from the file")
+    apply_parser.add_argument("--parallel", "-j", type=int, help="Maximum number of proxies started at once")
 
     # Stop command
     stop_parser = subparsers.add_parser("stop", help="Stop a proxy")
@@ -53,6 +190,10 @@ def main():
     # Stop-all command
     subparsers.add_parser("stop-all", help="Stop all proxies and cleanup")
 
+    # Reconcile command
+    reconcile_parser = subparsers.add_parser("reconcile", help="Fix drift between state and running processes")
+    reconcile_parser.add_argument("--dry-run", action="store_true", help="Only show what would be changed")
+
     # List configs command
     list_cfg_parser = subparsers.add_parser("list-configs", help="List available VPN configurations")
     list_cfg_parser.add_argument("country", nargs="?", help="Country to list configs for")
@@ -61,28 +202,91 @@ def main():
     subparsers.add_parser("list-countries", help="List available countries")
 
     # Status command
-    subparsers.add_parser("status", help="Show running proxies")
+    status_parser = subparsers.add_parser("status", help="Show running proxies")
+    status_parser.add_argument(
+        "--live", action="store_true", help="Check processes and tun interfaces instead of trusting the state"
+    )
+
+    # Forwarder command
+    subparsers.add_parser("forwarder", help="Run the builtin HTTP/SOCKS5 forwarding engine (PROXY_MODE=builtin)")
+
+    # Gateway command
+    gateway_parser = subparsers.add_parser("gateway", help="Serve one port balancing over all running proxies")
+    gateway_parser.add_argument("--port", type=int, help="Gateway port (default: GATEWAY_PORT)")
+    gateway_parser.add_argument(
+        "--policy", choices=["round-robin", "least-connections", "random", "sticky"], help="Balancing policy"
+    )
+
+    # Monitor command
+    monitor_parser = subparsers.add_parser("monitor", help="Health-check proxies and restart broken ones")
+    monitor_parser.add_argument("--interval", type=float, help="Seconds between checks")
+    monitor_parser.add_argument("--url", help="URL to fetch through every proxy (default: HEALTH_CHECK_URL)")
+
+    # Reset-quota command
+    quota_parser = subparsers.add_parser("reset-quota", help="Start the traffic quota of a proxy over")
+    quota_parser.add_argument("port", type=int, help="Port of the proxy")
+
+    # Users command
+    users_parser = subparsers.add_parser("users", help="Manage proxy users without restarting proxies")
+    users_commands = users_parser.add_subparsers(dest="users_command")
+    users_commands.add_parser("list", help="List proxy users")
+    add_user_arguments(users_commands.add_parser("add", help="Create a proxy user"))
+    add_user_arguments(users_commands.add_parser("set", help="Change a proxy user"), changing=True)
+    users_commands.add_parser("remove", help="Delete a proxy user").add_argument("username", help="Name of the user")
 
     # Logs command
     log_parser = subparsers.add_parser("logs", help="Show OpenVPN logs for a port")
     log_parser.add_argument("port", type=int, help="Port of the proxy")
+    log_parser.add_argument("-n", "--lines", type=int, help="Number of last lines to show (default: the whole log)")
+    log_parser.add_argument("-f", "--follow", action="store_true", help="Keep printing new lines")
 
     args = parser.parse_args()
 
     if args.command == "start":
-        cmd_start(args.country, args.config, args.port, args.label)
+        config = None if args.config == "auto" else args.config
+        cmd_start(args.country, config, args.port, args.label, limits_from(args), traffic_from(args))
+    elif args.command == "start-batch":
+        specs = [
+            {**spec, "limits": limits_from(args), "traffic": traffic_from(args)}
+            for spec in parse_batch_specs(args.specs, args.file)
+        ]
+        cmd_start_batch(specs, args.parallel)
+    elif args.command == "apply":
+        cmd_apply(args.file, args.dry_run, not args.keep_unlisted, args.parallel)
     elif args.command == "stop":
         cmd_stop(args.port)
     elif args.command == "stop-all":
         cmd_stop_all()
+    elif args.command == "reconcile":
+        cmd_reconcile(args.dry_run)
+    elif args.command == "reset-quota":
+        cmd_reset_quota(args.port)
+    elif args.command == "users":
+        if args.users_command == "list":
+            cmd_users_list()
+        elif args.users_command == "add":
+            password = args.password or getpass.getpass(f"Password for {args.username}: ")
+            cmd_users_add(args.username, password, args.ports, args.countries)
+        elif args.users_command == "set":
+            cmd_users_set(args.username, **user_changes_from(args))
+        elif args.users_command == "remove":
+            cmd_users_remove(args.username)
+        else:
+            users_parser.print_help()
     elif args.command == "list-configs":
         cmd_list_configs(args.country)
     elif args.command == "list-countries":
         cmd_list_countries()
     elif args.command == "status":
-        cmd_status()
+        cmd_status(args.live)
+    elif args.command == "forwarder":
+        cmd_forwarder()
+    elif args.command == "gateway":
+        cmd_gateway(args.port, args.policy)
+    elif args.command == "monitor":
+        cmd_monitor(args.interval, args.url)
     elif args.command == "logs":
-        cmd_logs(args.port)
+        cmd_logs(args.port, args.lines, args.follow)
     else:
         parser.print_help()
 
@@ -92,6 +296,11 @@ def main_start():
     main()
 
 
+def main_start_batch():
+    sys.argv.insert(1, "start-batch")
+    main()
+
+
 def main_stop():
     sys.argv.insert(1, "stop")
     main()
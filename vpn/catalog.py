@@ -0,0 +1,152 @@
+import hashlib
+import re
+import threading
+import time
+from pathlib import Path
+
+from core.config import CATALOG_CHECK_INTERVAL, CONFIG_DIR
+
+# Directives that would make OpenVPN run scripts on the host
+UNSAFE_DIRECTIVE = re.compile(r"^\s*(up|down|script-security)\s+")
+
+
+def parse_ovpn(text):
+    """
+    Extract connection metadata from the content of an .ovpn file.
+
+    Returns:
+        dict: 'remotes' as a list of {'host', 'port', 'proto'} dicts plus the default
+        'proto' and 'cipher' (None when not set).
+    """
+    proto = None
+    cipher = None
+    remotes = []
+    for line in text.splitlines():
+        parts = line.split()
+        if not parts or parts[0].startswith(("#", ";", "<")):
+            continue
+        if parts[0] == "proto" and len(parts) > 1:
+            proto = parts[1]
+        elif parts[0] in ("cipher", "data-ciphers") and len(parts) > 1 and cipher is None:
+            cipher = parts[1].split(":")[0]
+        elif parts[0] == "remote" and len(parts) > 1:
+            remotes.append(
+                {
+                    "host": parts[1],
+                    "port": int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 1194,
+                    "proto": parts[3] if len(parts) > 3 else None,
+                }
+            )
+    for remote in remotes:
+        remote["proto"] = remote["proto"] or proto or "udp"
+    return {"remotes": remotes, "proto": proto or "udp", "cipher": cipher}
+
+
+def sanitize_ovpn(text):
+    """Comment out directives that run host scripts (up/down/script-security)."""
+    return "".join(f"# {line}" if UNSAFE_DIRECTIVE.match(line) else line for line in text.splitlines(keepends=True))
+
+
+class ConfigCatalog:
+    """
+    In-memory index of the VPN configs under `config_dir`.
+
+    The tree is scanned once and rescanned only when the modification time of a
+    country directory or config file changes. Those mtimes are checked at most
+    every `check_interval` seconds, so frequent listing requests cost nothing.
+    """
+
+    def __init__(self, config_dir=CONFIG_DIR, check_interval=CATALOG_CHECK_INTERVAL):
+        self.config_dir = Path(config_dir)
+        self.check_interval = check_interval
+        self.entries = {}
+        self.version = ""
+        self._mtimes = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _snapshot(self):
+        """Return the mtimes of the config tree, keyed by path."""
+        mtimes = {}
+        if not self.config_dir.is_dir():
+            return mtimes
+        mtimes[str(self.config_dir)] = self.config_dir.stat().st_mtime_ns
+        for country_dir in self.config_dir.iterdir():
+            if not country_dir.is_dir():
+                continue
+            mtimes[str(country_dir)] = country_dir.stat().st_mtime_ns
+            for config in country_dir.iterdir():
+                if config.name.endswith(".ovpn"):
+                    mtimes[str(config)] = config.stat().st_mtime_ns
+        return mtimes
+
+    def refresh(self, force=False):
+        """Rescan the config tree if it changed since the last scan."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._mtimes is not None and now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            mtimes = self._snapshot()
+            if force or mtimes != self._mtimes:
+                self._scan()
+                self._mtimes = mtimes
+
+    def _scan(self):
+        entries = {}
+        if self.config_dir.is_dir():
+            for country_dir in sorted(d for d in self.config_dir.iterdir() if d.is_dir()):
+                configs = {}
+                for path in sorted(country_dir.iterdir()):
+                    if not path.name.endswith(".ovpn"):
+                        continue
+                    text = path.read_text(errors="replace")
+                    configs[path.name] = {
+                        "name": path.name,
+                        "country": country_dir.name,
+                        "path": str(path),
+                        "sha256": hashlib.sha256(text.encode()).hexdigest(),
+                        "sanitized": sanitize_ovpn(text),
+                        **parse_ovpn(text),
+                    }
+                entries[country_dir.name] = configs
+
+        digest = hashlib.sha256()
+        for country, configs in entries.items():
+            for name, info in configs.items():
+                digest.update(f"{country}/{name}:{info['sha256']}\n".encode())
+        self.entries = entries
+        self.version = digest.hexdigest()[:16]
+
+    def countries(self):
+        """Return the sorted list of countries."""
+        self.refresh()
+        return list(self.entries)
+
+    def configs(self, country=None):
+        """Return config file names per country, optionally for a single country."""
+        self.refresh()
+        if country:
+            return {country: list(self.entries[country])} if country in self.entries else {}
+        return {c: list(configs) for c, configs in self.entries.items()}
+
+    def metadata(self, country=None):
+        """Return the parsed metadata of every config, optionally for a single country."""
+        self.refresh()
+        countries = [country] if country else list(self.entries)
+        return [
+            {key: value for key, value in info.items() if key != "sanitized"}
+            for c in countries
+            for info in self.entries.get(c, {}).values()
+        ]
+
+    def get(self, country, config_name):
+        """
+        Look up a config by country and file name, with or without the .ovpn suffix.
+
+        Returns:
+            dict or None: The catalog entry, including the sanitized config text.
+        """
+        self.refresh()
+        configs = self.entries.get(country, {})
+        return configs.get(config_name) or configs.get(f"{config_name}.ovpn")
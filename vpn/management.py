@@ -0,0 +1,191 @@
+import asyncio
+import re
+import threading
+import time
+
+from core.config import MANAGEMENT_BYTECOUNT_INTERVAL
+
+# First and longest delay between attempts to reach a management socket
+RECONNECT_DELAY = 0.1
+MAX_RECONNECT_DELAY = 5
+
+# "<time>,<state>,<description>,<local ip>,<remote ip>,<remote port>,...", from the
+# state history ("state on all") or pushed as ">STATE:..."
+STATE_LINE = re.compile(r"^(?:>STATE:)?(\d+),([A-Z_]+),([^,]*),([^,]*),([^,]*),?([^,]*)")
+BYTECOUNT_LINE = re.compile(r"^>BYTECOUNT:(\d+),(\d+)")
+
+
+def socket_path(tunnel_id):
+    """Return the management socket path OpenVPN is started with for `tunnel_id`."""
+    return f"/tmp/ovpn_{tunnel_id}.sock"
+
+
+class ManagementClient:
+    """
+    Follows every OpenVPN instance through its management interface.
+
+    Each instance is started with "--management <socket> unix". One asyncio loop
+    keeps a connection to all of those sockets, turns on real-time state
+    notifications and byte counts, and keeps a table per tunnel: state (CONNECTING,
+    CONNECTED, RECONNECTING, EXITING, ...), assigned tun IP, remote, reconnect count
+    and bytes in/out. Readiness, reconnects and traffic are pushed by OpenVPN, so
+    nothing is polled and no log is parsed.
+
+    `on_moved(tunnel_id, tun_ip)` is called (on the client's thread) when a tunnel
+    reconnects with a different address.
+    """
+
+    def __init__(self, bytecount_interval=MANAGEMENT_BYTECOUNT_INTERVAL, on_moved=None):
+        self.bytecount_interval = bytecount_interval
+        self.on_moved = on_moved
+        # tunnel_id -> status dict, guarded by _changed
+        self.tunnels = {}
+        self._changed = threading.Condition()
+        self._sessions = {}
+        self.loop = None
+
+    def start_in_thread(self):
+        """Run the client's event loop in a daemon thread."""
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self.loop.run_forever, name="openvpn-management", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """Stop the event loop; the OpenVPN instances are not affected."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def watch(self, tunnel_id, path=None):
+        """Start following the OpenVPN instance of `tunnel_id`, replacing an earlier session."""
+        tunnel_id = int(tunnel_id)
+        with self._changed:
+            self.tunnels[tunnel_id] = {
+                "state": None,
+                "description": None,
+                "tun_ip": None,
+                "remote": None,
+                "since": None,
+                "reconnects": 0,
+                "bytes_in": 0,
+                "bytes_out": 0,
+            }
+        self.loop.call_soon_threadsafe(self._open_session, tunnel_id, path or socket_path(tunnel_id))
+
+    def unwatch(self, tunnel_id):
+        """Stop following `tunnel_id`."""
+        tunnel_id = int(tunnel_id)
+        with self._changed:
+            self.tunnels.pop(tunnel_id, None)
+            self._changed.notify_all()
+        self.loop.call_soon_threadsafe(self._close_session, tunnel_id)
+
+    def status(self, tunnel_id):
+        """Return a copy of the status of `tunnel_id`, or None if it is not followed."""
+        with self._changed:
+            status = self.tunnels.get(int(tunnel_id))
+            return dict(status) if status is not None else None
+
+    def wait_connected(self, tunnel_id, timeout, is_alive=None, check_interval=0.5):
+        """
+        Block until OpenVPN reports the tunnel as CONNECTED.
+
+        Args:
+            tunnel_id (int): The followed tunnel.
+            timeout (float): Maximum number of seconds to wait.
+            is_alive (callable): Optional liveness check, consulted every `check_interval`
+                seconds, for processes that die before their management socket is up.
+
+        Returns:
+            str or None: The assigned tun IP, or None on timeout, exit or when not followed.
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                status = self.tunnels.get(int(tunnel_id))
+                if status is None or status["state"] == "EXITING":
+                    return None
+                if status["state"] == "CONNECTED" and status["tun_ip"]:
+                    return status["tun_ip"]
+                if is_alive is not None and not is_alive():
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._changed.wait(min(remaining, check_interval))
+
+    # ---------- Sessions (run on the client's loop) ----------
+
+    def _open_session(self, tunnel_id, path):
+        self._close_session(tunnel_id)
+        self._sessions[tunnel_id] = self.loop.create_task(self._session(tunnel_id, path))
+
+    def _close_session(self, tunnel_id):
+        task = self._sessions.pop(tunnel_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def _session(self, tunnel_id, path):
+        """Stay connected to one management socket, reconnecting after OpenVPN restarts."""
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(path)
+            except OSError:
+                # Not created yet, or OpenVPN is down (a supervised one comes back)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+            delay = RECONNECT_DELAY
+            try:
+                # The state history replays everything since OpenVPN started
+                previous = (self.status(tunnel_id) or {}).get("tun_ip")
+                self._update(tunnel_id, reconnects=0)
+                writer.write(f"state on all\nbytecount {self.bytecount_interval}\n".encode())
+                await writer.drain()
+                replaying = True
+                while line := await reader.readline():
+                    line = line.decode(errors="replace").rstrip("\r\n")
+                    if replaying and line == "END":
+                        replaying = False
+                        # A restarted OpenVPN may have come back with another address
+                        self._check_moved(tunnel_id, previous)
+                        continue
+                    self._handle(tunnel_id, line, replaying)
+            except OSError:
+                pass
+            finally:
+                writer.close()
+            # The socket only closes when OpenVPN exits
+            self._update(tunnel_id, state="EXITING")
+
+    def _handle(self, tunnel_id, line, replaying):
+        match = STATE_LINE.match(line)
+        if match:
+            since, state, description, tun_ip, remote, remote_port = match.groups()
+            previous = (self.status(tunnel_id) or {}).get("tun_ip")
+            changes = {"state": state, "description": description, "since": int(since)}
+            if state == "CONNECTED":
+                changes["tun_ip"] = tun_ip or None
+                changes["remote"] = f"{remote}:{remote_port}" if remote_port else remote or None
+            self._update(tunnel_id, reconnected=state == "RECONNECTING", **changes)
+            if not replaying:
+                self._check_moved(tunnel_id, previous)
+            return
+        match = BYTECOUNT_LINE.match(line)
+        if match:
+            self._update(tunnel_id, bytes_in=int(match.group(1)), bytes_out=int(match.group(2)))
+
+    def _check_moved(self, tunnel_id, previous):
+        status = self.status(tunnel_id)
+        if status is None or status["state"] != "CONNECTED" or not previous:
+            return
+        if status["tun_ip"] and status["tun_ip"] != previous and self.on_moved is not None:
+            self.on_moved(tunnel_id, status["tun_ip"])
+
+    def _update(self, tunnel_id, reconnected=False, **changes):
+        with self._changed:
+            status = self.tunnels.get(tunnel_id)
+            if status is not None:
+                status.update(changes)
+                status["reconnects"] += reconnected
+                self._changed.notify_all()
@@ -1,12 +1,29 @@
 import contextlib
 import os
 import re
-import signal
 import subprocess
 import time
 from pathlib import Path
 
-from core.config import CONFIG_DIR, OPENVPN_PASS, OPENVPN_USER
+from core.cgroup import CgroupManager, enter_command
+from core.config import (
+    CGROUPS,
+    CONFIG_DIR,
+    CONFIG_SELECTION,
+    OPENVPN_PASS,
+    OPENVPN_USER,
+    ROUTING_BACKEND,
+    TUN_READY_TIMEOUT,
+)
+from core.process import terminate
+from core.procfs import read_pid_file
+
+from . import netlink
+from .catalog import ConfigCatalog
+from .management import socket_path
+from .prober import LatencyProber
+from .routing import IPRouteBackend, get_routing_backend
+from .shaping import TrafficShaper
 
 
 class VPNManager:
@@ -14,8 +31,25 @@ class VPNManager:
     Handles OpenVPN process management and routing configuration.
     """
 
-    def __init__(self, config_dir=CONFIG_DIR):
+    def __init__(self, config_dir=CONFIG_DIR, routing_backend=ROUTING_BACKEND, selection=CONFIG_SELECTION):
         self.config_dir = config_dir
+        self.catalog = ConfigCatalog(config_dir)
+        self.prober = LatencyProber(self.catalog)
+        self.selection = selection
+        self.routing = get_routing_backend(routing_backend)
+        self.fallback_routing = IPRouteBackend()
+        # Optional Supervisor running OpenVPN in the foreground (set up by the API)
+        self.supervisor = None
+        # Optional ManagementClient following OpenVPN's management sockets (set up by the API)
+        self.management = None
+        # Per-instance cgroups of OpenVPN and per-port 3proxy (None if disabled)
+        self.cgroups = CgroupManager() if CGROUPS else None
+        self.shaper = TrafficShaper()
+
+    def cgroup_path(self, tunnel_id):
+        """Return the existing cgroup of a tunnel, or None."""
+        path = self.cgroups.path(tunnel_id) if self.cgroups is not None else None
+        return path if path is not None and path.is_dir() else None
 
     def get_tun_ip(self, interface):
         """
@@ -27,6 +61,12 @@ class VPNManager:
         Returns:
             str or None: The IP address if found.
         """
+        try:
+            return netlink.get_ipv4_addresses().get(interface)
+        except (OSError, AttributeError):
+            # No rtnetlink available (non-Linux host or restricted sandbox)
+            pass
+
         try:
             output = subprocess.check_output(["ip", "addr", "show", interface], stderr=subprocess.STDOUT).decode()
             match = re.search(r"inet (\d+\.\d+\.\d+\.\d+)", output)
@@ -36,53 +76,118 @@ class VPNManager:
             pass
         return None
 
+    def wait_for_tun_ip(self, interface, timeout=TUN_READY_TIMEOUT, is_alive=None):
+        """
+        Wait until a TUN interface gets its IPv4 address.
+
+        Listens for kernel link/address events over netlink and returns as soon as the
+        address shows up. Falls back to polling `get_tun_ip` once a second when
+        netlink cannot be used.
+
+        Args:
+            interface (str): The name of the TUN interface.
+            timeout (float): Maximum number of seconds to wait.
+            is_alive (callable): Optional check; waiting stops early once it returns False.
+
+        Returns:
+            str or None: The IP address, or None on timeout or if the process died.
+        """
+        try:
+            return netlink.wait_for_ipv4(interface, timeout, is_alive)
+        except (OSError, AttributeError):
+            pass
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if is_alive is not None and not is_alive():
+                return None
+            tun_ip = self.get_tun_ip(interface)
+            if tun_ip:
+                return tun_ip
+            time.sleep(1)
+        return None
+
+    def wait_for_tunnel(self, tunnel_id, interface, timeout=TUN_READY_TIMEOUT, is_alive=None):
+        """
+        Wait until a tunnel is connected and return its tun IP.
+
+        Followed tunnels are ready once OpenVPN pushes its CONNECTED state over the
+        management socket, which also reports a failed start (EXITING) right away;
+        others fall back to wait_for_tun_ip.
+
+        Returns:
+            str or None: The IP address, or None on timeout or if OpenVPN exited.
+        """
+        if self.management is not None and self.management.status(tunnel_id) is not None:
+            return self.management.wait_connected(tunnel_id, timeout, is_alive)
+        return self.wait_for_tun_ip(interface, timeout, is_alive)
+
     def list_countries(self):
         """
         Return a list of available countries.
         """
-        config_dir = Path(self.config_dir)
-        if not config_dir.exists():
-            return []
-        return sorted([d.name for d in config_dir.iterdir() if d.is_dir()])
+        return self.catalog.countries()
 
     def list_configs(self, country=None):
         """
         Get available VPN configurations.
         """
-        config_dir = Path(self.config_dir)
-        if not config_dir.exists():
-            return {}
+        return self.catalog.configs(country)
+
+    def pick_config(self, country, exclude=()):
+        """
+        Choose a config of `country` automatically.
+
+        With the "fastest" selection the config with the lowest measured latency
+        wins, otherwise the first one in catalog order.
 
-        result = {}
-        if country:
-            country_path = config_dir / country
-            if country_path.exists():
-                result[country] = sorted([f.name for f in country_path.iterdir() if f.name.endswith(".ovpn")])
+        Args:
+            country (str): Country folder name.
+            exclude (set): Config names to avoid, e.g. those already in use, with or
+                without the .ovpn suffix.
+
+        Returns:
+            str or None: A config not in `exclude` (or any config if all are excluded),
+            None if the country has no configs.
+        """
+        if self.selection == "fastest":
+            configs = self.prober.fastest(country)
         else:
-            countries = self.list_countries()
-            for c in countries:
-                configs = sorted([f.name for f in (config_dir / c).iterdir() if f.name.endswith(".ovpn")])
-                result[c] = configs
-        return result
+            configs = self.list_configs(country).get(country, [])
+        # State entries keep the name as it was given, catalog names end in .ovpn
+        exclude = {str(c).removesuffix(".ovpn") for c in exclude if c}
+        free = [c for c in configs if c.removesuffix(".ovpn") not in exclude]
+        return (free or configs or [None])[0]
 
-    def setup_vpn_process(self, country, config_name, port, tun_interface):
+    def resolve_config(self, country, config_name):
         """
-        Start the OpenVPN process.
+        Return the catalog entry of a config, rescanning once if it is not known yet.
+
+        Raises:
+            FileNotFoundError: If the config does not exist.
         """
-        config_path = Path(self.config_dir) / country / config_name
-        if not config_name.endswith(".ovpn") and not config_path.exists():
-            config_path = Path(f"{config_path}.ovpn")
+        entry = self.catalog.get(country, config_name)
+        if entry is None:
+            self.catalog.refresh(force=True)
+            entry = self.catalog.get(country, config_name)
+        if entry is None:
+            raise FileNotFoundError(f"Config not found: {Path(self.config_dir) / country / config_name}")
+        return entry
 
-        if not config_path.exists():
-            raise FileNotFoundError(f"Config not found: {config_path}")
+    def setup_vpn_process(self, country, config_name, port, tun_interface, cgroup=None):
+        """
+        Start the OpenVPN process, inside `cgroup` if given (see core.cgroup).
+        """
+        config = self.resolve_config(country, config_name)
 
         ovpn_pid_file = f"/tmp/ovpn_{port}.pid"
         ovpn_log_file = f"/tmp/ovpn_{port}.log"
         ovpn_auth_file = f"/tmp/ovpn_auth_{port}.tmp"
         temp_ovpn_cfg = f"/tmp/ovpn_cfg_{port}.ovpn"
+        management_socket = socket_path(port)
 
         # Cleanup old files
-        for f_path in [ovpn_log_file, ovpn_auth_file]:
+        for f_path in [ovpn_log_file, f"{ovpn_log_file}.1", ovpn_auth_file, management_socket]:
             f = Path(f_path)
             if f.exists():
                 with contextlib.suppress(Exception):
@@ -97,18 +202,12 @@ class VPNManager:
         except Exception as e:
             raise RuntimeError(f"Failed to create temp auth file: {e}") from e
 
-        # Prepare temp config
+        # Prepare temp config from the already sanitized catalog copy
         try:
-            temp_cfg = Path(temp_ovpn_cfg)
-            with config_path.open() as f_in, temp_cfg.open("w") as f_out:
-                for line in f_in:
-                    if re.match(r"^\s*(up|down|script-security)\s+", line):
-                        f_out.write(f"# {line}")
-                    else:
-                        f_out.write(line)
-            config_to_use = str(temp_cfg)
+            Path(temp_ovpn_cfg).write_text(config["sanitized"])
+            config_to_use = temp_ovpn_cfg
         except Exception:
-            config_to_use = str(config_path)
+            config_to_use = config["path"]
 
         ovpn_cmd = [
             "openvpn",
@@ -119,13 +218,20 @@ class VPNManager:
             "--dev",
             tun_interface,
             "--route-nopull",
-            "--daemon",
             "--writepid",
             ovpn_pid_file,
-            "--log",
+            # Appending lets the log be rotated by copy and truncate while OpenVPN runs
+            "--log-append",
             ovpn_log_file,
         ]
 
+        if self.management is not None:
+            # State changes, the assigned IP and byte counts are pushed over this socket
+            ovpn_cmd += ["--management", management_socket, "unix"]
+
+        if self.supervisor is None:
+            ovpn_cmd.append("--daemon")
+
         # Check OpenVPN version for DCO support
         try:
             version_out = subprocess.check_output(["openvpn", "--version"], text=True).splitlines()[0]
@@ -134,6 +240,21 @@ class VPNManager:
         except Exception:
             pass
 
+        ovpn_cmd = enter_command(cgroup, ovpn_cmd)
+
+        if self.management is not None:
+            self.management.watch(port, management_socket)
+
+        if self.supervisor is not None:
+            # Runs in the foreground; a failing start shows up as an exited child
+            try:
+                self.supervisor.spawn(("openvpn", port), ovpn_cmd)
+            except OSError as e:
+                with Path(ovpn_log_file).open("a") as f:
+                    f.write(f"\nStartup Error: {e}\n")
+                return 1, ovpn_log_file, temp_ovpn_cfg
+            return 0, ovpn_log_file, temp_ovpn_cfg
+
         result = subprocess.run(ovpn_cmd, capture_output=True, text=True)
         if result.returncode != 0 and result.stderr:
             with Path(ovpn_log_file).open("a") as f:
@@ -145,79 +266,126 @@ class VPNManager:
         """
         Setup IP rules and routing table for the proxy.
         """
-        port_str = str(port)
-        subprocess.run(["ip", "rule", "add", "from", tun_ip, "table", port_str])
-        subprocess.run(["ip", "route", "add", "default", "dev", tun_interface, "table", port_str])
+        try:
+            self.routing.setup(port, tun_ip, tun_interface)
+        except OSError:
+            self.fallback_routing.setup(port, tun_ip, tun_interface)
 
     def cleanup_routing(self, port, tun_ip=None):
         """
         Clean up IP rules and routing tables.
         """
-        port_str = str(port)
-        if tun_ip:
-            subprocess.run(["ip", "rule", "del", "from", tun_ip, "table", port_str], stderr=subprocess.DEVNULL)
+        try:
+            self.routing.cleanup(port, tun_ip)
+        except OSError:
+            self.fallback_routing.cleanup(port, tun_ip)
+
+    def cleanup_routing_many(self, ports):
+        """
+        Clean up IP rules and routing tables of several ports in one pass.
+        """
+        try:
+            self.routing.cleanup_many(ports)
+        except OSError:
+            self.fallback_routing.cleanup_many(ports)
 
-        subprocess.run(["ip", "route", "flush", "table", port_str], stderr=subprocess.DEVNULL)
+    def setup_routing_many(self, entries):
+        """
+        Set up routing for several (port, tun_ip, tun_interface) tuples in one pass.
+        """
+        try:
+            self.routing.setup_many(entries)
+        except OSError:
+            self.fallback_routing.setup_many(entries)
 
+    def list_routing_tables(self):
+        """
+        Return the routing tables with source rules or routes, see IPRouteBackend.list_tables.
+        """
         try:
-            rules = subprocess.check_output(["ip", "rule", "show"]).decode()
-            for line in rules.splitlines():
-                if f"lookup {port_str}" in line or f"table {port_str}" in line:
-                    rule_match = re.match(r"(\d+):\s+(.*)\s+(lookup|table)", line)
-                    if rule_match:
-                        rule_spec = rule_match.group(2).strip()
-                        subprocess.run(["ip", "rule", "del"] + rule_spec.split(), stderr=subprocess.DEVNULL)
-        except Exception:
+            return self.routing.list_tables()
+        except OSError:
+            return self.fallback_routing.list_tables()
+
+    def list_interfaces(self):
+        """
+        Return every network interface with its IPv4 address (or None), keyed by name.
+        """
+        try:
+            return netlink.get_interfaces()
+        except (OSError, AttributeError):
             pass
+        interfaces = {}
+        with contextlib.suppress(OSError):
+            interfaces = dict.fromkeys(os.listdir("/sys/class/net"))
+        with contextlib.suppress(Exception):
+            output = subprocess.check_output(["ip", "-4", "-o", "addr", "show"], text=True)
+            for match in re.finditer(r"^\d+:\s+(\S+)\s+inet (\d+\.\d+\.\d+\.\d+)", output, re.MULTILINE):
+                if interfaces.get(match.group(1)) is None:
+                    interfaces[match.group(1)] = match.group(2)
+        return interfaces
 
-    def stop_vpn_processes(self, port):
+    def delete_interfaces(self, names):
+        """
+        Delete several network interfaces, in one netlink batch where possible.
+        """
+        names = list(names)
+        if not names:
+            return
+        try:
+            netlink.delete_links(names)
+            return
+        except (OSError, AttributeError):
+            pass
+        for name in names:
+            subprocess.run(["ip", "link", "delete", name], stderr=subprocess.DEVNULL)
+
+    def stop_vpn_processes(self, port, proxy_port=None):
         """
         Stop OpenVPN and 3proxy processes for a specific port.
+
+        `proxy_port` names the 3proxy daemon when it differs from the tunnel's port
+        (tunnels taken over from the warm pool).
+        """
+        self.stop_vpn_processes_many([(port, proxy_port or port)])
+
+    def stop_vpn_processes_many(self, tunnels, deadline=None):
         """
-        pids_to_wait = []
-        for pid_file_path in [f"/tmp/ovpn_{port}.pid", f"/tmp/3proxy_{port}.pid"]:
-            pid_file = Path(pid_file_path)
-            if pid_file.exists():
-                try:
-                    with pid_file.open() as f:
-                        pid = int(f.read().strip())
-                        os.kill(pid, signal.SIGTERM)
-                        pids_to_wait.append((pid, pid_file))
-                except Exception:
-                    if pid_file.exists():
-                        pid_file.unlink()
-
-        # Wait for processes to exit
-        if pids_to_wait:
-            for _ in range(50):  # wait up to 5 seconds
-                still_running = []
-                for pid, pid_file in pids_to_wait:
-                    try:
-                        os.kill(pid, 0)
-                        still_running.append((pid, pid_file))
-                    except OSError:
-                        # Process is gone, cleanup pid file
-                        if pid_file.exists():
-                            pid_file.unlink()
-
-                if not still_running:
-                    break
-                pids_to_wait = still_running
-                time.sleep(0.1)
-            else:
-                # Force kill if still running after 5 seconds
-                for pid, pid_file in pids_to_wait:
-                    with contextlib.suppress(Exception):
-                        os.kill(pid, signal.SIGKILL)
-                    if pid_file.exists():
-                        pid_file.unlink()
-
-        # Cleanup tun interface
-        tun_interface = f"tun{port}"
-        subprocess.run(["ip", "link", "delete", tun_interface], stderr=subprocess.DEVNULL)
-
-        # Also cleanup temp auth file
-        auth_file = Path(f"/tmp/ovpn_auth_{port}.tmp")
-        if auth_file.exists():
-            with contextlib.suppress(Exception):
-                auth_file.unlink()
+        Stop the OpenVPN and 3proxy processes of several tunnels together.
+
+        Every process is signalled at once and waited for under one deadline (see
+        core.process.terminate); the tun interfaces are then deleted in one batch.
+
+        Args:
+            tunnels (list): (tunnel_id, proxy_port) tuples.
+            deadline (float): Optional time.monotonic() value to kill survivors at,
+                by default STOP_TIMEOUT seconds from now.
+        """
+        processes = {}
+        for tunnel_id, proxy_port in tunnels:
+            processes[("openvpn", tunnel_id)] = f"/tmp/ovpn_{tunnel_id}.pid"
+            processes[("3proxy", proxy_port)] = f"/tmp/3proxy_{proxy_port}.pid"
+        # Supervised children are taken out of supervision first so they are not restarted
+        supervised = self.supervisor.release(processes) if self.supervisor is not None else {}
+
+        pids = [*supervised.values()]
+        pids += [read_pid_file(pid_file) for name, pid_file in processes.items() if name not in supervised]
+
+        terminate([pid for pid in pids if pid is not None], deadline=deadline)
+        for pid_file in processes.values():
+            with contextlib.suppress(OSError):
+                Path(pid_file).unlink()
+
+        # Cleanup tun interfaces; most vanished together with their OpenVPN process
+        tun_interfaces = {f"tun{tunnel_id}" for tunnel_id, _ in tunnels}
+        self.delete_interfaces(sorted(tun_interfaces & set(self.list_interfaces())))
+        if self.cgroups is not None:
+            self.cgroups.remove_many(sorted({tunnel_id for tunnel_id, _ in tunnels}))
+
+        # Also cleanup temp auth files and management sockets
+        for tunnel_id, _ in tunnels:
+            if self.management is not None:
+                self.management.unwatch(tunnel_id)
+            for f_path in [f"/tmp/ovpn_auth_{tunnel_id}.tmp", socket_path(tunnel_id)]:
+                with contextlib.suppress(OSError):
+                    Path(f_path).unlink()
@@ -0,0 +1,345 @@
+import ipaddress
+import os
+import select
+import socket
+import struct
+import time
+
+# Netlink protocol constants (see linux/netlink.h and linux/rtnetlink.h)
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+NLM_F_DUMP = 0x300
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+RTM_NEWRULE = 32
+RTM_DELRULE = 33
+RTM_GETRULE = 34
+
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+
+IFLA_IFNAME = 3
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+
+RTA_OIF = 4
+RTA_TABLE = 15
+
+FRA_SRC = 2
+FRA_TABLE = 15
+
+RT_TABLE_UNSPEC = 0
+RTPROT_BOOT = 3
+RT_SCOPE_LINK = 253
+RTN_UNICAST = 1
+FR_ACT_TO_TBL = 1
+
+# Number of requests sent before their acknowledgements are collected
+BATCH_SIZE = 64
+
+NLMSG_HEADER = struct.Struct("=IHHII")
+RTATTR_HEADER = struct.Struct("=HH")
+IFADDRMSG = struct.Struct("=BBBBI")
+IFINFOMSG = struct.Struct("=BxHiII")
+# rtmsg and fib_rule_hdr share the same layout: 8 bytes followed by a u32
+RTMSG = struct.Struct("=BBBBBBBBI")
+FIB_RULE_HDR = struct.Struct("=BBBBBBBBI")
+
+
+class NetlinkError(OSError):
+    """Raised when the kernel answers a netlink request with an error."""
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def parse_attrs(data, offset=0):
+    """
+    Parse a sequence of rtattr structures.
+
+    Returns:
+        dict: Attribute type mapped to its raw payload (the last one wins).
+    """
+    attrs = {}
+    while offset + RTATTR_HEADER.size <= len(data):
+        length, attr_type = RTATTR_HEADER.unpack_from(data, offset)
+        if length < RTATTR_HEADER.size:
+            break
+        attrs[attr_type & 0x3FFF] = data[offset + RTATTR_HEADER.size : offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def pack_attr(attr_type, payload):
+    """Encode a single rtattr, padded to the netlink alignment."""
+    length = RTATTR_HEADER.size + len(payload)
+    return RTATTR_HEADER.pack(length, attr_type) + payload + b"\0" * (_align(length) - length)
+
+
+def _cstring(value):
+    return value.split(b"\0", 1)[0].decode()
+
+
+class NetlinkSocket:
+    """
+    A minimal rtnetlink socket.
+
+    Only the handful of message types needed by the manager are decoded; everything
+    else is handed back as raw payloads.
+    """
+
+    def __init__(self, groups=0):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW | socket.SOCK_CLOEXEC, NETLINK_ROUTE)
+        self.sock.bind((0, groups))
+        self.seq = int(time.time())
+        # Notifications received while waiting for a reply, kept for next_events()
+        self.pending = []
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, msg_type, flags, payload):
+        """Send one netlink message and return its sequence number."""
+        self.seq += 1
+        header = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload), msg_type, flags, self.seq, 0)
+        self.sock.send(header + payload)
+        return self.seq
+
+    def recv(self):
+        """
+        Read one datagram from the socket.
+
+        Returns:
+            list: (msg_type, flags, seq, payload) tuples contained in the datagram.
+        """
+        data = self.sock.recv(65536)
+        messages = []
+        offset = 0
+        while offset + NLMSG_HEADER.size <= len(data):
+            length, msg_type, flags, seq, _ = NLMSG_HEADER.unpack_from(data, offset)
+            if length < NLMSG_HEADER.size:
+                break
+            messages.append((msg_type, flags, seq, data[offset + NLMSG_HEADER.size : offset + length]))
+            offset += _align(length)
+        return messages
+
+    def next_events(self):
+        """Return queued notifications if there are any, otherwise read the socket."""
+        if self.pending:
+            events, self.pending = self.pending, []
+            return events
+        return self.recv()
+
+    def dump(self, msg_type, payload):
+        """Run a dump request and return the payloads of every reply message."""
+        seq = self.send(msg_type, NLM_F_REQUEST | NLM_F_DUMP, payload)
+        replies = []
+        while True:
+            for reply_type, reply_flags, reply_seq, reply in self.recv():
+                if reply_seq != seq:
+                    self.pending.append((reply_type, reply_flags, reply_seq, reply))
+                    continue
+                if reply_type == NLMSG_DONE:
+                    return replies
+                if reply_type == NLMSG_ERROR:
+                    check_error(reply)
+                    continue
+                replies.append((reply_type, reply))
+
+    def request_many(self, messages):
+        """
+        Send (msg_type, flags, payload) requests with NLM_F_ACK set and wait for every ack.
+
+        Requests are pipelined in chunks of BATCH_SIZE to keep the socket buffers small.
+
+        Returns:
+            list: The errno of each request in order, 0 on success.
+        """
+        errors = []
+        for start in range(0, len(messages), BATCH_SIZE):
+            chunk = messages[start : start + BATCH_SIZE]
+            seqs = {}
+            for i, (msg_type, flags, payload) in enumerate(chunk):
+                seqs[self.send(msg_type, flags | NLM_F_REQUEST | NLM_F_ACK, payload)] = i
+            chunk_errors = [0] * len(chunk)
+            while seqs:
+                for reply_type, reply_flags, reply_seq, reply in self.recv():
+                    if reply_seq not in seqs:
+                        self.pending.append((reply_type, reply_flags, reply_seq, reply))
+                        continue
+                    if reply_type == NLMSG_ERROR:
+                        (error,) = struct.unpack_from("=i", reply)
+                        chunk_errors[seqs.pop(reply_seq)] = -error
+            errors.extend(chunk_errors)
+        return errors
+
+
+def check_error(payload):
+    """Raise NetlinkError if an NLMSG_ERROR payload carries a non-zero errno."""
+    (error,) = struct.unpack_from("=i", payload)
+    if error:
+        raise NetlinkError(-error, os.strerror(-error))
+
+
+def parse_address(payload):
+    """
+    Decode an RTM_NEWADDR payload.
+
+    Returns:
+        tuple: (ifindex, label or None, IPv4 address or None).
+    """
+    family, _, _, _, index = IFADDRMSG.unpack_from(payload)
+    if family != socket.AF_INET:
+        return index, None, None
+    attrs = parse_attrs(payload, IFADDRMSG.size)
+    raw = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+    address = str(ipaddress.IPv4Address(raw)) if raw and len(raw) == 4 else None
+    label = _cstring(attrs[IFA_LABEL]) if IFA_LABEL in attrs else None
+    return index, label, address
+
+
+def parse_link(payload):
+    """
+    Decode an RTM_NEWLINK/RTM_DELLINK payload.
+
+    Returns:
+        tuple: (ifindex, interface name or None).
+    """
+    _, _, index, _, _ = IFINFOMSG.unpack_from(payload)
+    attrs = parse_attrs(payload, IFINFOMSG.size)
+    name = _cstring(attrs[IFLA_IFNAME]) if IFLA_IFNAME in attrs else None
+    return index, name
+
+
+def get_interfaces():
+    """
+    Return every interface with its first IPv4 address (None if it has none), keyed by name.
+    """
+    with NetlinkSocket() as nl:
+        names = {}
+        for _, payload in nl.dump(RTM_GETLINK, IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)):
+            index, name = parse_link(payload)
+            if name:
+                names[index] = name
+
+        interfaces = dict.fromkeys(names.values())
+        for _, payload in nl.dump(RTM_GETADDR, IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0)):
+            index, label, address = parse_address(payload)
+            name = names.get(index, label)
+            if name and address and interfaces.get(name) is None:
+                interfaces[name] = address
+        return interfaces
+
+
+def get_ipv4_addresses():
+    """
+    Return the first IPv4 address of every interface, keyed by interface name.
+    """
+    return {name: address for name, address in get_interfaces().items() if address}
+
+
+def delete_links(names):
+    """
+    Delete several network interfaces by name in one batch.
+
+    Returns:
+        list: The errno of each deletion in order, 0 on success.
+    """
+    messages = [
+        (RTM_DELLINK, 0, IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0) + pack_attr(IFLA_IFNAME, name.encode() + b"\0"))
+        for name in names
+    ]
+    with NetlinkSocket() as nl:
+        return nl.request_many(messages)
+
+
+def wait_for_ipv4(interface, timeout, is_alive=None, check_interval=0.5):
+    """
+    Block until `interface` gets an IPv4 address.
+
+    Subscribes to link and IPv4 address notifications before dumping the current
+    addresses, so an address assigned in between cannot be missed.
+
+    Args:
+        interface (str): The interface name, e.g. "tun8011".
+        timeout (float): Maximum number of seconds to wait.
+        is_alive (callable): Optional liveness check; waiting stops once it returns False.
+        check_interval (float): How often `is_alive` is consulted while no events arrive.
+
+    Returns:
+        str or None: The IPv4 address, or None on timeout or when the owner died.
+    """
+    deadline = time.monotonic() + timeout
+    with NetlinkSocket(RTMGRP_LINK | RTMGRP_IPV4_IFADDR) as nl:
+        ifindex = None
+        for _, payload in nl.dump(RTM_GETLINK, IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)):
+            index, name = parse_link(payload)
+            if name == interface:
+                ifindex = index
+        for _, payload in nl.dump(RTM_GETADDR, IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0)):
+            index, label, address = parse_address(payload)
+            if address and (index == ifindex or label == interface):
+                return address
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if not nl.pending:
+                readable, _, _ = select.select([nl], [], [], min(remaining, check_interval))
+                if not readable:
+                    if is_alive is not None and not is_alive():
+                        return None
+                    continue
+            for msg_type, _, _, payload in nl.next_events():
+                if msg_type == RTM_NEWLINK:
+                    index, name = parse_link(payload)
+                    if name == interface:
+                        ifindex = index
+                elif msg_type == RTM_DELLINK:
+                    index, _ = parse_link(payload)
+                    if index == ifindex:
+                        ifindex = None
+                elif msg_type == RTM_NEWADDR:
+                    index, label, address = parse_address(payload)
+                    if address and (index == ifindex or label == interface):
+                        return address
+
+
+def parse_table(header, payload, attr_offset):
+    """Return the routing table of a route or rule message (RTA_TABLE == FRA_TABLE)."""
+    attrs = parse_attrs(payload, attr_offset)
+    if RTA_TABLE in attrs:
+        return struct.unpack("=I", attrs[RTA_TABLE])[0]
+    return header[4]
+
+
+def table_id_field(table):
+    """The 8-bit table field of rtmsg/fib_rule_hdr; larger ids only travel as an attribute."""
+    return table if table < 256 else RT_TABLE_UNSPEC
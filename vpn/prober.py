@@ -0,0 +1,191 @@
+import asyncio
+import contextlib
+import itertools
+import os
+import socket
+import struct
+import threading
+import time
+
+from core.config import PROBE_CONCURRENCY, PROBE_TIMEOUT, PROBE_TTL
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+
+def icmp_checksum(data):
+    """Internet checksum (RFC 1071) of `data`."""
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _icmp_socket():
+    """
+    Open a non-blocking ICMP socket.
+
+    Unprivileged "ping" sockets (net.ipv4.ping_group_range) are preferred; raw
+    sockets need root. Returns (socket, is_raw), or (None, False) if neither works.
+    """
+    for kind in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+        try:
+            sock = socket.socket(socket.AF_INET, kind, socket.IPPROTO_ICMP)
+        except OSError:
+            continue
+        sock.setblocking(False)
+        return sock, kind == socket.SOCK_RAW
+    return None, False
+
+
+class LatencyProber:
+    """
+    Measures round-trip times to the servers of the VPN configs.
+
+    Every `remote` of a config is probed: TCP remotes by timing a TCP handshake,
+    UDP remotes with an ICMP echo (falling back to a TCP handshake on the same
+    port when ICMP sockets are unavailable or the echo gets no reply). A config's
+    latency is that of its fastest remote. Probes run concurrently on an asyncio
+    loop, each distinct server once, and results are cached for `ttl` seconds.
+    """
+
+    def __init__(self, catalog, ttl=PROBE_TTL, timeout=PROBE_TIMEOUT, concurrency=PROBE_CONCURRENCY):
+        self.catalog = catalog
+        self.ttl = ttl
+        self.timeout = timeout
+        self.concurrency = max(1, concurrency)
+        # (method, host, port) -> (rtt in ms or None, monotonic time of the measurement)
+        self.cache = {}
+        self._lock = threading.Lock()
+        # One probe run per country at a time; concurrent callers wait for its results
+        self._country_locks = {}
+        self._ids = itertools.count(os.getpid() & 0xFFFF)
+
+    def latencies(self, country, force=False):
+        """
+        Return the latency of every config of `country`.
+
+        Returns:
+            dict: Config name mapped to its round-trip time in milliseconds,
+            or None if none of its servers answered.
+        """
+        with self._lock:
+            country_lock = self._country_locks.setdefault(country, threading.Lock())
+        with country_lock:
+            configs = self.catalog.metadata(country)
+            targets = {self._target(remote) for info in configs for remote in info["remotes"]}
+            now = time.monotonic()
+            stale = [t for t in targets if force or now - self.cache.get(t, (None, -self.ttl))[1] >= self.ttl]
+            if stale:
+                self._store(self._run(self._probe_all(stale)))
+
+        return {
+            info["name"]: min(
+                (rtt for rtt in (self.cache.get(self._target(r), (None, 0))[0] for r in info["remotes"]) if rtt),
+                default=None,
+            )
+            for info in configs
+        }
+
+    def fastest(self, country, exclude=()):
+        """
+        Return the configs of `country` not in `exclude`, fastest first.
+
+        Configs whose servers did not answer come last, in catalog order.
+        """
+        latencies = self.latencies(country)
+        candidates = [name for name in latencies if name not in exclude]
+        return sorted(candidates, key=lambda name: (latencies[name] is None, latencies[name] or 0))
+
+    @staticmethod
+    def _target(remote):
+        if remote["proto"].startswith("tcp"):
+            return ("tcp", remote["host"], remote["port"])
+        return ("icmp", remote["host"], remote["port"])
+
+    def _store(self, results):
+        now = time.monotonic()
+        with self._lock:
+            self.cache.update({target: (rtt, now) for target, rtt in results.items()})
+
+    @staticmethod
+    def _run(coro):
+        """Run `coro` on a fresh event loop, also when called from a thread with a running loop."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coro)
+        result = {}
+        thread = threading.Thread(target=lambda: result.update(asyncio.run(coro)))
+        thread.start()
+        thread.join()
+        return result
+
+    async def _probe_all(self, targets):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def probe(target):
+            async with semaphore:
+                method, host, port = target
+                if method == "icmp":
+                    # Hosts that drop pings may still answer on the port
+                    with contextlib.suppress(OSError, TimeoutError):
+                        rtt = await asyncio.wait_for(self._icmp_rtt(host), self.timeout)
+                        if rtt is not None:
+                            return rtt
+                try:
+                    return await asyncio.wait_for(self._tcp_rtt(host, port), self.timeout)
+                except (OSError, TimeoutError):
+                    return None
+
+        rtts = await asyncio.gather(*(probe(t) for t in targets))
+        return dict(zip(targets, rtts, strict=True))
+
+    async def _tcp_rtt(self, host, port):
+        started = time.perf_counter()
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+        except ConnectionRefusedError:
+            # A RST takes one round trip as well
+            return (time.perf_counter() - started) * 1000
+        rtt = (time.perf_counter() - started) * 1000
+        writer.close()
+        with contextlib.suppress(OSError):
+            await writer.wait_closed()
+        return rtt
+
+    async def _icmp_rtt(self, host):
+        """
+        Time one ICMP echo to `host`.
+
+        Returns:
+            float or None: The round-trip time in ms, None if no ICMP socket can be opened.
+        """
+        sock, raw = _icmp_socket()
+        if sock is None:
+            return None
+        loop = asyncio.get_running_loop()
+        with sock:
+            infos = await loop.getaddrinfo(host, None, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+            address = infos[0][4][0]
+            ident = next(self._ids) & 0xFFFF
+            payload = struct.pack("!d", time.time())
+            header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ident, 1)
+            checksum = icmp_checksum(header + payload)
+            packet = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum, ident, 1) + payload
+
+            started = time.perf_counter()
+            await loop.sock_sendto(sock, packet, (address, 0))
+            while True:
+                data, (source, _) = await loop.sock_recvfrom(sock, 2048)
+                if raw:
+                    # Raw sockets see every ICMP packet, IP header included
+                    data = data[(data[0] & 0x0F) * 4 :]
+                if source != address or len(data) < 8:
+                    continue
+                kind, _, _, reply_ident, _ = struct.unpack("!BBHHH", data[:8])
+                # Ping sockets replace the identifier with their own, so only raw ones check it
+                if kind == ICMP_ECHO_REPLY and (not raw or reply_ident == ident):
+                    return (time.perf_counter() - started) * 1000
@@ -0,0 +1,211 @@
+import errno
+import ipaddress
+import re
+import socket
+import struct
+import subprocess
+
+from . import netlink
+
+
+class IPRouteBackend:
+    """
+    Policy routing through the `ip` command line tool.
+
+    Every operation forks `ip`; kept as the fallback when netlink is not usable.
+    """
+
+    name = "ip"
+
+    def setup(self, port, tun_ip, tun_interface):
+        """
+        Add the source rule and the default route of a proxy's routing table.
+
+        Safe to repeat, e.g. after a netlink batch that failed halfway: `ip rule add`
+        does not refuse duplicates, so an existing rule is deleted first.
+        """
+        port_str = str(port)
+        subprocess.run(["ip", "rule", "del", "from", tun_ip, "table", port_str], stderr=subprocess.DEVNULL)
+        subprocess.run(["ip", "rule", "add", "from", tun_ip, "table", port_str])
+        subprocess.run(["ip", "route", "replace", "default", "dev", tun_interface, "table", port_str])
+
+    def cleanup(self, port, tun_ip=None):
+        """Remove every rule pointing at the proxy's table and flush the table."""
+        port_str = str(port)
+        if tun_ip:
+            subprocess.run(["ip", "rule", "del", "from", tun_ip, "table", port_str], stderr=subprocess.DEVNULL)
+
+        subprocess.run(["ip", "route", "flush", "table", port_str], stderr=subprocess.DEVNULL)
+
+        try:
+            rules = subprocess.check_output(["ip", "rule", "show"]).decode()
+            for line in rules.splitlines():
+                if f"lookup {port_str}" in line or f"table {port_str}" in line:
+                    rule_match = re.match(r"(\d+):\s+(.*)\s+(lookup|table)", line)
+                    if rule_match:
+                        rule_spec = rule_match.group(2).strip()
+                        subprocess.run(["ip", "rule", "del"] + rule_spec.split(), stderr=subprocess.DEVNULL)
+        except Exception:
+            pass
+
+    def setup_many(self, entries):
+        """Set up routing for (port, tun_ip, tun_interface) tuples."""
+        for port, tun_ip, tun_interface in entries:
+            self.setup(port, tun_ip, tun_interface)
+
+    def cleanup_many(self, ports):
+        """Clean up routing for several ports."""
+        for port in ports:
+            self.cleanup(port)
+
+    def list_tables(self):
+        """
+        Return the routing tables that have source rules or IPv4 routes.
+
+        Returns:
+            dict: Table id mapped to {'sources': rule source IPs, 'routes': route count}.
+        """
+        tables = {}
+        rules = subprocess.check_output(["ip", "-4", "rule", "show"], text=True)
+        for match in re.finditer(r"from (\d+\.\d+\.\d+\.\d+)(?:/32)? lookup (\d+)", rules):
+            tables.setdefault(int(match.group(2)), {"sources": [], "routes": 0})["sources"].append(match.group(1))
+        routes = subprocess.check_output(["ip", "-4", "route", "show", "table", "all"], text=True)
+        for match in re.finditer(r"\btable (\d+)\b", routes):
+            tables.setdefault(int(match.group(1)), {"sources": [], "routes": 0})["routes"] += 1
+        return tables
+
+
+class NetlinkRouteBackend:
+    """
+    Policy routing over an in-process rtnetlink socket.
+
+    Rules and routes are added and removed without forking. Bulk operations dump
+    the rule and route lists once and send all changes as one pipelined batch.
+    """
+
+    name = "netlink"
+
+    def setup(self, port, tun_ip, tun_interface):
+        """Add the source rule and the default route of a proxy's routing table."""
+        self.setup_many([(port, tun_ip, tun_interface)])
+
+    def cleanup(self, port, tun_ip=None):
+        """Remove every rule pointing at the proxy's table and flush the table."""
+        self.cleanup_many([port])
+
+    def setup_many(self, entries):
+        """
+        Set up routing for (port, tun_ip, tun_interface) tuples in one batch.
+
+        Raises:
+            NetlinkError: If the kernel rejects a rule or route (existing entries are ignored).
+        """
+        messages = []
+        for port, tun_ip, tun_interface in entries:
+            table = int(port)
+            ifindex = socket.if_nametoindex(tun_interface)
+            messages.append(
+                (
+                    netlink.RTM_NEWRULE,
+                    netlink.NLM_F_CREATE | netlink.NLM_F_EXCL,
+                    netlink.FIB_RULE_HDR.pack(
+                        socket.AF_INET, 0, 32, 0, netlink.table_id_field(table), 0, 0, netlink.FR_ACT_TO_TBL, 0
+                    )
+                    + netlink.pack_attr(netlink.FRA_SRC, ipaddress.IPv4Address(tun_ip).packed)
+                    + netlink.pack_attr(netlink.FRA_TABLE, struct.pack("=I", table)),
+                )
+            )
+            messages.append(
+                (
+                    netlink.RTM_NEWROUTE,
+                    netlink.NLM_F_CREATE | netlink.NLM_F_EXCL,
+                    netlink.RTMSG.pack(
+                        socket.AF_INET,
+                        0,
+                        0,
+                        0,
+                        netlink.table_id_field(table),
+                        netlink.RTPROT_BOOT,
+                        netlink.RT_SCOPE_LINK,
+                        netlink.RTN_UNICAST,
+                        0,
+                    )
+                    + netlink.pack_attr(netlink.RTA_OIF, struct.pack("=I", ifindex))
+                    + netlink.pack_attr(netlink.RTA_TABLE, struct.pack("=I", table)),
+                )
+            )
+
+        with netlink.NetlinkSocket() as nl:
+            errors = nl.request_many(messages)
+        for error in errors:
+            if error and error != errno.EEXIST:
+                raise netlink.NetlinkError(error, f"Failed to set up routing: {errno.errorcode.get(error, error)}")
+
+    def cleanup_many(self, ports):
+        """
+        Remove the rules and routes of all given ports' tables.
+
+        The rule and route lists are dumped once, whatever the number of ports.
+        """
+        tables = {int(port) for port in ports}
+        if not tables:
+            return
+
+        with netlink.NetlinkSocket() as nl:
+            messages = []
+            empty_rule = netlink.FIB_RULE_HDR.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0)
+            for _, payload in nl.dump(netlink.RTM_GETRULE, empty_rule):
+                header = netlink.FIB_RULE_HDR.unpack_from(payload)
+                if netlink.parse_table(header, payload, netlink.FIB_RULE_HDR.size) in tables:
+                    messages.append((netlink.RTM_DELRULE, 0, payload))
+
+            empty_route = netlink.RTMSG.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0)
+            for _, payload in nl.dump(netlink.RTM_GETROUTE, empty_route):
+                header = netlink.RTMSG.unpack_from(payload)
+                if netlink.parse_table(header, payload, netlink.RTMSG.size) in tables:
+                    messages.append((netlink.RTM_DELROUTE, 0, payload))
+
+            # Entries that vanished in the meantime are not an error
+            nl.request_many(messages)
+
+    def list_tables(self):
+        """
+        Return the routing tables that have source rules or IPv4 routes.
+
+        Returns:
+            dict: Table id mapped to {'sources': rule source IPs, 'routes': route count}.
+        """
+        tables = {}
+        with netlink.NetlinkSocket() as nl:
+            empty_rule = netlink.FIB_RULE_HDR.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0)
+            for _, payload in nl.dump(netlink.RTM_GETRULE, empty_rule):
+                header = netlink.FIB_RULE_HDR.unpack_from(payload)
+                source = netlink.parse_attrs(payload, netlink.FIB_RULE_HDR.size).get(netlink.FRA_SRC)
+                if header[2] == 32 and source and len(source) == 4:
+                    table = netlink.parse_table(header, payload, netlink.FIB_RULE_HDR.size)
+                    entry = tables.setdefault(table, {"sources": [], "routes": 0})
+                    entry["sources"].append(str(ipaddress.IPv4Address(source)))
+
+            empty_route = netlink.RTMSG.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0)
+            for _, payload in nl.dump(netlink.RTM_GETROUTE, empty_route):
+                header = netlink.RTMSG.unpack_from(payload)
+                table = netlink.parse_table(header, payload, netlink.RTMSG.size)
+                tables.setdefault(table, {"sources": [], "routes": 0})["routes"] += 1
+        return tables
+
+
+def get_routing_backend(name="auto"):
+    """
+    Return the routing backend for `name` ("netlink", "ip" or "auto").
+
+    "auto" picks netlink whenever an rtnetlink socket can be opened.
+    """
+    if name == "ip":
+        return IPRouteBackend()
+    if name == "netlink":
+        return NetlinkRouteBackend()
+    try:
+        netlink.NetlinkSocket().close()
+    except (OSError, AttributeError):
+        return IPRouteBackend()
+    return NetlinkRouteBackend()
@@ -0,0 +1,79 @@
+import subprocess
+
+from core.config import QUOTA_THROTTLE_KBPS
+
+# Queueing delay the upload shaper allows before it drops packets
+SHAPER_LATENCY_MS = 50
+# Smallest bucket; a bucket must hold at least one full packet at any rate
+MIN_BURST_BYTES = 16 * 1024
+
+
+def burst_bytes(kbps):
+    """Return the token bucket size for a rate: 100 ms worth of traffic, at least MIN_BURST_BYTES."""
+    return max(kbps * 1000 // 8 // 10, MIN_BURST_BYTES)
+
+
+def traffic_rates(traffic, throttled=False):
+    """
+    Return the (download, upload) rates in kbit/s to apply for traffic limits.
+
+    Args:
+        traffic (dict): 'download_kbps' and 'upload_kbps' (None = unlimited).
+        throttled (bool): Whether the quota is used up; both directions are then
+            capped at QUOTA_THROTTLE_KBPS.
+    """
+    rates = [(traffic or {}).get("download_kbps"), (traffic or {}).get("upload_kbps")]
+    if throttled:
+        rates = [min(rate or QUOTA_THROTTLE_KBPS, QUOTA_THROTTLE_KBPS) for rate in rates]
+    return tuple(rates)
+
+
+class TrafficShaper:
+    """
+    Rate-limits tun interfaces with `tc`.
+
+    Downloads arrive on the tun interface from OpenVPN and are policed at its
+    ingress (excess packets are dropped, so TCP backs off); uploads leave through
+    it and are queued by a token bucket filter. Shaping the tunnel covers every
+    proxy mode alike and vanishes with the interface.
+    """
+
+    def apply(self, interface, download_kbps=None, upload_kbps=None):
+        """
+        Replace the rate limits of `interface`; None lifts the limit of a direction.
+
+        Raises:
+            RuntimeError: If tc is missing or rejects the change.
+        """
+        self._batch([f"qdisc del dev {interface} root", f"qdisc del dev {interface} ingress"], check=False)
+        commands = []
+        if upload_kbps:
+            commands.append(
+                f"qdisc add dev {interface} root tbf rate {upload_kbps}kbit "
+                f"burst {burst_bytes(upload_kbps)} latency {SHAPER_LATENCY_MS}ms"
+            )
+        if download_kbps:
+            commands += [
+                f"qdisc add dev {interface} handle ffff: ingress",
+                f"filter add dev {interface} parent ffff: protocol all prio 1 u32 match u32 0 0 "
+                f"police rate {download_kbps}kbit burst {burst_bytes(download_kbps)} conform-exceed drop",
+            ]
+        if commands:
+            self._batch(commands)
+
+    def clear(self, interface):
+        """Remove every rate limit of `interface`."""
+        self.apply(interface)
+
+    @staticmethod
+    def _batch(commands, check=True):
+        try:
+            result = subprocess.run(
+                ["tc", "-force", "-batch", "-"], input="\n".join(commands) + "\n", capture_output=True, text=True
+            )
+        except OSError as e:
+            if check:
+                raise RuntimeError(f"tc is not available: {e}") from e
+            return
+        if check and result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or f"tc exited with {result.returncode}")